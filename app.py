@@ -6,19 +6,125 @@ Date: 05/2019
 """
 
 # Import packages
-from flask import Flask, render_template, request, session, redirect
+from flask import Flask, render_template, request, session, redirect, \
+    jsonify, Response, g, before_render_template, template_rendered, \
+    stream_template, stream_with_context
+import contextvars
+import json
+import time as timer
+import batch_logic
+import compression
+import config
+import deadline
+import http_cache
+import metrics
+import sweep_logic
 import travel_logic
 import weather_logic
 import validate
 import datetime as dt
-import random
-import string
+import secrets
+import session_store
 import utils
 
+
 app = Flask(__name__)
-# Session key
-app.secret_key = "".join(random.SystemRandom().choice(
-    string.ascii_uppercase + string.digits) for i in range(6))
+# Session key - signs the session ID cookie. Must be the same for every
+# worker, so set SECRET_KEY when running more than one
+app.secret_key = config.secret_key or secrets.token_hex(32)
+# Session data is kept server-side, shared by every worker
+app.session_interface = session_store.ServerSideSessionInterface(
+    session_store.get_store(config.session_backend), config.session_ttl)
+# Static assets are served from precompressed copies when accepted
+if config.precompress_static:
+    try:
+        compression.precompress(app.static_folder)
+    except OSError:
+        pass  # Read-only static folder - the assets are sent uncompressed
+app.view_functions["static"] = lambda filename: compression.send_static(
+    app.static_folder, filename)
+# Renders templates that await, for the coroutine views (see asgi.py)
+async_jinja_env = app.jinja_env.overlay(enable_async=True)
+
+
+# Start of the template render in progress. Kept per context, as coroutines
+# sharing a thread render at once
+_render_start = contextvars.ContextVar("render_start", default=None)
+
+
+@app.before_request
+def start_timer():
+    """
+    Record when the request started, to measure its duration, and start its
+        deadline budget for upstream calls
+    """
+    g.start_time = timer.perf_counter()
+    deadline.start(config.request_deadline)
+
+
+@app.teardown_request
+def clear_deadline(error):
+    """
+    Remove the deadline budget of the finished request from the thread
+    :param error: The unhandled exception, if any
+    """
+    deadline.clear()
+
+
+@app.after_request
+def record_duration(response):
+    """
+    Record the duration of the request by endpoint. A streamed response is
+        measured until it has been sent
+    :param response: The response
+    :return: The unchanged response
+    """
+    if "start_time" in g:
+        start_time = g.start_time
+        labels = {"endpoint": request.endpoint or "unmatched",
+                  "method": request.method, "status": response.status_code}
+
+        def observe():
+            metrics.request_latency.observe(
+                timer.perf_counter() - start_time, **labels)
+        if response.is_streamed:
+            response.call_on_close(observe)
+        else:
+            observe()
+    return response
+
+
+@app.after_request
+def compress(response):
+    """
+    Compress the response if the client accepts it
+    :param response: The response
+    :return: The (possibly) compressed response
+    """
+    return compression.compress_response(response)
+
+
+def _render_started(sender, template, context, **extra):
+    """
+    Record when a template render started, and count rendered error messages
+    """
+    _render_start.set(timer.perf_counter())
+    if context.get("flag") is True or context.get("error_message"):
+        metrics.error_messages.inc(template=template.name)
+
+
+def _render_finished(sender, template, context, **extra):
+    """
+    Record the duration of a template render
+    """
+    start_time = _render_start.get()
+    if start_time is not None:
+        metrics.render_latency.observe(timer.perf_counter() - start_time,
+                                       template=template.name)
+
+
+before_render_template.connect(_render_started, app)
+template_rendered.connect(_render_finished, app)
 
 
 @app.route("/")
@@ -28,7 +134,82 @@ def home_page():
     Home page
     :return: A render of the home page
     """
-    return render_template("home.html")
+    return http_cache.render_static("home.html", config.static_page_max_age)
+
+
+def _submit_route_options(postcodes_valid):
+    """
+    Validate the rest of the submitted route options form and assign it to
+        session keys
+    :param postcodes_valid: Result of validate.are_valid_postcodes for the
+                            'FROM' and 'TO' postcodes
+    :return: If invalid form input, return the same page with an appropriate
+        error message. If the form validates, redirect to route-results
+    """
+    if isinstance(postcodes_valid, tuple):
+        start_postcode_valid = end_postcode_valid = postcodes_valid
+    else:
+        start_postcode_valid, end_postcode_valid = postcodes_valid
+    time = validate.is_valid_time(request.form["time"])
+    date = validate.is_valid_date(request.form["date"])
+    selected_modes = ["foot"]
+
+    # Invalid Postcode
+    if isinstance(start_postcode_valid, tuple):
+        return render_template("route-options.html",
+                               error_message=start_postcode_valid[1])
+    elif start_postcode_valid is False:
+        return render_template("route-options.html",
+                               error_message="Please enter a valid "
+                                             "'FROM' postcode")
+    elif isinstance(end_postcode_valid, tuple):
+        return render_template("route-options.html",
+                               error_message=end_postcode_valid[1])
+    elif end_postcode_valid is False:
+        return render_template("route-options.html",
+                               error_message="Please enter a valid "
+                                             "'TO' postcode")
+    # "When" has been altered - likely using inspect element
+    elif not (request.form["when"] == "at" or
+              request.form["when"] == "by"):
+        return render_template("route-options.html",
+                               error_message="Please do not change the "
+                                             "values from the on-screen "
+                                             "options")
+    # Invalid Time
+    elif time is False:
+        return render_template("route-options.html",
+                               error_message="The time must have the "
+                                             "format HH:MM")
+    # Invalid Date
+    elif date is False:
+        return render_template("route-options.html",
+                               error_message="The date must have the "
+                                             "format DD/MM/YY")
+    else:
+        # "Mode" checkbox results
+        if "mode1" in request.form:
+            selected_modes.append("bus")
+        if "mode2" in request.form:
+            selected_modes.append("train")
+        if "mode3" in request.form:
+            selected_modes.append("boat")
+        modes = "-".join(selected_modes)
+
+        # Create session data
+        session["start_postcode"] = request.form["start_postcode"]
+        session["end_postcode"] = request.form["end_postcode"]
+        session["when"] = request.form["when"]
+        session["time"] = request.form["time"]
+        session["date"] = request.form["date"]
+        session["modes"] = modes
+        # Sweep mode compares the routes at several times
+        if "sweep" in request.form:
+            session["rank"] = request.form.get("rank") \
+                if request.form.get("rank") in sweep_logic.RANKS \
+                else "duration"
+            return redirect("/route-sweep")
+        return redirect("/route-results")
 
 
 @app.route("/route-options", methods=["GET", "POST"])
@@ -41,98 +222,171 @@ def route_options():
     """
     # Validate User Input
     if request.method == "POST":
-        # Assign the result of validation checks
-        start_postcode_valid = validate.is_valid_postcode(
-            request.form["start_postcode"])
-        end_postcode_valid = validate.is_valid_postcode(
-            request.form["end_postcode"])
-        time = validate.is_valid_time(request.form["time"])
-        date = validate.is_valid_date(request.form["date"])
-        selected_modes = ["foot"]
-
-        # Invalid Postcode
-        if isinstance(start_postcode_valid, tuple):
-            return render_template("route-options.html",
-                                   error_message=start_postcode_valid[1])
-        elif start_postcode_valid is False:
-            return render_template("route-options.html",
-                                   error_message="Please enter a valid "
-                                                 "'FROM' postcode")
-        elif isinstance(end_postcode_valid, tuple):
-            return render_template("route-options.html",
-                                   error_message=end_postcode_valid[1])
-        elif end_postcode_valid is False:
-            return render_template("route-options.html",
-                                   error_message="Please enter a valid "
-                                                 "'TO' postcode")
-        # "When" has been altered - likely using inspect element
-        elif not (request.form["when"] == "at" or
-                  request.form["when"] == "by"):
-            return render_template("route-options.html",
-                                   error_message="Please do not change the "
-                                                 "values from the on-screen "
-                                                 "options")
-        # Invalid Time
-        elif time is False:
-            return render_template("route-options.html",
-                                   error_message="The time must have the "
-                                                 "format HH:MM")
-        # Invalid Date
-        elif date is False:
-            return render_template("route-options.html",
-                                   error_message="The date must have the "
-                                                 "format DD/MM/YY")
-        else:
-            # "Mode" checkbox results
-            if "mode1" in request.form:
-                selected_modes.append("bus")
-            if "mode2" in request.form:
-                selected_modes.append("train")
-            if "mode3" in request.form:
-                selected_modes.append("boat")
-            modes = "-".join(selected_modes)
-
-            # Create session data
-            session["start_postcode"] = request.form["start_postcode"]
-            session["end_postcode"] = request.form["end_postcode"]
-            session["when"] = request.form["when"]
-            session["time"] = request.form["time"]
-            session["date"] = request.form["date"]
-            session["modes"] = modes
-            return redirect("/route-results")
-    return render_template("route-options.html")
+        # Both postcodes are resolved in a single round trip
+        return _submit_route_options(validate.are_valid_postcodes(
+            [request.form["start_postcode"], request.form["end_postcode"]]))
+    return http_cache.render_static("route-options.html",
+                                    config.static_page_max_age)
+
+
+async def route_options_async():
+    """
+    Coroutine version of route_options. The postcodes are resolved without
+        holding a thread
+    :return: See route_options
+    """
+    if request.method == "POST":
+        return _submit_route_options(
+            await validate.are_valid_postcodes_async(
+                [request.form["start_postcode"],
+                 request.form["end_postcode"]]))
+    return http_cache.render_static("route-options.html",
+                                    config.static_page_max_age)
+
+
+def _session_travel(travel_class):
+    """
+    Create the travel object of the options in the session
+    :param travel_class: travel_logic.TravelInformation or
+                            travel_logic.AsyncTravelInformation
+    :return: A tuple containing the travel object and a dictionary of the
+                options as shown on the page
+    """
+    travel_obj = travel_class(
+        modes=session["modes"], source_pc=session["start_postcode"],
+        destination_pc=session["end_postcode"], dep_arri=session["when"],
+        date=session["date"], time=session["time"])
+    # Assign session data to dictionary
+    session_data = {
+        "source": str(session["start_postcode"]).upper(),
+        "destination": str(session["end_postcode"]).upper(),
+        "time": str(dt.datetime.strptime(travel_obj.date, "%Y-%m-%d").
+                    strftime("%d/%m/%y") + "  " + session["when"] + "  "
+                    + travel_obj.time),
+        "modes": str(session["modes"]).replace("-", ", ").capitalize()
+    }
+    return travel_obj, session_data
+
+
+def _route_results_page(session_data, results):
+    """
+    Render the route results page once the routes have been fetched
+        successfully. A refresh is answered with a 304 while the routes are
+        unchanged
+    :param session_data: The options as shown on the page
+    :param results: The fetched travel_logic.RouteResults
+    :return: The response
+    """
+    etag = http_cache.etag_for(
+        session_data, [route.as_dict(duration=True)
+                       for route in results.routes],
+        results.part_weather)
+    # The url doesn't identify the search, so every view is revalidated
+    return http_cache.conditional(
+        etag, None, render_template, "route-results.html",
+        session_data=session_data, results=results)
 
 
 @app.route("/route-results")
 def route_results():
     """
     Results page. Informs user of their choices and outputs route information
-        in a table including addresses, timings and transport modes
+        in a table including addresses, timings and transport modes. Each
+        alternative route has its own table. Unless the routes are cached,
+        the page is streamed: the choices are sent at once and the tables
+        follow once the routes arrive
     :return: A render of the route-results page.
     """
-    # Create TravelInformation object
-    travel_obj = travel_logic.TravelInformation(
-        modes=session["modes"], source_pc=session["start_postcode"],
-        destination_pc=session["end_postcode"], dep_arri=session["when"],
-        date=session["date"], time=session["time"])
-    route_info = travel_obj.format_travel_request()
+    # Weather page is usually visited next - fetch it while routes load
+    weather_logic.prefetch_weather_info(session["end_postcode"])
 
-    # If weather_info is a dictionary, the api call was successful
-    if isinstance(route_info, dict):
-        # Assign session data to dictionary
-        session_data = {
-            "source": str(session["start_postcode"]).upper(),
-            "destination": str(session["end_postcode"]).upper(),
-            "time": str(dt.datetime.strptime(travel_obj.date, "%Y-%m-%d").
-                        strftime("%d/%m/%y") + "  " + session["when"] + "  "
-                        + travel_obj.time),
-            "modes": str(session["modes"]).replace("-", ", ").capitalize()
-        }
-        return render_template("route-results.html", session_data=session_data,
-                               routes=route_info, flag=False)
-    else:
-        return render_template("route-results.html", routes=route_info,
-                               flag=True)
+    (travel_obj, session_data) = _session_travel(
+        travel_logic.TravelInformation)
+    # Routes (and the weather where each part starts) are fetched when the
+    # template reaches them
+    results = travel_logic.RouteResults(travel_obj,
+                                        with_weather=config.route_weather)
+
+    if travel_obj.cache_key() in travel_logic.route_cache:
+        results.fetch()
+        if results.error is None:
+            return _route_results_page(session_data, results)
+    return Response(stream_with_context(stream_template(
+        "route-results.html", session_data=session_data, results=results)))
+
+
+def _stream_template_async(template_name, **context):
+    """
+    Coroutine version of stream_template. The template is rendered by the
+        async environment, so it can await what it iterates. The request
+        context must stay pushed until the page is sent
+    :param template_name: Name of the template
+    :param context: The variables of the template
+    :return: An async generator of the parts of the page
+    """
+    app.update_template_context(context)
+    template = async_jinja_env.get_template(template_name)
+    before_render_template.send(app, _async_wrapper=app.ensure_sync,
+                                template=template, context=context)
+
+    async def generate():
+        async for part in template.generate_async(context):
+            yield part
+        template_rendered.send(app, _async_wrapper=app.ensure_sync,
+                               template=template, context=context)
+    return generate()
+
+
+async def route_results_async():
+    """
+    Coroutine version of route_results. The routes and the weather along
+        them are awaited without holding a thread. Unless the routes are
+        cached, the page is streamed as in route_results
+    :return: A render of the route-results page
+    """
+    # Weather page is usually visited next - fetch it while routes load
+    weather_logic.prefetch_weather_info(session["end_postcode"])
+
+    (travel_obj, session_data) = _session_travel(
+        travel_logic.AsyncTravelInformation)
+    # Routes are awaited when the template reaches them
+    results = travel_logic.RouteResults(travel_obj,
+                                        with_weather=config.route_weather)
+
+    if travel_obj.cache_key() in travel_logic.route_cache:
+        await results.fetch_async()
+        if results.error is None:
+            return _route_results_page(session_data, results)
+    return Response(_stream_template_async(
+        "route-results.html", session_data=session_data, results=results))
+
+
+@app.route("/route-sweep")
+def route_sweep():
+    """
+    Sweep results. Plans the route at every time across a window in
+        parallel. The page is streamed, and each time's best route is added
+        to a ranked table as soon as it is available
+    :return: A streamed render of the route-sweep page
+    """
+    time = session["time"] or dt.datetime.now().strftime("%H:%M")
+    times = sweep_logic.sweep_times(time, config.sweep_window,
+                                    config.sweep_step)
+    session_data = {
+        "source": str(session["start_postcode"]).upper(),
+        "destination": str(session["end_postcode"]).upper(),
+        "time": str((session["date"] or dt.datetime.now().strftime(
+            "%d/%m/%y")) + "  " + session["when"] + "  " + times[0] +
+            " - " + times[-1]),
+        "modes": str(session["modes"]).replace("-", ", ").capitalize()
+    }
+    results = sweep_logic.run_sweep(
+        session["modes"], session["start_postcode"], session["end_postcode"],
+        session["when"], session["date"], times, session["rank"],
+        config.sweep_concurrency)
+    return Response(stream_with_context(stream_template(
+        "route-sweep.html", session_data=session_data, results=results,
+        rank=session["rank"])))
 
 
 # Weather Page
@@ -146,18 +400,77 @@ def weather_results():
     # Create WeatherInformation object
     weather_obj = weather_logic.WeatherInformation(destination_pc=
                                                    session["end_postcode"])
-    weather_info = weather_obj.get_weather_info()
+    return _weather_page(weather_obj.get_weather_info())
+
+
+async def weather_results_async():
+    """
+    Coroutine version of weather_results. The weather is awaited without
+        holding a thread
+    :return: A render of the weather results page
+    """
+    weather_obj = weather_logic.AsyncWeatherInformation(
+        destination_pc=session["end_postcode"])
+    return _weather_page(await weather_obj.get_weather_info())
+
 
+def _weather_page(weather_info):
+    """
+    Render the weather results page
+    :param weather_info: Result of WeatherInformation.get_weather_info
+    :return: The response
+    """
     # If weather_info is a dictionary, the api call was successful
     if isinstance(weather_info, dict):
         postcode = utils.format_pc(str(session["end_postcode"]))
-        return render_template("weather-results.html", postcode=postcode,
-                               weather=weather_info, flag=False)
+        etag = http_cache.etag_for(postcode, weather_info)
+        return http_cache.conditional(
+            etag, None, render_template, "weather-results.html",
+            postcode=postcode, weather=weather_info, flag=False)
     else:
         return render_template("weather-results.html", weather=weather_info,
                                flag=True)
 
 
+@app.route("/api/routes/batch", methods=["POST"])
+def route_batch():
+    """
+    Plans many routes in one request. The JSON body contains "jobs", a list
+        of objects with the keys "from", "to", "when", "date", "time" and
+        "modes" (see batch_logic.parse_job), and optionally "concurrency"
+    :return: A stream of newline delimited JSON results, one per unique job,
+        in the order they complete. If the body is invalid, a JSON error
+        with status 400
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get("jobs"), list):
+        return jsonify(error="The body must be a JSON object with a list "
+                             "of 'jobs'"), 400
+    elif len(data["jobs"]) > config.batch_max_jobs:
+        return jsonify(error="A batch can contain at most {max} jobs"
+                       .format(max=config.batch_max_jobs)), 400
+
+    concurrency = data.get("concurrency", config.batch_concurrency)
+    if not isinstance(concurrency, int) or concurrency < 1:
+        return jsonify(error="'concurrency' must be a positive integer"), 400
+    concurrency = min(concurrency, config.batch_concurrency)
+
+    results = batch_logic.run_batch(data["jobs"], concurrency)
+    return Response((json.dumps(result) + "\n" for result in results),
+                    mimetype="application/x-ndjson")
+
+
+@app.route("/metrics")
+def metrics_page():
+    """
+    Metrics for monitoring: latency and outcome of upstream calls, request
+        and template render durations, and cache statistics
+    :return: The metrics in the Prometheus text exposition format
+    """
+    return Response(metrics.exposition(),
+                    mimetype="text/plain; version=0.0.4")
+
+
 @app.errorhandler(404)
 def not_found(error):
     """
@@ -167,7 +480,7 @@ def not_found(error):
     :param error: Error code 404
     :return: A render of the "404 - Page Not Found" Page
     """
-    return render_template("404.html"), 404
+    return http_cache.render_static("404.html"), 404
 
 
 @app.errorhandler(500)
@@ -179,7 +492,7 @@ def internal_error(error):
     :param error: Error code 500
     :return: A render of the "500 - Internal Server Error" Page
     """
-    return render_template("500.html"), 500
+    return http_cache.render_static("500.html"), 500
 
 
 if __name__ == '__main__':
@@ -0,0 +1,279 @@
+"""
+Title: ASGI application. The upstream-bound pages (route options, route
+            results and weather results) are served by coroutines on the
+            event loop, so a request waiting on an upstream doesn't hold a
+            thread. Every other page is served by the Flask app on a pool of
+            threads. Run it with serve.py --asgi, or any ASGI server
+            (uvicorn asgi:application)
+Author: Primus27
+Date: 10/2026
+"""
+
+# Import packages
+from concurrent.futures import ThreadPoolExecutor
+from flask import request, request_started
+from werkzeug.exceptions import HTTPException
+import asyncio
+import contextvars
+import io
+import sys
+import threading
+from app import app, async_jinja_env, route_options_async, \
+    route_results_async, weather_results_async
+import http_client
+import config
+
+# Endpoint: coroutine serving it. They run within the Flask request context,
+# so before/after request functions and sessions apply as to any view
+coroutine_views = {"route_options": route_options_async,
+                   "route_results": route_results_async,
+                   "weather_results": weather_results_async}
+# Templates rendered by the coroutine views with the async environment
+coroutine_templates = ["route-results.html"]
+
+_executor = ThreadPoolExecutor(max_workers=config.serve_threads,
+                               thread_name_prefix="request")
+
+
+def _environ(scope, body):
+    """
+    Create the WSGI environ of a request
+    :param scope: The ASGI connection scope
+    :param body: The request body as bytes
+    :return: The environ dictionary
+    """
+    path = scope["path"]
+    root_path = scope.get("root_path", "")
+    if path.startswith(root_path):
+        path = path[len(root_path):]
+    (server_name, server_port) = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": root_path.encode().decode("latin-1"),
+        "PATH_INFO": path.encode().decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port or 80),
+        "SERVER_PROTOCOL": "HTTP/" + scope.get("http_version", "1.1"),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False
+    }
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = scope["client"][0]
+        environ["REMOTE_PORT"] = str(scope["client"][1])
+    for (name, value) in scope["headers"]:
+        name = name.decode("latin-1").upper().replace("-", "_")
+        if name not in ("CONTENT_LENGTH", "CONTENT_TYPE"):
+            name = "HTTP_" + name
+        value = value.decode("latin-1")
+        if name in environ:
+            value = environ[name] + "," + value  # Repeated header
+        environ[name] = value
+    return environ
+
+
+async def _read_body(receive):
+    """
+    Read the whole request body
+    :param receive: The ASGI receive function
+    :return: The body as bytes
+    """
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        body += message.get("body", b"")
+        if not message.get("more_body", False):
+            break
+    return bytes(body)
+
+
+def _endpoint(environ):
+    """
+    :param environ: The WSGI environ of a request
+    :return: The endpoint the request is routed to, or None if it isn't
+                routed (e.g. 404 or 405)
+    """
+    try:
+        return app.url_map.bind_to_environ(environ).match()[0]
+    except HTTPException:
+        return None
+
+
+async def _send_start(send, status, headers):
+    """
+    Send the status and headers of a response
+    :param send: The ASGI send function
+    :param status: The status code
+    :param headers: List of (name, value) tuples
+    """
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(name.lower().encode("latin-1"),
+                             value.encode("latin-1"))
+                            for (name, value) in headers]})
+
+
+async def _send_chunk(send, chunk):
+    """
+    Send part of a response body
+    :param send: The ASGI send function
+    :param chunk: The part of the body, as str or bytes
+    """
+    if isinstance(chunk, str):
+        chunk = chunk.encode()
+    if chunk:
+        await send({"type": "http.response.body", "body": chunk,
+                    "more_body": True})
+
+
+async def _in_thread(function, *args):
+    """
+    Run blocking work (such as loading or saving a session) on a thread of
+        the pool, within a copy of the current context so that it sees the
+        request context
+    :param function: The function to call
+    :return: The result of the function
+    """
+    return await asyncio.get_running_loop().run_in_executor(
+        _executor, contextvars.copy_context().run, function, *args)
+
+
+async def _serve_thread(environ, send):
+    """
+    Serve a request with the Flask app on a thread of the pool. The whole
+        body is read on that thread, so a streamed page keeps its context,
+        and each part is sent as it is produced
+    :param environ: The WSGI environ of the request
+    :param send: The ASGI send function
+    """
+    loop = asyncio.get_running_loop()
+    parts = asyncio.Queue()
+    started = []
+    stop = threading.Event()  # Set if the client has gone
+
+    def start_response(status, headers, exc_info=None):
+        started[:] = [int(status.split(" ", 1)[0]), headers]
+        return lambda data: None  # Write callable isn't used by Flask
+
+    def run():
+        try:
+            body = app(environ, start_response)
+            try:
+                for chunk in body:
+                    loop.call_soon_threadsafe(parts.put_nowait, chunk)
+                    if stop.is_set():
+                        break
+            finally:
+                if hasattr(body, "close"):
+                    body.close()
+        finally:
+            loop.call_soon_threadsafe(parts.put_nowait, None)
+
+    task = loop.run_in_executor(_executor, run)
+    try:
+        chunk = await parts.get()
+        if chunk is None:
+            await task  # Raises if the app failed before sending anything
+        await _send_start(send, *started)
+        while chunk is not None:
+            await _send_chunk(send, chunk)
+            chunk = await parts.get()
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        stop.set()
+    await task
+
+
+async def _serve_coroutine(view, environ, send):
+    """
+    Serve a request with a coroutine view, following the steps of
+        Flask.wsgi_app. The session is loaded, and the response finalised
+        (which saves the session), on a thread of the pool. The request
+        context stays pushed until the page is sent, so a streamed template
+        can still use it
+    :param view: The coroutine function of the endpoint
+    :param environ: The WSGI environ of the request
+    :param send: The ASGI send function
+    """
+    # Loaded before the context is pushed, which would block the event loop
+    await _in_thread(app.session_interface.preload, app, environ)
+    context = app.request_context(environ)
+    error = None
+    try:
+        context.push()
+        try:
+            try:
+                request_started.send(app, _async_wrapper=app.ensure_sync)
+                rv = app.preprocess_request()
+                if rv is None:
+                    rv = await view(**request.view_args)
+            except Exception as e:
+                rv = app.handle_user_exception(e)
+            response = await _in_thread(app.finalize_request, rv)
+        except Exception as e:
+            error = e
+            response = await _in_thread(app.handle_exception, e)
+
+        try:
+            # An async body is a page rendered by the async environment
+            if hasattr(response.response, "__aiter__") and \
+                    request.method != "HEAD":
+                await _send_start(send, response.status_code,
+                                  response.get_wsgi_headers(environ)
+                                  .to_wsgi_list())
+                async for chunk in response.response:
+                    await _send_chunk(send, chunk)
+            else:
+                (body, _, headers) = response.get_wsgi_response(environ)
+                await _send_start(send, response.status_code, headers)
+                for chunk in body:
+                    await _send_chunk(send, chunk)
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            response.close()
+    finally:
+        context.pop(error)
+
+
+async def _lifespan(receive, send):
+    """
+    Compile the templates of the coroutine views on startup, and close the
+        upstream connections of the event loop on shutdown
+    :param receive: The ASGI receive function
+    :param send: The ASGI send function
+    """
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            for name in coroutine_templates:
+                async_jinja_env.get_template(name)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await http_client.close_async_clients()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    """
+    The ASGI application
+    :param scope: The ASGI connection scope
+    :param receive: The ASGI receive function
+    :param send: The ASGI send function
+    """
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    elif scope["type"] != "http":
+        return  # Only HTTP is served
+    environ = _environ(scope, await _read_body(receive))
+    view = coroutine_views.get(_endpoint(environ))
+    if view is None:
+        await _serve_thread(environ, send)
+    else:
+        await _serve_coroutine(view, environ, send)
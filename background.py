@@ -0,0 +1,39 @@
+"""
+Title: Bounded executor for work that runs outside of a page request, such
+            as cache refreshes and prefetching
+Author: Primus27
+Date: 10/2026
+"""
+
+# Import packages
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import rate_limit
+import config
+
+_executor = ThreadPoolExecutor(max_workers=config.background_workers,
+                               thread_name_prefix="background")
+# Limits the tasks that are queued or running at once
+_slots = threading.BoundedSemaphore(config.background_queue_size)
+
+
+def submit(function, *args, **kwargs):
+    """
+    Run a function in the background, unless the queue is full. Its
+        upstream calls wait behind those of page requests
+    :param function: The function to call
+    :return: A Future of the result, or None if the task was dropped because
+                the queue is full
+    """
+    if not _slots.acquire(blocking=False):
+        return None
+    try:
+        future = _executor.submit(rate_limit.run_with_priority,
+                                  rate_limit.BACKGROUND, function, *args,
+                                  **kwargs)
+    except RuntimeError:  # Executor has been shut down
+        _slots.release()
+        return None
+    # Released once the task finishes or is cancelled
+    future.add_done_callback(lambda _: _slots.release())
+    return future
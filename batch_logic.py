@@ -0,0 +1,138 @@
+"""
+Title: Plans many routes in one request. Identical jobs are merged, all
+            postcodes are validated in bulk and the route lookups run on a
+            bounded pool of threads
+Author: Primus27
+Date: 10/2026
+"""
+
+# Import packages
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import postcode_logic
+import rate_limit
+import travel_logic
+import utils
+import validate
+import config
+
+MODES = ["foot", "bus", "train", "boat"]
+
+_executor = ThreadPoolExecutor(max_workers=config.batch_workers,
+                               thread_name_prefix="batch")
+
+
+def parse_job(job):
+    """
+    Check a job and normalise its options
+    :param job: Dictionary with the keys "from" and "to" (postcodes), and
+                    optionally "when" ("at"/"by"), "date" (DD/MM/YY), "time"
+                    (HH:MM) and "modes" (list or dash separated string)
+    :return: If valid, a tuple of the normalised options (source,
+                destination, when, date, time, modes). Otherwise, return a
+                tuple with -1 and an error message
+    """
+    if not isinstance(job, dict):
+        return -1, "Each job must be an object"
+    source = job.get("from")
+    destination = job.get("to")
+    when = job.get("when", "at")
+    date = job.get("date", "")
+    time = job.get("time", "")
+    modes = job.get("modes", ["foot"])
+    if isinstance(modes, str):
+        modes = modes.split("-")
+
+    if not isinstance(source, str) or not isinstance(destination, str):
+        return -1, "Please enter a 'FROM' and 'TO' postcode"
+    elif when not in ["at", "by"]:
+        return -1, "'when' must be 'at' or 'by'"
+    elif not isinstance(time, str) or validate.is_valid_time(time) is False:
+        return -1, "The time must have the format HH:MM"
+    elif not isinstance(date, str) or validate.is_valid_date(date) is False:
+        return -1, "The date must have the format DD/MM/YY"
+    elif not isinstance(modes, list) or \
+            not all(mode in MODES for mode in modes):
+        return -1, "The modes must be from: " + ", ".join(MODES)
+    # Walking is always included, as on the route options form
+    modes = "-".join(mode for mode in MODES if mode == "foot" or
+                     mode in modes)
+    return (utils.format_pc(source), utils.format_pc(destination), when,
+            date, time, modes)
+
+
+def _plan_route(options):
+    """
+    Fetch the routes of one job
+    :param options: Normalised options, as returned by parse_job
+    :return: Dictionary with the status and every alternative route, or the
+                error
+    """
+    (source, destination, when, date, time, modes) = options
+    travel_obj = travel_logic.TravelInformation(
+        modes=modes, source_pc=source, destination_pc=destination,
+        dep_arri=when, date=date, time=time)
+    route_info = travel_obj.format_travel_request(all_routes=True)
+    if isinstance(route_info, list):
+        return {"status": "ok",
+                "routes": [route.as_dict(duration=True)
+                           for route in route_info]}
+    return {"status": "error", "error": route_info}
+
+
+def run_batch(jobs, concurrency):
+    """
+    Plan the routes of many jobs, yielding each result as soon as it is
+        available. Identical jobs are only planned once
+    :param jobs: List of jobs (see parse_job)
+    :param concurrency: Maximum number of route lookups running at once
+    :return: Generator of dictionaries, each containing "jobs" (the indexes
+                of the jobs it answers) and a "status" of "ok" (with the
+                alternative "routes") or "error" (with "error")
+    """
+    # Options: indexes of the jobs requesting them
+    unique_jobs = {}
+    for index, job in enumerate(jobs):
+        options = parse_job(job)
+        if options[0] == -1:
+            yield {"jobs": [index], "status": "error", "error": options[1]}
+        else:
+            unique_jobs.setdefault(options, []).append(index)
+    if not unique_jobs:
+        return
+
+    # Validate every postcode in one lookup
+    resolved = postcode_logic.resolve_postcodes(
+        [postcode for options in unique_jobs for postcode in options[:2]])
+    if isinstance(resolved, tuple):
+        for indexes in unique_jobs.values():
+            yield {"jobs": indexes, "status": "error", "error": resolved[1]}
+        return
+    pending = []
+    for options, indexes in unique_jobs.items():
+        if resolved.get(options[0]) is None:
+            yield {"jobs": indexes, "status": "error",
+                   "error": "Please enter a valid 'FROM' postcode"}
+        elif resolved.get(options[1]) is None:
+            yield {"jobs": indexes, "status": "error",
+                   "error": "Please enter a valid 'TO' postcode"}
+        else:
+            pending.append(options)
+
+    # At most concurrency lookups are submitted at any time. Their upstream
+    # calls wait behind those of page requests, paced to the quotas
+    running = {}
+    try:
+        while pending or running:
+            while pending and len(running) < concurrency:
+                options = pending.pop(0)
+                running[_executor.submit(rate_limit.run_paced, _plan_route,
+                                         options)] = options
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = {"jobs": unique_jobs[running.pop(future)]}
+                result.update(future.result())
+                yield result
+    finally:
+        # Client went away - don't run the remaining lookups
+        for future in running:
+            future.cancel()
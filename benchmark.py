@@ -0,0 +1,270 @@
+"""
+Title: Load test and latency benchmark. Runs the app against local stub
+            upstreams, drives it with simulated user sessions and reports
+            throughput, latency percentiles and error rates per endpoint
+Author: Primus27
+Date: 10/2026
+"""
+
+# Import packages
+import argparse
+import datetime as dt
+import json
+import random
+import subprocess
+import sys
+import threading
+import time
+import requests
+from werkzeug.serving import make_server, WSGIRequestHandler
+import stub_upstreams
+
+ENDPOINTS = ["route_options", "route_results", "weather_results"]
+
+
+class _QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass  # Don't log every request of the app
+
+
+def _postcode(number, valid=True):
+    """
+    Postcode from the benchmark's pool
+    :param number: Index of the postcode in the pool
+    :param valid: Whether the stub upstreams treat the postcode as existing
+    :return: The postcode
+    """
+    return "{area}{district} {sector}AA".format(
+        area="SW" if valid else "ZZ", district=number // 10 + 1,
+        sector=number % 10)
+
+
+class Recorder:
+    """
+    Collects the latency and result of every request made by the users
+    """
+    def __init__(self):
+        self.samples = {endpoint: [] for endpoint in ENDPOINTS}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds, ok):
+        """
+        Record a request
+        :param endpoint: Name of the endpoint
+        :param seconds: Latency of the request
+        :param ok: Boolean on whether the request succeeded
+        """
+        with self._lock:
+            self.samples[endpoint].append((seconds, ok))
+
+
+def _timed(recorder, endpoint, send):
+    """
+    Send a request and record it. A request fails if it raises, returns a
+        status code of 500 or above, or renders an API error page
+    :param recorder: The Recorder
+    :param endpoint: Name of the endpoint
+    :param send: Function sending the request
+    :return: The response, or None if the request raised
+    """
+    start = time.perf_counter()
+    try:
+        r = send()
+    except requests.exceptions.RequestException:
+        recorder.record(endpoint, time.perf_counter() - start, False)
+        return None
+    ok = r.status_code < 500 and b"Something went wrong</h1>" not in r.content
+    recorder.record(endpoint, time.perf_counter() - start, ok)
+    return r
+
+
+def run_user(app_url, args, deadline, recorder):
+    """
+    Simulate one user repeatedly planning a route and (usually) checking the
+        weather, until the deadline
+    :param app_url: Base url of the app
+    :param args: The parsed command line arguments
+    :param deadline: time.monotonic() value to stop at
+    :param recorder: The Recorder
+    """
+    session = requests.Session()
+    while time.monotonic() < deadline:
+        valid = random.random() >= args.invalid_ratio
+        form = {"start_postcode": _postcode(
+                    random.randrange(args.postcode_pool), valid),
+                "end_postcode": _postcode(
+                    random.randrange(args.postcode_pool)),
+                "when": random.choice(["at", "by"]),
+                "time": "{0:02d}:{1:02d}".format(random.randrange(6, 22),
+                                                 random.randrange(60)),
+                "date": "", "mode1": "bus", "mode2": "train"}
+        r = _timed(recorder, "route_options", lambda: session.post(
+            app_url + "/route-options", data=form, allow_redirects=False))
+        if r is None or r.status_code != 302:
+            continue  # Invalid form - the user tries again
+        _timed(recorder, "route_results",
+               lambda: session.get(app_url + "/route-results"))
+        if random.random() < args.weather_ratio:
+            _timed(recorder, "weather_results",
+                   lambda: session.get(app_url + "/weather-results"))
+
+
+def _percentile(values, percentile):
+    """
+    Nearest-rank percentile
+    :param values: Sorted list of values
+    :param percentile: The percentile (0-100)
+    :return: The value at the percentile, or None if there are no values
+    """
+    if not values:
+        return None
+    rank = max(int(round(percentile / 100 * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def summarise(recorder, seconds):
+    """
+    Summarise the recorded requests of each endpoint
+    :param recorder: The Recorder
+    :param seconds: Duration of the run
+    :return: Dictionary of endpoint to its number of requests, requests per
+                second, latency percentiles (ms) and error rate
+    """
+    summary = {}
+    for endpoint, samples in recorder.samples.items():
+        latencies = sorted(latency * 1000 for latency, _ in samples)
+        errors = sum(1 for _, ok in samples if not ok)
+        summary[endpoint] = {
+            "requests": len(samples),
+            "rps": round(len(samples) / seconds, 2),
+            "p50_ms": _percentile(latencies, 50),
+            "p95_ms": _percentile(latencies, 95),
+            "p99_ms": _percentile(latencies, 99),
+            "error_rate": round(errors / len(samples), 4) if samples else 0
+        }
+    return summary
+
+
+def compare(results, baseline, max_regression):
+    """
+    Print the change of each endpoint against a baseline run
+    :param results: Results of this run
+    :param baseline: Results of the baseline run
+    :param max_regression: Largest allowed fractional increase in p95
+                            latency or decrease in requests per second
+    :return: Boolean on whether every endpoint is within max_regression
+    """
+    passed = True
+    for endpoint in ENDPOINTS:
+        new = results["endpoints"].get(endpoint, {})
+        old = baseline["endpoints"].get(endpoint, {})
+        if not new.get("p95_ms") or not old.get("p95_ms") or \
+                not old.get("rps"):
+            continue
+        p95_change = new["p95_ms"] / old["p95_ms"] - 1
+        rps_change = new["rps"] / old["rps"] - 1
+        regressed = p95_change > max_regression or \
+            rps_change < -max_regression
+        passed = passed and not regressed
+        print("{endpoint:<16} p95 {p95:+.1%}  rps {rps:+.1%}{flag}".format(
+            endpoint=endpoint, p95=p95_change, rps=rps_change,
+            flag="  REGRESSION" if regressed else ""))
+    return passed
+
+
+def _revision():
+    """
+    :return: The current git commit, or None if unavailable
+    """
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the app against local stub upstreams")
+    parser.add_argument("--duration", type=float, default=30,
+                        help="Seconds to run for")
+    parser.add_argument("--users", type=int, default=20,
+                        help="Concurrent user sessions")
+    parser.add_argument("--weather-ratio", type=float, default=0.8,
+                        help="Fraction of planned routes followed by a "
+                             "visit to the weather page")
+    parser.add_argument("--invalid-ratio", type=float, default=0.05,
+                        help="Fraction of forms with an invalid postcode")
+    parser.add_argument("--postcode-pool", type=int, default=500,
+                        help="Number of distinct postcodes users choose from")
+    for name, latency in [("postcodes", 0.03), ("transport", 0.3),
+                          ("weather", 0.05)]:
+        parser.add_argument("--{name}-latency".format(name=name),
+                            type=float, default=latency,
+                            help="Median latency of the {name} stub (s)"
+                            .format(name=name))
+    parser.add_argument("--jitter", type=float, default=0.3,
+                        help="Spread of the stub latency distribution")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Fraction of stub requests that fail")
+    parser.add_argument("--rate-limits", action="store_true",
+                        help="Keep the upstream rate limits of the API keys "
+                             "(the stubs have no quota)")
+    parser.add_argument("--output", help="Write the results to a JSON file")
+    parser.add_argument("--compare", help="Compare against a results file")
+    parser.add_argument("--max-regression", type=float, default=0.1,
+                        help="Fractional change treated as a regression")
+    args = parser.parse_args()
+
+    stubs = {name: stub_upstreams.start_stub(stub_upstreams.Profile(
+                 getattr(args, name + "_latency"), args.jitter,
+                 args.error_rate))
+             for name in ["postcodes", "transport", "weather"]}
+    import config
+    config.postcodes_url = stub_upstreams.base_url(stubs["postcodes"])
+    config.transport_url = stub_upstreams.base_url(stubs["transport"])
+    config.weather_url = stub_upstreams.base_url(stubs["weather"])
+    if not args.rate_limits:
+        config.rate_limits = {}
+    import app
+    import http_client
+
+    server = make_server("127.0.0.1", 0, app.app, threaded=True,
+                         request_handler=_QuietRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    app_url = "http://127.0.0.1:{port}".format(port=server.server_port)
+
+    recorder = Recorder()
+    start = time.monotonic()
+    deadline = start + args.duration
+    users = [threading.Thread(target=run_user,
+                              args=(app_url, args, deadline, recorder))
+             for _ in range(args.users)]
+    for user in users:
+        user.start()
+    for user in users:
+        user.join()
+    seconds = time.monotonic() - start
+    server.shutdown()
+
+    results = {
+        "revision": _revision(),
+        "date": dt.datetime.now().isoformat(timespec="seconds"),
+        "parameters": vars(args),
+        "endpoints": summarise(recorder, seconds),
+        "upstreams": http_client.stats()
+    }
+    print(json.dumps(results["endpoints"], indent=2))
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            if not compare(results, json.load(baseline_file),
+                           args.max_regression):
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+"""
+Title: Bounded in-process cache with least-recently-used eviction and
+            expiry times, and coalescing of concurrent identical calls
+Author: Primus27
+Date: 10/2026
+"""
+
+# Import packages
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+import threading
+import time
+
+# Returned by TTLCache.get when a key is not cached (None can be cached)
+MISSING = object()
+
+
+class WaitTimeout(Exception):
+    """
+    Raised by SingleFlight.do_within when the call in flight doesn't finish
+    within the time the caller can wait
+    """
+
+
+class TTLCache:
+    """
+    Thread-safe cache holding at most max_size entries. Each entry expires
+    after a time to live and the least recently used entry is evicted when
+    the cache is full. Hits and misses are counted.
+    """
+    def __init__(self, max_size, ttl, negative_ttl=None, stale_ttl=0):
+        """
+        Constructor for the cache
+        :param max_size: Maximum number of entries held
+        :param ttl: Seconds an entry stays valid
+        :param negative_ttl: Seconds a cached None (e.g. an invalid postcode)
+                        stays valid. Defaults to ttl
+        :param stale_ttl: Seconds an expired entry is still returned by
+                        get_stale
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self.stale_ttl = stale_ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key: (expiry time, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=MISSING):
+        """
+        Fetch an entry from the cache
+        :param key: The key of the entry
+        :param default: Returned if the key is not cached or has expired
+        :return: The cached value, or default
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                now = time.monotonic()
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                elif entry[0] + self.stale_ttl <= now:
+                    del self._entries[key]
+            self.misses += 1
+            return default
+
+    def get_stale(self, key):
+        """
+        Fetch an entry from the cache, including an entry that has expired
+            less than stale_ttl seconds ago
+        :param key: The key of the entry
+        :return: A tuple containing the cached value and whether it is still
+                    fresh, or MISSING if the key is not cached
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                now = time.monotonic()
+                if entry[0] + self.stale_ttl > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1], entry[0] > now
+                del self._entries[key]
+            self.misses += 1
+            return MISSING
+
+    def set(self, key, value, ttl=None):
+        """
+        Add or replace an entry, evicting the least recently used entry if
+            the cache is full
+        :param key: The key of the entry
+        :param value: The value to cache
+        :param ttl: Seconds the entry stays valid. Defaults to the cache's ttl
+                        (or negative_ttl if the value is None)
+        """
+        if ttl is None:
+            ttl = self.negative_ttl if value is None else self.ttl
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        """
+        Remove an entry from the cache, if present
+        :param key: The key of the entry
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """
+        Remove every entry from the cache
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        """
+        Check whether get_stale would return an entry, without counting a hit
+            or miss
+        :param key: The key of the entry
+        :return: Boolean on whether the key is cached
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and \
+                entry[0] + self.stale_ttl > time.monotonic()
+
+    def stats(self):
+        """
+        Usage statistics of the cache
+        :return: Dictionary with the number of hits, misses and entries
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "size": len(self._entries), "max_size": self.max_size}
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key, so that only one of them
+    runs and the rest wait for and share its result (or exception).
+    The number of calls saved is counted.
+    """
+    def __init__(self):
+        """
+        Constructor for the coalescer
+        """
+        self.saved = 0
+        self._calls = {}  # key: Future of the call in flight
+        self._lock = threading.Lock()
+
+    def do(self, key, function, *args, **kwargs):
+        """
+        Run a function, or wait for the in-flight call with the same key
+        :param key: Identifies calls that are interchangeable
+        :param function: The function to call
+        :return: The result of the function. Raises its exception on failure
+        """
+        return self.do_within(None, key, function, *args, **kwargs)
+
+    def do_within(self, timeout, key, function, *args, **kwargs):
+        """
+        Run a function, or wait at most timeout seconds for the in-flight
+            call with the same key (see do). Raises WaitTimeout if the call
+            doesn't finish in time
+        :param timeout: Most seconds to wait, or None to wait for as long as
+                        the call takes
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.saved += 1
+                leader = False
+            else:
+                call = Future()
+                self._calls[key] = call
+                leader = True
+        if not leader:
+            try:
+                return call.result(None if timeout is None
+                                   else max(timeout, 0))
+            except FutureTimeoutError:
+                if call.done():
+                    raise  # Raised by the call itself
+                raise WaitTimeout("Call in flight didn't finish in time")
+
+        try:
+            result = function(*args, **kwargs)
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
@@ -0,0 +1,201 @@
+"""
+Title: Circuit breakers for upstream APIs. When too many recent calls to an
+            upstream fail, further calls fail fast until a probe succeeds
+Author: Primus27
+Date: 10/2026
+"""
+
+# Import packages
+from collections import deque
+import threading
+import time
+import requests
+import metrics
+import config
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """
+    Raised instead of calling an upstream whose circuit is open
+    """
+    outcome = "circuit_open"
+
+
+class CircuitBreaker:
+    """
+    Tracks the failure rate of calls to one upstream over a sliding window.
+    The circuit opens when the rate is too high, rejecting calls for a
+    while, then lets a limited number of probe calls through (half open)
+    to decide whether to close again. Each change of state starts a new
+    generation, and results of calls allowed in an older one are ignored.
+    """
+    def __init__(self, name, failure_rate, min_calls, window, open_seconds,
+                 probes=1):
+        """
+        Constructor for the circuit breaker
+        :param name: Name of the upstream
+        :param failure_rate: Fraction of failed calls that opens the circuit
+        :param min_calls: Calls needed in the window before it can open
+        :param window: Seconds of calls the failure rate is measured over
+        :param open_seconds: Seconds the circuit stays open before probing
+        :param probes: Calls let through at once while half open
+        """
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.open_seconds = open_seconds
+        self.probes = probes
+        self.state = CLOSED
+        self.generation = 0
+        self.rejected = 0
+        self._calls = deque()  # (time, succeeded)
+        self._failures = 0
+        self._opened_at = 0
+        self._probing = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Check whether a call may be made. Every allowed call must be
+            followed by record() or release()
+        :return: The generation of the call if it may be made, otherwise
+                    None
+        """
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self._opened_at < self.open_seconds:
+                    self.rejected += 1
+                    return None
+                self._change(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self._probing >= self.probes:
+                    self.rejected += 1
+                    return None
+                self._probing += 1
+            return self.generation
+
+    def before_call(self):
+        """
+        Raise CircuitOpenError unless a call may be made
+        :return: The generation of the call, to pass to record() or release()
+        """
+        generation = self.allow()
+        if generation is None:
+            raise CircuitOpenError("Circuit for {name} is open".format(
+                name=self.name))
+        return generation
+
+    def record(self, generation, succeeded):
+        """
+        Record the result of an allowed call. It is ignored if the state has
+            changed since the call was allowed, e.g. a call made while
+            closed that ends after the circuit has opened isn't a probe
+        :param generation: The generation of the call (see allow())
+        :param succeeded: Boolean on whether the upstream answered properly
+        """
+        now = time.monotonic()
+        with self._lock:
+            if generation != self.generation:
+                return
+            elif self.state == HALF_OPEN:
+                if succeeded:
+                    self._change(CLOSED)
+                else:
+                    self._open(now)
+                return
+
+            self._calls.append((now, succeeded))
+            if not succeeded:
+                self._failures += 1
+            while self._calls and self._calls[0][0] <= now - self.window:
+                if not self._calls.popleft()[1]:
+                    self._failures -= 1
+            if len(self._calls) >= self.min_calls and \
+                    self._failures / len(self._calls) >= self.failure_rate:
+                self._open(now)
+
+    def release(self, generation):
+        """
+        Release an allowed call that ended without a result, e.g. because
+            it was cancelled, so that it doesn't hold a probe slot
+        :param generation: The generation of the call (see allow())
+        """
+        with self._lock:
+            if generation == self.generation and self.state == HALF_OPEN:
+                self._probing -= 1
+
+    def _change(self, state):
+        """
+        Move to a new state, starting a new generation of calls. Must be
+            called with the lock held
+        :param state: CLOSED, OPEN or HALF_OPEN
+        """
+        self.state = state
+        self.generation += 1
+        self._calls.clear()
+        self._failures = 0
+        self._probing = 0
+
+    def _open(self, now):
+        """
+        Open the circuit. Must be called with the lock held
+        :param now: The current time.monotonic()
+        """
+        self._change(OPEN)
+        self._opened_at = now
+
+
+def get_breaker(upstream):
+    """
+    Fetch the circuit breaker of an upstream, creating it on first use
+    :param upstream: Name of the upstream (key of config.upstream_timeouts)
+    :return: The CircuitBreaker
+    """
+    breaker = _breakers.get(upstream)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(upstream)
+            if breaker is None:
+                breaker = CircuitBreaker(
+                    upstream, failure_rate=config.circuit_failure_rate,
+                    min_calls=config.circuit_min_calls,
+                    window=config.circuit_window,
+                    open_seconds=config.circuit_open_seconds,
+                    probes=config.circuit_probes)
+                _breakers[upstream] = breaker
+    return breaker
+
+
+def breakers():
+    """
+    :return: Dictionary of upstream name to its CircuitBreaker
+    """
+    return dict(_breakers)
+
+
+def _collect():
+    """
+    :return: List of lines exposing the state of each circuit
+    """
+    states = sorted(breakers().items())
+    return metrics.samples(
+        "circuit_open", "gauge",
+        "1 if the circuit of the upstream is open, 0.5 if half open",
+        ("upstream",),
+        [((upstream,), {CLOSED: 0, HALF_OPEN: 0.5, OPEN: 1}[breaker.state])
+         for upstream, breaker in states]) + \
+        metrics.samples(
+            "circuit_rejected_total", "counter",
+            "Calls failed fast because the circuit was open", ("upstream",),
+            [((upstream,), breaker.rejected) for upstream, breaker in states])
+
+
+metrics.register_collector(_collect)
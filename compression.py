@@ -0,0 +1,150 @@
+"""
+Title: Response compression. Pages are compressed with brotli (if installed)
+            or gzip, as the client accepts, and static assets are served from
+            precompressed copies
+Author: Primus27
+Date: 10/2026
+"""
+
+# Import packages
+from flask import request, send_from_directory
+from werkzeug.security import safe_join
+import argparse
+import gzip
+import mimetypes
+import os
+import cache
+import config
+
+try:
+    import brotli
+except ImportError:
+    brotli = None  # Optional - gzip only
+
+# Encodings in order of preference, and the suffix of precompressed files
+SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+# (ETag, encoding): compressed body of a page with a data derived ETag
+_compressed = cache.TTLCache(max_size=config.compression_cache_size,
+                             ttl=config.compression_cache_ttl)
+
+
+def encodings():
+    """
+    :return: List of the available encodings, in order of preference
+    """
+    return [encoding for encoding in SUFFIXES
+            if encoding != "br" or brotli is not None]
+
+
+def choose_encoding():
+    """
+    Choose the encoding of the response to the current request
+    :return: The preferred encoding the client accepts, or None
+    """
+    for encoding in encodings():
+        if request.accept_encodings.quality(encoding) > 0:
+            return encoding
+    return None
+
+
+def compress(data, encoding):
+    """
+    Compress data
+    :param data: The bytes to compress
+    :param encoding: "br" or "gzip"
+    :return: The compressed bytes
+    """
+    if encoding == "br":
+        return brotli.compress(data, quality=config.brotli_level)
+    return gzip.compress(data, compresslevel=config.gzip_level, mtime=0)
+
+
+def compress_response(response):
+    """
+    Compress a page if the client accepts it and it is worth compressing.
+        Streamed responses and files are left as they are. Pages with an
+        ETag are compressed once and reused
+    :param response: The response
+    :return: The (possibly) compressed response
+    """
+    if response.status_code != 200 or response.direct_passthrough or \
+            response.is_streamed or "Content-Encoding" in response.headers \
+            or response.mimetype not in config.compress_types:
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = choose_encoding()
+    if encoding is None or \
+            len(response.get_data()) < config.compress_min_size:
+        return response
+
+    (etag, weak) = response.get_etag()
+    key = (etag, encoding)
+    data = _compressed.get(key) if etag else cache.MISSING
+    if data is cache.MISSING:
+        data = compress(response.get_data(), encoding)
+        if etag:
+            _compressed.set(key, data)
+    response.set_data(data)
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def precompress(folder):
+    """
+    Write compressed copies of the static assets in a folder that are missing
+        or older than the asset
+    :param folder: The static folder
+    :return: Number of copies written
+    """
+    written = 0
+    for directory, _, files in os.walk(folder):
+        for name in files:
+            path = os.path.join(directory, name)
+            if name.endswith(tuple(SUFFIXES.values())) or \
+                    mimetypes.guess_type(name)[0] not in \
+                    config.compress_types:
+                continue
+            with open(path, "rb") as asset:
+                data = asset.read()
+            for encoding in encodings():
+                copy = path + SUFFIXES[encoding]
+                if os.path.isfile(copy) and \
+                        os.path.getmtime(copy) >= os.path.getmtime(path):
+                    continue
+                with open(copy, "wb") as copy_file:
+                    copy_file.write(compress(data, encoding))
+                written += 1
+    return written
+
+
+def send_static(folder, filename):
+    """
+    Send a static asset, using its precompressed copy if the client accepts
+        the encoding
+    :param folder: The static folder
+    :param filename: Path of the asset within the folder
+    :return: The response
+    """
+    encoding = choose_encoding()
+    path = safe_join(folder, filename)
+    if encoding is not None and path is not None and \
+            os.path.isfile(path + SUFFIXES[encoding]):
+        response = send_from_directory(
+            folder, filename + SUFFIXES[encoding],
+            mimetype=mimetypes.guess_type(filename)[0])
+        response.headers["Content-Encoding"] = encoding
+    else:
+        response = send_from_directory(folder, filename)
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Write compressed copies of the static assets")
+    parser.add_argument("folder", nargs="?", default="static",
+                        help="The static folder")
+    args = parser.parse_args()
+    print("{count} compressed copies written".format(
+        count=precompress(args.folder)))
@@ -8,7 +8,160 @@ import os
 
 # OpenWeather API
 weather_key = os.environ.get("OPENWEATHER_KEY")
+weather_url = os.environ.get("OPENWEATHER_URL",
+                             "http://api.openweathermap.org")
 
 # Transport API
 transport_id = os.environ.get("TRANSPORT_ID")
-transport_key = os.environ.get("TRANSPORT_KEY")
\ No newline at end of file
+transport_key = os.environ.get("TRANSPORT_KEY")
+transport_url = os.environ.get("TRANSPORT_URL", "https://transportapi.com")
+
+# Postcodes API
+postcodes_url = os.environ.get("POSTCODES_URL", "https://api.postcodes.io")
+
+# Connection pooling - (connect, read) timeouts in seconds for each upstream
+upstream_timeouts = {
+    "postcodes": (3.05, 5),
+    "transport": (3.05, 15),
+    "weather": (3.05, 5)
+}
+# Maximum number of kept-alive connections per upstream host
+upstream_pool_size = int(os.environ.get("UPSTREAM_POOL_SIZE", 10))
+
+# Postcode lookups - threads used when several lookups run concurrently
+postcode_lookup_workers = int(os.environ.get("POSTCODE_LOOKUP_WORKERS", 8))
+# Postcode cache - entries held and seconds that valid/invalid postcodes live
+postcode_cache_size = int(os.environ.get("POSTCODE_CACHE_SIZE", 10000))
+postcode_cache_ttl = 24 * 60 * 60
+postcode_cache_negative_ttl = 10 * 60
+# Offline postcode index built with postcode_index.py. If set, postcodes are
+# resolved from the index instead of postcodes.io
+postcode_index_path = os.environ.get("POSTCODE_INDEX")
+# Weather cache - grid cell size in degrees (0.01 is roughly 1km), entries
+# held and seconds that the weather of a cell lives
+weather_grid_resolution = float(os.environ.get("WEATHER_GRID_RESOLUTION",
+                                               0.01))
+weather_cache_size = int(os.environ.get("WEATHER_CACHE_SIZE", 5000))
+weather_cache_ttl = 10 * 60
+
+# Background work (cache refreshes, prefetching) - threads and the maximum
+# number of tasks queued or running at once
+background_workers = int(os.environ.get("BACKGROUND_WORKERS", 4))
+background_queue_size = int(os.environ.get("BACKGROUND_QUEUE_SIZE", 64))
+
+# Route cache - entries held, seconds routes stay fresh and seconds an
+# expired route is still served while it is refreshed in the background
+route_cache_size = int(os.environ.get("ROUTE_CACHE_SIZE", 2000))
+route_cache_ttl = 2 * 60
+route_cache_stale_ttl = 60
+# Requested times within the same bucket (minutes) share cached routes,
+# requested at the bucket's end for departures and its start for arrivals
+route_time_bucket = int(os.environ.get("ROUTE_TIME_BUCKET", 5))
+# Seconds a prefetched weather result waits to be picked up
+weather_prefetch_ttl = 60
+
+# Batch route API - threads shared by all batches, the default and maximum
+# lookups one batch runs at once, and the maximum jobs in a batch
+batch_workers = int(os.environ.get("BATCH_WORKERS", 16))
+batch_concurrency = int(os.environ.get("BATCH_CONCURRENCY", 8))
+batch_max_jobs = int(os.environ.get("BATCH_MAX_JOBS", 500))
+
+# Circuit breakers - the circuit of an upstream opens when this fraction of
+# calls within the window (seconds) fail, once there have been enough calls.
+# It stays open for circuit_open_seconds, then lets probe calls through
+circuit_failure_rate = 0.5
+circuit_min_calls = 10
+circuit_window = 30
+circuit_open_seconds = 15
+circuit_probes = 1
+
+# Deadline budget - seconds a page request may spend on upstream calls, and
+# the share of the budget each upstream may use for one call
+request_deadline = float(os.environ.get("REQUEST_DEADLINE", 12))
+deadline_shares = {
+    "postcodes": 0.25,
+    "transport": 0.5,
+    "weather": 0.25
+}
+
+# Coalescing - identical upstream requests in flight at the same time share
+# one call. Query parameters holding credentials are ignored when comparing
+coalesce_requests = os.environ.get("COALESCE_REQUESTS", "1") != "0"
+credential_params = ["app_id", "app_key", "appid"]
+
+# Sessions - the cookie carries a session ID signed with the secret key, and
+# the data is kept in a store shared by every worker. Backends: "memory"
+# (single process), "sqlite" (one host) or "remote" (see session_store.py)
+secret_key = os.environ.get("SECRET_KEY")
+session_backend = os.environ.get("SESSION_BACKEND", "memory")
+session_sqlite_path = os.environ.get("SESSION_SQLITE_PATH", "sessions.db")
+session_store_address = os.environ.get("SESSION_STORE_ADDRESS",
+                                       "127.0.0.1:8200")
+session_store_timeout = 2
+session_ttl = int(os.environ.get("SESSION_TTL", 86400))
+
+# HTTP caching and compression - seconds clients may reuse the static pages,
+# and the responses worth compressing
+static_page_max_age = int(os.environ.get("STATIC_PAGE_MAX_AGE", 300))
+compress_types = ["text/html", "text/css", "text/plain", "text/javascript",
+                  "application/javascript", "application/json",
+                  "image/svg+xml"]
+compress_min_size = 500
+gzip_level = 6
+brotli_level = 5
+compression_cache_size = 1000
+compression_cache_ttl = 600
+precompress_static = os.environ.get("PRECOMPRESS_STATIC", "1") != "0"
+
+# Production server (serve.py) - worker processes, threads handling requests
+# in each worker, and seconds a stopping worker has to finish its requests
+serve_host = os.environ.get("HOST", "127.0.0.1")
+serve_port = int(os.environ.get("PORT", 8000))
+serve_workers = int(os.environ.get("WORKERS", os.cpu_count() or 1))
+serve_threads = int(os.environ.get("THREADS", 16))
+# Serve asgi.application: the upstream-bound pages are served by coroutines
+serve_asgi = os.environ.get("SERVE_ASGI", "0") == "1"
+graceful_timeout = 30
+keepalive_timeout = 5
+worker_restart_delay = 1
+# Connections opened to each upstream by a worker before it serves
+warmup_connections = 2
+
+# Route weather - weather where each part of a route starts. Distinct grid
+# cells are fetched concurrently by route_weather_workers threads, at most
+# route_weather_max_cells per page, waiting up to route_weather_timeout.
+# Fetches beyond route_weather_queue_size queued or running are dropped
+route_weather = os.environ.get("ROUTE_WEATHER", "1") != "0"
+route_weather_workers = 8
+route_weather_queue_size = 32
+route_weather_max_cells = 12
+route_weather_timeout = 2
+
+# Departure time sweep - minutes covered after the requested time, minutes
+# between the times, and route lookups running at once for one sweep
+sweep_window = int(os.environ.get("SWEEP_WINDOW", 60))
+sweep_step = int(os.environ.get("SWEEP_STEP", 10))
+sweep_concurrency = 6
+sweep_workers = 16
+# Most seconds a sweep lookup waits for the quota. The sweep's page is
+# waiting, so a lookup that would wait longer shows an error instead
+sweep_max_wait = 10
+
+# Rate limits - (calls per minute, largest burst) allowed by the quota of
+# each upstream's API key, or None for no limit. Calls without quota wait in
+# a queue of rate_queue_size for at most rate_max_wait seconds (less if the
+# page request's deadline budget is shorter), or longer for background work
+rate_limits = {
+    "postcodes": None,
+    "transport": (int(os.environ.get("TRANSPORT_RATE_LIMIT", 30)), 5),
+    "weather": (int(os.environ.get("OPENWEATHER_RATE_LIMIT", 60)), 10)
+}
+# Servers (or processes not sharing a bucket) calling the upstreams with the
+# same keys - each keeps within its share of the quotas
+rate_limit_processes = int(os.environ.get("RATE_LIMIT_PROCESSES", 0))
+# Directory of the buckets shared by the processes of a server, or "" to
+# keep each process's bucket in memory. serve.py sets one for its workers
+rate_limit_shared_dir = os.environ.get("RATE_LIMIT_SHARED_DIR", "")
+rate_queue_size = 20
+rate_max_wait = 3
+rate_max_wait_background = 15
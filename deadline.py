@@ -0,0 +1,89 @@
+"""
+Title: Deadline budget of the current page request. Each upstream gets a
+            share of the budget, and calls made once it is spent fail fast
+Author: Primus27
+Date: 10/2026
+"""
+
+# Import packages
+import contextlib
+import contextvars
+import time
+import requests
+import config
+
+# (deadline, total seconds) of the request being handled. A context
+# variable, so that it is also seen by the request's coroutines
+_budget = contextvars.ContextVar("deadline_budget", default=None)
+
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    """
+    Raised instead of calling an upstream once the budget is spent
+    """
+
+
+def start(seconds):
+    """
+    Start the deadline budget of the request handled by this thread
+    :param seconds: Total seconds the request may spend on upstream calls
+    """
+    _budget.set((time.monotonic() + seconds, seconds))
+
+
+def clear():
+    """
+    Remove the deadline of this thread (e.g. once the request is finished)
+    """
+    _budget.set(None)
+
+
+def current():
+    """
+    :return: The budget of this thread, to apply later with within, or None
+                if it has none
+    """
+    return _budget.get()
+
+
+@contextlib.contextmanager
+def within(budget):
+    """
+    Apply a budget taken with current to the calls made in the block. Used
+        by a streamed page, whose body is sent after its request has been
+        torn down
+    :param budget: The budget, or None for no budget
+    """
+    token = _budget.set(budget)
+    try:
+        yield
+    finally:
+        _budget.reset(token)
+
+
+def remaining():
+    """
+    :return: Seconds left of this thread's budget, or None if it has none
+    """
+    budget = _budget.get()
+    if budget is None:
+        return None
+    return budget[0] - time.monotonic()
+
+
+def timeout_for(upstream, timeout):
+    """
+    Limit the timeout of an upstream call to the upstream's share of the
+        budget and to the time left. Raises DeadlineExceeded if the budget
+        is spent
+    :param upstream: Name of the upstream (key of config.deadline_shares)
+    :param timeout: The (connect, read) timeout configured for the upstream
+    :return: The (connect, read) timeout to use
+    """
+    left = remaining()
+    if left is None:
+        return timeout  # Not within a page request
+    elif left <= 0:
+        raise DeadlineExceeded("Deadline budget of the request is spent")
+    allowance = min(left, _budget.get()[1] * config.deadline_shares[upstream])
+    return min(timeout[0], allowance), min(timeout[1], allowance)
@@ -0,0 +1,88 @@
+"""
+Title: HTTP caching of pages. Result pages get an ETag derived from their
+            data and are revalidated on every view, so a refresh costs a
+            304. Static pages are rendered once per process and may be
+            reused by clients for a while
+Author: Primus27
+Date: 10/2026
+"""
+
+# Import packages
+from flask import request, make_response, render_template, Response
+import hashlib
+import json
+import threading
+
+_pages = {}  # (template, script root): rendered page
+_pages_lock = threading.Lock()
+
+
+def etag_for(*data):
+    """
+    Derive an entity tag from the data a page is rendered from
+    :param data: JSON serialisable objects
+    :return: The tag
+    """
+    encoded = json.dumps(data, sort_keys=True, separators=(",", ":"),
+                         default=str).encode()
+    return hashlib.blake2b(encoded, digest_size=12).hexdigest()
+
+
+def conditional(etag, max_age, render, *args, public=False, **kwargs):
+    """
+    Answer a conditional GET with a 304 if the client's copy of the page is
+        current, and only render the page otherwise
+    :param etag: Tag of the data the page is rendered from (see etag_for).
+                    The tag is weak, as it doesn't change with the encoding
+    :param max_age: Seconds the client may reuse the page without asking.
+                    If None, the client revalidates it on every view (for
+                    pages whose url doesn't identify their data)
+    :param render: Function returning the page, e.g. render_template
+    :param public: Whether shared caches may store the page. Otherwise it is
+                    private to the user's session
+    :return: The response
+    """
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = make_response(render(*args, **kwargs))
+    response.set_etag(etag, weak=True)
+    if max_age is None:
+        response.cache_control.no_cache = True
+    else:
+        response.cache_control.max_age = max_age
+    if public:
+        response.cache_control.public = True
+    else:
+        response.cache_control.private = True
+        response.vary.add("Cookie")
+    return response
+
+
+def render_static(template, max_age=None):
+    """
+    Render a page that doesn't depend on the request, once per process.
+        Conditional GETs are answered with a 304
+    :param template: Name of the template
+    :param max_age: Seconds the page stays fresh. If None, the page is not
+                    cached by clients (e.g. error pages)
+    :return: The response
+    """
+    key = (template, request.script_root)
+    page = _pages.get(key)
+    if page is None:
+        page = render_template(template)
+        with _pages_lock:
+            _pages[key] = page
+    if max_age is None:
+        return page
+    return conditional(etag_for(template, page), max_age, lambda: page,
+                       public=True)
+
+
+def clear():
+    """
+    Forget every rendered static page (e.g. after the templates changed)
+    """
+    with _pages_lock:
+        _pages.clear()
@@ -0,0 +1,532 @@
+"""
+Title: Shared HTTP client used for every outbound API call. Keeps a pool of
+            kept-alive connections per upstream, applies its timeouts and
+            coalesces identical requests that are in flight at once. Each
+            call has a coroutine counterpart built on httpx
+Author: Primus27
+Date: 10/2026
+"""
+
+# Import packages
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+import asyncio
+import json
+import os
+import ssl
+import threading
+import weakref
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+import urllib3
+import cache
+import circuit_breaker
+import deadline
+import metrics
+import rate_limit
+import config
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+_stats = {}
+_stats_lock = threading.Lock()
+_flights = {}  # Upstream: cache.SingleFlight of its requests in flight
+_flights_lock = threading.Lock()
+# Event loop: {upstream: httpx.AsyncClient}. Connections belong to the loop
+# that opened them
+_async_clients = weakref.WeakKeyDictionary()
+# Event loop: {request key: Task of the coroutine request in flight}
+_async_flights = weakref.WeakKeyDictionary()
+_async_saved = {}  # Upstream: coroutine requests coalesced
+# httpx exceptions and the requests exceptions they are raised as, so the
+# error handling of the blocking calls applies. The first match is used
+_async_errors = (
+    (httpx.ConnectTimeout, requests.exceptions.ConnectTimeout),
+    (httpx.TimeoutException, requests.exceptions.ReadTimeout),
+    (httpx.UnsupportedProtocol, requests.exceptions.InvalidSchema),
+    (httpx.TransportError, requests.exceptions.ConnectionError),
+    (httpx.TooManyRedirects, requests.exceptions.TooManyRedirects),
+    (httpx.DecodingError, requests.exceptions.ContentDecodingError),
+    (httpx.InvalidURL, requests.exceptions.InvalidURL),
+    (httpx.HTTPError, requests.exceptions.RequestException)
+)
+
+
+def _record(upstream, key):
+    """
+    Increment one of the connection statistics of an upstream
+    :param upstream: Name of the upstream (key of config.upstream_timeouts)
+    :param key: The statistic to increment ("requests" or "connections")
+    """
+    with _stats_lock:
+        counters = _stats.setdefault(upstream,
+                                     {"requests": 0, "connections": 0})
+        counters[key] += 1
+
+
+def _counting_pool(pool_class, upstream):
+    """
+    Create a connection pool class that records every new connection (and
+        therefore every TCP/TLS handshake) made to an upstream
+    :param pool_class: The urllib3 connection pool class to extend
+    :param upstream: Name of the upstream the pool belongs to
+    :return: The connection pool class
+    """
+    class CountingPool(pool_class):
+        def _new_conn(self):
+            _record(upstream, "connections")
+            return super()._new_conn()
+    return CountingPool
+
+
+class PooledAdapter(HTTPAdapter):
+    """
+    Transport adapter that keeps connections to one upstream alive and counts
+        how often a new connection has to be opened
+    """
+    def __init__(self, upstream, **kwargs):
+        """
+        Constructor for the adapter
+        :param upstream: Name of the upstream the adapter is mounted for
+        """
+        self.upstream = upstream
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _counting_pool(HTTPConnectionPool, self.upstream),
+            "https": _counting_pool(HTTPSConnectionPool, self.upstream)
+        }
+
+
+def get_session(upstream):
+    """
+    Fetch the session of an upstream, creating it on first use
+    :param upstream: Name of the upstream (key of config.upstream_timeouts)
+    :return: The requests session for the upstream
+    """
+    session = _sessions.get(upstream)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(upstream)
+            if session is None:
+                session = requests.Session()
+                adapter = PooledAdapter(
+                    upstream, pool_connections=2,
+                    pool_maxsize=config.upstream_pool_size, pool_block=False)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _sessions[upstream] = session
+    return session
+
+
+def warm_up(upstream, url, connections=1):
+    """
+    Open connections to an upstream ahead of its first request, so the
+        TCP/TLS handshakes aren't paid by a user. No request is sent
+    :param upstream: Name of the upstream (key of config.upstream_timeouts)
+    :param url: Base url of the upstream
+    :param connections: Number of connections to open
+    :return: Number of connections opened
+    """
+    session = get_session(upstream)
+    # The pool that requests to the url will use (the CA bundle and proxies
+    # can be set by environment variables)
+    settings = session.merge_environment_settings(url, {}, None, None, None)
+    pool = session.get_adapter(url).get_connection_with_tls_context(
+        requests.Request("GET", url).prepare(), verify=settings["verify"],
+        proxies=settings["proxies"], cert=settings["cert"])
+    opened = []
+    try:
+        for _ in range(min(connections, config.upstream_pool_size)):
+            connection = pool._get_conn()
+            connection.timeout = config.upstream_timeouts[upstream][0]
+            try:
+                connection.connect()
+            except (OSError, urllib3.exceptions.HTTPError):
+                connection.close()
+                break
+            finally:
+                opened.append(connection)
+    finally:
+        for connection in opened:
+            pool._put_conn(connection)
+    return sum(1 for connection in opened if connection.is_connected)
+
+
+def request(upstream, method, url, **kwargs):
+    """
+    Send a request to an upstream through its pooled session. The request
+        waits for the upstream's rate limit, its timeout is limited by the
+        deadline budget of the page request, and it fails fast if the
+        upstream's circuit is open
+    :param upstream: Name of the upstream (key of config.upstream_timeouts)
+    :param method: The HTTP method, e.g. "GET"
+    :param url: The full url of the request
+    :param kwargs: Additional arguments passed to requests
+    :return: The response. Raises requests exceptions on failure (including
+                rate_limit.RateLimited, circuit_breaker.CircuitOpenError and
+                deadline.DeadlineExceeded)
+    """
+    rate_limit.acquire(upstream)
+    kwargs["timeout"] = deadline.timeout_for(
+        upstream, kwargs.get("timeout", config.upstream_timeouts[upstream]))
+    breaker = circuit_breaker.get_breaker(upstream)
+    generation = breaker.before_call()
+    _record(upstream, "requests")
+    try:
+        r = get_session(upstream).request(method, url, **kwargs)
+    except (requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout):
+        breaker.record(generation, False)
+        raise
+    except Exception:
+        # Not caused by the upstream (e.g. bad url)
+        breaker.record(generation, True)
+        raise
+    except BaseException:
+        # Cancelled - says nothing about the upstream
+        breaker.release(generation)
+        raise
+    breaker.record(generation, r.status_code < 500)
+    return r
+
+
+def _ssl_context():
+    """
+    Create the TLS settings of the coroutine clients. A CA bundle set for
+        requests (REQUESTS_CA_BUNDLE or CURL_CA_BUNDLE) applies to them too
+    :return: An ssl.SSLContext, or True to use httpx's default (which
+                reads SSL_CERT_FILE and SSL_CERT_DIR)
+    """
+    bundle = os.environ.get("REQUESTS_CA_BUNDLE") or \
+        os.environ.get("CURL_CA_BUNDLE")
+    if not bundle:
+        return True
+    elif os.path.isdir(bundle):
+        return ssl.create_default_context(capath=bundle)
+    return ssl.create_default_context(cafile=bundle)
+
+
+def get_async_client(upstream):
+    """
+    Fetch the client of an upstream for the running event loop, creating it
+        on first use. Like the blocking sessions, it follows redirects and
+        reads proxies and CA bundles from environment variables
+    :param upstream: Name of the upstream (key of config.upstream_timeouts)
+    :return: The httpx.AsyncClient for the upstream
+    """
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    client = clients.get(upstream)
+    if client is None:
+        client = httpx.AsyncClient(
+            verify=_ssl_context(), trust_env=True, follow_redirects=True,
+            max_redirects=requests.models.DEFAULT_REDIRECT_LIMIT,
+            limits=httpx.Limits(
+                max_connections=None,
+                max_keepalive_connections=config.upstream_pool_size))
+        clients[upstream] = client
+    return client
+
+
+async def close_async_clients():
+    """
+    Close the clients (and their kept-alive connections) of the running
+        event loop
+    """
+    clients = _async_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.aclose()
+
+
+def _requests_error(error):
+    """
+    Convert an httpx exception to the matching requests exception
+    :param error: The httpx exception
+    :return: The requests exception
+    """
+    for (httpx_error, requests_error) in _async_errors:
+        if isinstance(error, httpx_error):
+            return requests_error(str(error) or type(error).__name__)
+
+
+def raise_for_status(r):
+    """
+    Raise requests.exceptions.HTTPError if the response of a coroutine call
+        is an error, as the response of a blocking call would
+    :param r: The httpx.Response
+    """
+    if r.status_code >= 400:
+        raise requests.exceptions.HTTPError(
+            "{code} {reason} for url: {url}".format(
+                code=r.status_code, reason=r.reason_phrase, url=r.url),
+            response=r)
+
+
+async def request_async(upstream, method, url, payload=None, timeout=None):
+    """
+    Coroutine version of request. The rate limit, deadline budget and
+        circuit breaker of the upstream apply in the same way
+    :param upstream: Name of the upstream (key of config.upstream_timeouts)
+    :param method: The HTTP method, e.g. "GET"
+    :param url: The full url of the request
+    :param payload: Object to send as the JSON body, if any
+    :param timeout: The (connect, read) timeout. Defaults to the upstream's
+    :return: The httpx.Response, read in full (check it with
+                raise_for_status). Raises requests exceptions on failure
+                (see request)
+    """
+    await rate_limit.acquire_async(upstream)
+    (connect, read) = deadline.timeout_for(
+        upstream, timeout or config.upstream_timeouts[upstream])
+    breaker = circuit_breaker.get_breaker(upstream)
+    generation = breaker.before_call()
+    _record(upstream, "requests")
+
+    async def trace(event, info):
+        if event == "connection.connect_tcp.complete":
+            _record(upstream, "connections")
+    try:
+        try:
+            r = await get_async_client(upstream).request(
+                method, url, json=payload,
+                timeout=httpx.Timeout(connect=connect, read=read,
+                                      write=read, pool=connect),
+                extensions={"trace": trace})
+        except (httpx.HTTPError, httpx.InvalidURL) as e:
+            raise _requests_error(e) from e
+    except (requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout):
+        breaker.record(generation, False)
+        raise
+    except Exception:
+        # Not caused by the upstream (e.g. bad url)
+        breaker.record(generation, True)
+        raise
+    except BaseException:
+        # Cancelled - says nothing about the upstream
+        breaker.release(generation)
+        raise
+    breaker.record(generation, r.status_code < 500)
+    return r
+
+
+def request_key(method, url, payload=None):
+    """
+    Identify a request, ignoring credentials and the order of query
+        parameters, so identical requests can be coalesced
+    :param method: The HTTP method, e.g. "GET"
+    :param url: The full url of the request
+    :param payload: Object sent as the JSON body, if any
+    :return: A tuple identifying the request
+    """
+    parts = urlsplit(url)
+    query = sorted((name, value) for name, value in parse_qsl(parts.query)
+                   if name not in config.credential_params)
+    normalised = urlunsplit((parts.scheme.lower(), parts.netloc.lower(),
+                             parts.path, urlencode(query), ""))
+    body = None if payload is None else json.dumps(payload, sort_keys=True)
+    return method, normalised, body
+
+
+def coalesce(upstream, key, function, *args, **kwargs):
+    """
+    Run a function making an upstream call, or wait for the identical call
+        already in flight and share its result or exception. A page request
+        waits no longer than its deadline budget allows
+    :param upstream: Name of the upstream (key of config.upstream_timeouts)
+    :param key: Identifies the call, as returned by request_key
+    :param function: The function making the call
+    :return: The result of the function. Raises its exception on failure
+    """
+    if not config.coalesce_requests:
+        return function(*args, **kwargs)
+    flight = _flights.get(upstream)
+    if flight is None:
+        with _flights_lock:
+            flight = _flights.setdefault(upstream, cache.SingleFlight())
+    try:
+        return flight.do_within(deadline.remaining(), key, function, *args,
+                                **kwargs)
+    except cache.WaitTimeout:
+        raise deadline.DeadlineExceeded("Deadline budget of the request is "
+                                        "spent")
+
+
+async def coalesce_async(upstream, key, function, *args):
+    """
+    Coroutine version of coalesce. Identical calls are coalesced within the
+        event loop they run on
+    :param upstream: Name of the upstream (key of config.upstream_timeouts)
+    :param key: Identifies the call, as returned by request_key
+    :param function: The coroutine function making the call
+    :return: The result of the function. Raises its exception on failure
+    """
+    if not config.coalesce_requests:
+        return await function(*args)
+    flights = _async_flights.setdefault(asyncio.get_running_loop(), {})
+    task = flights.get((upstream, key))
+    if task is None:
+        task = asyncio.ensure_future(function(*args))
+        flights[(upstream, key)] = task
+        task.add_done_callback(lambda _: flights.pop((upstream, key), None))
+    else:
+        _async_saved[upstream] = _async_saved.get(upstream, 0) + 1
+    # A caller that gives up doesn't cancel the call for the others
+    try:
+        return await asyncio.wait_for(asyncio.shield(task),
+                                      deadline.remaining())
+    except asyncio.TimeoutError:
+        if task.done():
+            # Finished as the wait ran out (or raised TimeoutError itself)
+            return task.result()
+        raise deadline.DeadlineExceeded("Deadline budget of the request is "
+                                        "spent")
+
+
+def _get_json(upstream, url, operation, kwargs):
+    """
+    GET a url from an upstream and decode the JSON body (see get_json)
+    """
+    with metrics.time_upstream(operation or upstream):
+        r = request(upstream, "GET", url, **kwargs)
+        r.raise_for_status()
+        return r.json()
+
+
+def _post_json(upstream, url, payload, operation, kwargs):
+    """
+    POST a JSON payload to an upstream and decode the JSON body (see
+        post_json)
+    """
+    with metrics.time_upstream(operation or upstream):
+        r = request(upstream, "POST", url, json=payload, **kwargs)
+        r.raise_for_status()
+        return r.json()
+
+
+async def _get_json_async(upstream, url, operation):
+    """
+    Coroutine version of _get_json
+    """
+    with metrics.time_upstream(operation or upstream):
+        r = await request_async(upstream, "GET", url)
+        raise_for_status(r)
+        return r.json()
+
+
+async def _post_json_async(upstream, url, payload, operation):
+    """
+    Coroutine version of _post_json
+    """
+    with metrics.time_upstream(operation or upstream):
+        r = await request_async(upstream, "POST", url, payload)
+        raise_for_status(r)
+        return r.json()
+
+
+def get_json(upstream, url, operation=None, **kwargs):
+    """
+    GET a url from an upstream and decode the JSON body
+    :param upstream: Name of the upstream (key of config.upstream_timeouts)
+    :param url: The full url of the request
+    :param operation: Name the latency is recorded under. Defaults to the
+                        upstream
+    :return: The decoded JSON, shared with identical requests in flight.
+                Raises requests exceptions on failure (including HTTPError if
+                status_code != 200) and ValueError if the body could not be
+                decoded
+    """
+    return coalesce(upstream, request_key("GET", url), _get_json, upstream,
+                    url, operation, kwargs)
+
+
+def post_json(upstream, url, payload, operation=None, **kwargs):
+    """
+    POST a JSON payload to an upstream and decode the JSON body
+    :param upstream: Name of the upstream (key of config.upstream_timeouts)
+    :param url: The full url of the request
+    :param payload: Object to send as the JSON body
+    :param operation: Name the latency is recorded under. Defaults to the
+                        upstream
+    :return: The decoded JSON, shared with identical requests in flight.
+                Raises requests exceptions on failure (including HTTPError if
+                status_code != 200) and ValueError if the body could not be
+                decoded
+    """
+    return coalesce(upstream, request_key("POST", url, payload), _post_json,
+                    upstream, url, payload, operation, kwargs)
+
+
+async def get_json_async(upstream, url, operation=None):
+    """
+    Coroutine version of get_json
+    :param upstream: Name of the upstream (key of config.upstream_timeouts)
+    :param url: The full url of the request
+    :param operation: Name the latency is recorded under. Defaults to the
+                        upstream
+    :return: The decoded JSON, shared with identical requests in flight on
+                the event loop. Raises the exceptions of get_json
+    """
+    return await coalesce_async(upstream, request_key("GET", url),
+                                _get_json_async, upstream, url, operation)
+
+
+async def post_json_async(upstream, url, payload, operation=None):
+    """
+    Coroutine version of post_json
+    :param upstream: Name of the upstream (key of config.upstream_timeouts)
+    :param url: The full url of the request
+    :param payload: Object to send as the JSON body
+    :param operation: Name the latency is recorded under. Defaults to the
+                        upstream
+    :return: The decoded JSON, shared with identical requests in flight on
+                the event loop. Raises the exceptions of post_json
+    """
+    return await coalesce_async(upstream, request_key("POST", url, payload),
+                                _post_json_async, upstream, url, payload,
+                                operation)
+
+
+def stats():
+    """
+    Connection reuse statistics for each upstream
+    :return: Dictionary of upstream name to the number of requests sent, new
+                connections (handshakes) made and requests that reused a
+                kept-alive connection
+    """
+    with _stats_lock:
+        return {upstream: {"requests": counters["requests"],
+                           "connections": counters["connections"],
+                           "reused": max(counters["requests"] -
+                                         counters["connections"], 0)}
+                for upstream, counters in _stats.items()}
+
+
+def _collect():
+    """
+    :return: List of lines exposing the connection statistics
+    """
+    upstream_stats = sorted(stats().items())
+    return metrics.samples(
+        "upstream_requests_total", "counter",
+        "Requests sent to each upstream", ("upstream",),
+        [((upstream, ), s["requests"]) for upstream, s in upstream_stats]) + \
+        metrics.samples(
+            "upstream_connections_total", "counter",
+            "New connections (TCP/TLS handshakes) made to each upstream",
+            ("upstream",),
+            [((upstream, ), s["connections"])
+             for upstream, s in upstream_stats]) + \
+        metrics.samples(
+            "upstream_coalesced_total", "counter",
+            "Requests that waited for an identical request in flight "
+            "instead of calling the upstream", ("upstream",),
+            [((upstream, ), getattr(_flights.get(upstream), "saved", 0) +
+              _async_saved.get(upstream, 0))
+             for upstream in sorted(set(_flights) | set(_async_saved))])
+
+
+metrics.register_collector(_collect)
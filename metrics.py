@@ -0,0 +1,294 @@
+"""
+Title: Lightweight instrumentation. Counters and latency histograms are
+            kept in memory and exposed in the Prometheus text format
+Author: Primus27
+Date: 10/2026
+"""
+
+# Import packages
+from bisect import bisect_left
+import contextlib
+import threading
+import time
+import requests
+
+# Latency buckets in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10, 30)
+
+_metrics = []
+_collectors = []
+_caches = {}
+
+
+def _format_labels(labelnames, labelvalues, extra=""):
+    """
+    Format the labels of a sample
+    :param labelnames: Tuple of label names
+    :param labelvalues: Tuple of label values, in the same order
+    :param extra: Additional formatted label (e.g. 'le="0.5"')
+    :return: The labels in braces, or "" if there are none
+    """
+    labels = ['{name}="{value}"'.format(
+        name=name, value=str(value).replace("\\", "\\\\")
+        .replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        labels.append(extra)
+    if not labels:
+        return ""
+    return "{" + ",".join(labels) + "}"
+
+
+def _format_value(value):
+    """
+    Format a sample value
+    :param value: The number
+    :return: The value as a string
+    """
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    A value that only increases, e.g. the number of errors
+    """
+    def __init__(self, name, documentation, labelnames=()):
+        """
+        Constructor for the counter, which is registered for exposition
+        :param name: Metric name
+        :param documentation: Help text
+        :param labelnames: Tuple of label names
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        """
+        Increase the counter
+        :param amount: Amount to increase by
+        :param labels: Value of each label
+        """
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def expose(self):
+        """
+        :return: List of lines in the text exposition format
+        """
+        lines = ["# HELP {name} {doc}".format(name=self.name,
+                                              doc=self.documentation),
+                 "# TYPE {name} counter".format(name=self.name)]
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.append(self.name + _format_labels(self.labelnames, key) +
+                         " " + _format_value(value))
+        return lines
+
+
+class Histogram:
+    """
+    Distribution of observed values (e.g. latencies) in buckets
+    """
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        """
+        Constructor for the histogram, which is registered for exposition
+        :param name: Metric name
+        :param documentation: Help text
+        :param labelnames: Tuple of label names
+        :param buckets: Sorted upper bounds of the buckets
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self._values = {}  # labels: [bucket counts, sum]
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value, **labels):
+        """
+        Record a value
+        :param value: The observed value
+        :param labels: Value of each label
+        """
+        key = tuple(labels[name] for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [[0] * len(self.buckets), 0.0]
+            counts[0][index] += 1
+            counts[1] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """
+        Context manager recording the seconds spent inside it
+        :param labels: Value of each label
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def expose(self):
+        """
+        :return: List of lines in the text exposition format
+        """
+        lines = ["# HELP {name} {doc}".format(name=self.name,
+                                              doc=self.documentation),
+                 "# TYPE {name} histogram".format(name=self.name)]
+        with self._lock:
+            values = sorted((key, (list(counts[0]), counts[1]))
+                            for key, counts in self._values.items())
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(self.name + "_bucket" + _format_labels(
+                    self.labelnames, key,
+                    'le="' + _format_value(bound) + '"') + " " +
+                    str(cumulative))
+            labels = _format_labels(self.labelnames, key)
+            lines.append(self.name + "_sum" + labels + " " + repr(total))
+            lines.append(self.name + "_count" + labels + " " +
+                         str(cumulative))
+        return lines
+
+
+def samples(name, metric_type, documentation, labelnames, values):
+    """
+    Format a metric whose values are kept elsewhere, for use by collectors
+    :param name: Metric name
+    :param metric_type: "counter" or "gauge"
+    :param documentation: Help text
+    :param labelnames: Tuple of label names
+    :param values: List of tuples containing the label values and the value
+    :return: List of lines in the text exposition format
+    """
+    lines = ["# HELP {name} {doc}".format(name=name, doc=documentation),
+             "# TYPE {name} {type}".format(name=name, type=metric_type)]
+    for labelvalues, value in values:
+        lines.append(name + _format_labels(labelnames, labelvalues) + " " +
+                     _format_value(value))
+    return lines
+
+
+def register_collector(function):
+    """
+    Register a function that is called on every scrape to expose values kept
+        elsewhere (e.g. cache statistics)
+    :param function: Function returning a list of lines in the text
+                        exposition format
+    """
+    _collectors.append(function)
+
+
+def register_cache(name, cache_obj):
+    """
+    Expose the hits, misses, size and hit ratio of a cache
+    :param name: Value of the "cache" label
+    :param cache_obj: A cache.TTLCache
+    """
+    _caches[name] = cache_obj
+
+
+def _collect_caches():
+    """
+    :return: List of lines exposing the statistics of registered caches
+    """
+    stats = [((name,), cache_obj.stats())
+             for name, cache_obj in sorted(_caches.items())]
+    return samples("cache_hits_total", "counter",
+                   "Cache lookups that were hits", ("cache",),
+                   [(key, s["hits"]) for key, s in stats]) + \
+        samples("cache_misses_total", "counter",
+                "Cache lookups that were misses", ("cache",),
+                [(key, s["misses"]) for key, s in stats]) + \
+        samples("cache_entries", "gauge", "Entries held by the cache",
+                ("cache",), [(key, s["size"]) for key, s in stats]) + \
+        samples("cache_hit_ratio", "gauge", "Hits divided by lookups",
+                ("cache",),
+                [(key, s["hits"] / max(s["hits"] + s["misses"], 1))
+                 for key, s in stats])
+
+
+register_collector(_collect_caches)
+
+
+def exposition():
+    """
+    Render every metric in the Prometheus text exposition format
+    :return: The metrics as a string
+    """
+    lines = []
+    for metric in _metrics:
+        lines += metric.expose()
+    for function in _collectors:
+        lines += function()
+    return "\n".join(lines) + "\n"
+
+
+upstream_latency = Histogram(
+    "upstream_request_duration_seconds",
+    "Latency of calls to upstream APIs, including reading the response",
+    ("operation", "outcome"))
+request_latency = Histogram(
+    "http_request_duration_seconds",
+    "Time taken to produce a response, by endpoint",
+    ("endpoint", "method", "status"))
+render_latency = Histogram(
+    "template_render_duration_seconds", "Time taken to render a template",
+    ("template",))
+error_messages = Counter(
+    "error_messages_total",
+    "Error messages shown to users (API errors and invalid form input)",
+    ("template",))
+
+
+def outcome(error):
+    """
+    Classify the exception raised by an upstream call
+    :param error: The exception
+    :return: The value of the "outcome" label
+    """
+    if getattr(error, "outcome", None):
+        return error.outcome  # e.g. circuit_open
+    elif isinstance(error, requests.exceptions.HTTPError):
+        return "http_error"
+    elif isinstance(error, requests.exceptions.Timeout):
+        return "timeout"
+    elif isinstance(error, requests.exceptions.ConnectionError):
+        return "connection"
+    elif isinstance(error, ValueError):
+        return "json_decode"
+    return "error"
+
+
+@contextlib.contextmanager
+def time_upstream(operation):
+    """
+    Context manager recording the latency and outcome of an upstream call
+    :param operation: Value of the "operation" label, e.g. "openweather"
+    """
+    start = time.perf_counter()
+    result = "ok"
+    try:
+        yield
+    except Exception as e:
+        result = outcome(e)
+        raise
+    finally:
+        upstream_latency.observe(time.perf_counter() - start,
+                                 operation=operation, outcome=result)
@@ -0,0 +1,148 @@
+"""
+Title: Offline postcode index. Compiles an ONS Postcode Directory style CSV
+            into a sorted binary file that is memory-mapped and binary
+            searched, so postcodes can be resolved without postcodes.io
+Author: Primus27
+Date: 10/2026
+"""
+
+# Import packages
+import argparse
+import csv
+import mmap
+import os
+import struct
+import threading
+import utils
+
+MAGIC = b"PCIDX1\0\0"
+HEADER = struct.Struct("<8sI4x")  # Magic, number of records
+RECORD = struct.Struct("<8sii")  # Postcode, latitude, longitude (1e-6 deg)
+KEY_SIZE = 8
+NO_COORDINATE = -2 ** 31  # Stored for postcodes without a grid reference
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def _key(postcode):
+    """
+    Convert a postcode to its fixed width key in the index
+    :param postcode: The postcode as a string (format irrelevant)
+    :return: The key as bytes, or None if the postcode can't be a key
+    """
+    formatted = utils.format_pc(postcode)
+    try:
+        key = formatted.encode("ascii")
+    except UnicodeEncodeError:
+        return None
+    if not key or len(key) > KEY_SIZE:
+        return None
+    return key.ljust(KEY_SIZE, b"\0")
+
+
+def build_index(csv_path, index_path):
+    """
+    Compile a postcode directory CSV into an index file. Terminated
+        postcodes are left out
+    :param csv_path: Path of the CSV. Requires a "pcds" or "pcd" column and
+                        "lat" and "long" columns. A "doterm" column is used
+                        if present
+    :param index_path: Path the index file is written to
+    :return: The number of postcodes in the index
+    """
+    records = {}
+    with open(csv_path, newline="", encoding="utf-8-sig") as csv_file:
+        for row in csv.DictReader(csv_file):
+            if row.get("doterm"):
+                continue  # Postcode has been terminated
+            key = _key(row.get("pcds") or row.get("pcd") or "")
+            if key is None:
+                continue
+            lat = float(row["lat"])
+            lon = float(row["long"])
+            # ONSPD uses 99.999999 for postcodes without a grid reference
+            if lat > 90:
+                records[key] = RECORD.pack(key, NO_COORDINATE, NO_COORDINATE)
+            else:
+                records[key] = RECORD.pack(key, round(lat * 1e6),
+                                           round(lon * 1e6))
+
+    temp_path = index_path + ".tmp"
+    with open(temp_path, "wb") as index_file:
+        index_file.write(HEADER.pack(MAGIC, len(records)))
+        for key in sorted(records):
+            index_file.write(records[key])
+    os.replace(temp_path, index_path)
+    return len(records)
+
+
+class PostcodeIndex:
+    """
+    A read-only, memory-mapped index file. The mapping is shared between
+    every process that opens the same file.
+    """
+    def __init__(self, index_path):
+        """
+        Constructor for the index
+        :param index_path: Path of an index file created by build_index
+        """
+        with open(index_path, "rb") as index_file:
+            self._map = mmap.mmap(index_file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        magic, self.count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a postcode index: " + index_path)
+
+    def lookup(self, postcode):
+        """
+        Binary search the index for a postcode
+        :param postcode: The postcode as a string (format irrelevant)
+        :return: A tuple containing the coordinates (None for each if the
+                    postcode has no grid reference), or None if the postcode
+                    does not exist
+        """
+        key = _key(postcode)
+        if key is None:
+            return None
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            offset = HEADER.size + middle * RECORD.size
+            middle_key = self._map[offset:offset + KEY_SIZE]
+            if middle_key < key:
+                low = middle + 1
+            elif middle_key > key:
+                high = middle
+            else:
+                lat, lon = RECORD.unpack_from(self._map, offset)[1:]
+                if lat == NO_COORDINATE:
+                    return None, None
+                return lat / 1e6, lon / 1e6
+        return None
+
+
+def get_index(index_path):
+    """
+    Fetch the index at a path, opening it on first use
+    :param index_path: Path of an index file created by build_index
+    :return: The PostcodeIndex
+    """
+    index = _indexes.get(index_path)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.get(index_path)
+            if index is None:
+                index = PostcodeIndex(index_path)
+                _indexes[index_path] = index
+    return index
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Compile a postcode directory CSV into an index file")
+    parser.add_argument("csv_path", help="ONS Postcode Directory style CSV")
+    parser.add_argument("index_path", help="Index file to write")
+    args = parser.parse_args()
+    print("Indexed {count} postcodes".format(
+        count=build_index(args.csv_path, args.index_path)))
@@ -0,0 +1,350 @@
+"""
+Title: Resolves postcodes to their validity and coordinates. Many postcodes
+            are resolved in one call using the bulk postcode lookup and
+            results are cached. Lookups can also be awaited on an event
+            loop
+Author: Primus27
+Date: 10/2026
+"""
+
+# Import packages
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import requests
+import cache
+import http_client
+import metrics
+import postcode_index
+import utils
+import config
+
+# Maximum number of postcodes postcodes.io accepts in one bulk lookup
+BULK_LIMIT = 100
+
+_executor = ThreadPoolExecutor(max_workers=config.postcode_lookup_workers,
+                               thread_name_prefix="postcode-lookup")
+# Formatted postcode: coordinates (None if the postcode does not exist)
+postcode_cache = cache.TTLCache(
+    max_size=config.postcode_cache_size, ttl=config.postcode_cache_ttl,
+    negative_ttl=config.postcode_cache_negative_ttl)
+metrics.register_cache("postcodes", postcode_cache)
+
+
+def _coordinates(result):
+    """
+    Extract the coordinates from a postcodes.io result
+    :param result: The "result" object of a postcode lookup
+    :return: A tuple containing the latitude and longitude
+    """
+    return result["latitude"], result["longitude"]
+
+
+def _bulk_lookup(postcodes):
+    """
+    API call to look up several postcodes in one request
+    :param postcodes: List of formatted postcodes (at most BULK_LIMIT)
+    :return: Dictionary of postcode to coordinates (None if invalid).
+                Raises requests exceptions on failure
+    """
+    url = "{base}/postcodes".format(base=config.postcodes_url)
+    json_info = http_client.post_json("postcodes", url,
+                                      {"postcodes": postcodes},
+                                      operation="postcodes_bulk_lookup")
+    resolved = {}
+    for item in json_info["result"]:
+        postcode = utils.format_pc(item["query"])
+        if item["result"] is None:
+            resolved[postcode] = None
+        else:
+            resolved[postcode] = _coordinates(item["result"])
+    return resolved
+
+
+def _single_lookup(postcode):
+    """
+    API call to look up one postcode
+    :param postcode: The formatted postcode
+    :return: The coordinates, or None if the postcode does not exist.
+                Raises requests exceptions on failure
+    """
+    url = "{base}/postcodes/{postcode}" \
+        .format(base=config.postcodes_url, postcode=postcode)
+    try:
+        json_info = http_client.get_json("postcodes", url,
+                                         operation="postcodes_lookup")
+    except requests.exceptions.HTTPError as e:
+        if e.response is not None and e.response.status_code == 404:
+            return None  # Postcode does not exist
+        raise
+    return _coordinates(json_info["result"])
+
+
+def _bulk_unavailable(error):
+    """
+    Check whether a failed bulk lookup means the endpoint isn't available
+        (rather than the upstream failing or limiting calls, when a single
+        lookup per postcode would only add to the load)
+    :param error: The requests.exceptions.HTTPError of the bulk lookup
+    :return: Boolean on whether to fall back to single lookups
+    """
+    return error.response is not None and \
+        error.response.status_code in (404, 405)
+
+
+def _bulk_try(postcodes):
+    """
+    API call to look up several postcodes in one request, allowing the bulk
+        lookup to be unavailable
+    :param postcodes: List of formatted postcodes (at most BULK_LIMIT)
+    :return: The bulk lookup result, or None if the bulk lookup is not
+                available. Raises requests exceptions on other failures
+    """
+    try:
+        return _bulk_lookup(postcodes)
+    except requests.exceptions.HTTPError as e:
+        if _bulk_unavailable(e):
+            return None
+        raise
+
+
+def _lookup(postcodes):
+    """
+    Look up formatted postcodes. Batches of BULK_LIMIT are sent concurrently
+        and, if the bulk lookup isn't available, a batch falls back to
+        concurrent single lookups
+    :param postcodes: List of unique, formatted, non-empty postcodes
+    :return: Dictionary of postcode to coordinates (None if invalid).
+                Raises requests exceptions on failure
+    """
+    chunks = [postcodes[i:i + BULK_LIMIT]
+              for i in range(0, len(postcodes), BULK_LIMIT)]
+    # The first batch is sent from the calling thread, the rest concurrently
+    futures = [_executor.submit(_bulk_try, chunk) for chunk in chunks[1:]]
+    results = [_bulk_try(chunks[0])]
+    results += [future.result() for future in futures]
+
+    resolved = {}
+    fallback = []
+    for chunk, result in zip(chunks, results):
+        if result is None:
+            fallback += chunk
+        else:
+            resolved.update(result)
+    # Bulk lookup not available - look up each postcode concurrently
+    for postcode, coords in zip(fallback,
+                                _executor.map(_single_lookup, fallback)):
+        resolved[postcode] = coords
+    return resolved
+
+
+async def _bulk_lookup_async(postcodes):
+    """
+    Coroutine version of _bulk_lookup
+    """
+    url = "{base}/postcodes".format(base=config.postcodes_url)
+    json_info = await http_client.post_json_async(
+        "postcodes", url, {"postcodes": postcodes},
+        operation="postcodes_bulk_lookup")
+    resolved = {}
+    for item in json_info["result"]:
+        postcode = utils.format_pc(item["query"])
+        if item["result"] is None:
+            resolved[postcode] = None
+        else:
+            resolved[postcode] = _coordinates(item["result"])
+    return resolved
+
+
+async def _single_lookup_async(postcode):
+    """
+    Coroutine version of _single_lookup
+    """
+    url = "{base}/postcodes/{postcode}" \
+        .format(base=config.postcodes_url, postcode=postcode)
+    try:
+        json_info = await http_client.get_json_async(
+            "postcodes", url, operation="postcodes_lookup")
+    except requests.exceptions.HTTPError as e:
+        if e.response is not None and e.response.status_code == 404:
+            return None  # Postcode does not exist
+        raise
+    return _coordinates(json_info["result"])
+
+
+async def _bulk_try_async(postcodes):
+    """
+    Coroutine version of _bulk_try
+    """
+    try:
+        return await _bulk_lookup_async(postcodes)
+    except requests.exceptions.HTTPError as e:
+        if _bulk_unavailable(e):
+            return None
+        raise
+
+
+async def _lookup_async(postcodes):
+    """
+    Coroutine version of _lookup. Every batch, and every single lookup of a
+        batch the bulk lookup isn't available for, is awaited at once
+    """
+    chunks = [postcodes[i:i + BULK_LIMIT]
+              for i in range(0, len(postcodes), BULK_LIMIT)]
+    results = await asyncio.gather(*[_bulk_try_async(chunk)
+                                      for chunk in chunks])
+
+    resolved = {}
+    fallback = []
+    for chunk, result in zip(chunks, results):
+        if result is None:
+            fallback += chunk
+        else:
+            resolved.update(result)
+    # Bulk lookup not available - look up each postcode concurrently
+    singles = await asyncio.gather(*[_single_lookup_async(postcode)
+                                     for postcode in fallback])
+    resolved.update(zip(fallback, singles))
+    return resolved
+
+
+def _from_cache(location_list):
+    """
+    Resolve the postcodes that don't need a lookup. If an offline postcode
+        index is configured, it resolves every postcode
+    :param location_list: List of postcodes as strings (format irrelevant)
+    :return: A tuple containing the postcodes resolved so far (see
+                resolve_postcodes, which may be an error tuple) and the list
+                of formatted postcodes that need a lookup
+    """
+    # Offline mode - no lookups are sent to postcodes.io
+    if config.postcode_index_path:
+        try:
+            index = postcode_index.get_index(config.postcode_index_path)
+        except (OSError, ValueError):
+            # Index file is missing or isn't an index
+            return (-1, "Error! Couldn't process postcode data"), []
+        return {utils.format_pc(location): index.lookup(location)
+                for location in location_list}, []
+
+    resolved = {}
+    postcodes = []
+    for postcode in dict.fromkeys(utils.format_pc(location)
+                                  for location in location_list):
+        if postcode == "":
+            resolved[postcode] = None
+            continue
+        coords = postcode_cache.get(postcode)
+        if coords is cache.MISSING:
+            postcodes.append(postcode)  # Not cached - needs a lookup
+        else:
+            resolved[postcode] = coords
+    return resolved, postcodes
+
+
+def _store(resolved, postcodes, looked_up):
+    """
+    Cache the looked up postcodes and add them to the resolved postcodes
+    :param resolved: Dictionary of the postcodes resolved so far
+    :param postcodes: List of the formatted postcodes that were looked up
+    :param looked_up: The result of the lookup
+    :return: The resolved postcodes
+    """
+    for postcode in postcodes:
+        coords = looked_up.get(postcode)
+        postcode_cache.set(postcode, coords)
+        resolved[postcode] = coords
+    return resolved
+
+
+def resolve_postcodes(location_list):
+    """
+    Resolve several postcodes in as few round trips as possible. If an
+        offline postcode index is configured, it is used instead
+    :param location_list: List of postcodes as strings (format irrelevant)
+    :return: If successful, return a dictionary of formatted postcode to a
+                tuple containing its coordinates, or None if the postcode
+                does not exist. Otherwise, return a tuple with -1 and an
+                error message
+    """
+    (resolved, postcodes) = _from_cache(location_list)
+    if not postcodes:
+        return resolved
+
+    try:
+        looked_up = _lookup(postcodes)
+    except requests.exceptions.HTTPError:  # status_code != 200
+        return -1, "Error! Could not retrieve live info. " \
+                   "Please check your information"
+    except requests.exceptions.ConnectionError:
+        return -1, "Connection Error! Please check your network and " \
+                   "try again"
+    except requests.exceptions.Timeout:
+        return -1, "Request Timeout! Please try again"
+    except requests.exceptions.TooManyRedirects:
+        return -1, "Redirect Error! Max redirections reached"
+    except ValueError:
+        # Decoding failed
+        # Response is a 204 (No Content) or contains invalid JSON
+        return -1, "Error! Couldn't process postcode data"
+    except requests.exceptions.RequestException:
+        return -1, "Something went wrong! Please try again"
+    else:
+        return _store(resolved, postcodes, looked_up)
+
+
+async def resolve_postcodes_async(location_list):
+    """
+    Coroutine version of resolve_postcodes
+    :param location_list: List of postcodes as strings (format irrelevant)
+    :return: See resolve_postcodes
+    """
+    (resolved, postcodes) = _from_cache(location_list)
+    if not postcodes:
+        return resolved
+
+    try:
+        looked_up = await _lookup_async(postcodes)
+    except requests.exceptions.HTTPError:  # status_code != 200
+        return -1, "Error! Could not retrieve live info. " \
+                   "Please check your information"
+    except requests.exceptions.ConnectionError:
+        return -1, "Connection Error! Please check your network and " \
+                   "try again"
+    except requests.exceptions.Timeout:
+        return -1, "Request Timeout! Please try again"
+    except requests.exceptions.TooManyRedirects:
+        return -1, "Redirect Error! Max redirections reached"
+    except ValueError:
+        # Decoding failed
+        # Response is a 204 (No Content) or contains invalid JSON
+        return -1, "Error! Couldn't process postcode data"
+    except requests.exceptions.RequestException:
+        return -1, "Something went wrong! Please try again"
+    else:
+        return _store(resolved, postcodes, looked_up)
+
+
+def resolve_postcode(location_str):
+    """
+    Resolve a single postcode, answered from the cache where possible
+    :param location_str: The postcode as a string (format irrelevant)
+    :return: If successful, return a tuple containing the coordinates, or
+                None if the postcode does not exist. Otherwise, return a
+                tuple with -1 and an error message
+    """
+    resolved = resolve_postcodes([location_str])
+    if isinstance(resolved, tuple):
+        return resolved  # Return error tuple
+    return resolved[utils.format_pc(location_str)]
+
+
+async def resolve_postcode_async(location_str):
+    """
+    Coroutine version of resolve_postcode
+    :param location_str: The postcode as a string (format irrelevant)
+    :return: See resolve_postcode
+    """
+    resolved = await resolve_postcodes_async([location_str])
+    if isinstance(resolved, tuple):
+        return resolved  # Return error tuple
+    return resolved[utils.format_pc(location_str)]
@@ -0,0 +1,401 @@
+"""
+Title: Rate limits for upstream APIs with per-minute quotas. Each upstream
+            has a token bucket and a short wait queue, in which page requests
+            are served before background work. The worker processes of a
+            server can share one bucket per upstream
+Author: Primus27
+Date: 10/2026
+"""
+
+# Import packages
+from contextlib import contextmanager
+import asyncio
+import contextvars
+import fcntl
+import heapq
+import itertools
+import mmap
+import os
+import struct
+import threading
+import time
+import requests
+import deadline
+import metrics
+import config
+
+# Priorities of calls, most urgent first
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+# Wait of bulk work, which waits its turn for as long as the quota needs
+PACED = float("inf")
+
+# (priority, max_wait) of the calls made by this thread or coroutine
+_priority = contextvars.ContextVar("rate_limit_priority",
+                                  default=(INTERACTIVE, None))
+_buckets = {}
+_buckets_lock = threading.Lock()
+# Tokens and the time.time() they were last refilled, of a shared bucket
+_SLOT = struct.Struct("dd")
+
+
+class RateLimited(requests.exceptions.Timeout):
+    """
+    Raised instead of calling an upstream when its quota wouldn't allow the
+    call within the time the caller can wait
+    """
+    outcome = "rate_limited"
+
+
+@contextmanager
+def priority(level, max_wait=None):
+    """
+    Make the upstream calls of this thread within the block wait with a
+        priority (calls are INTERACTIVE by default)
+    :param level: INTERACTIVE or BACKGROUND
+    :param max_wait: Most seconds a call may wait for the quota. Defaults to
+                        the configured wait of the priority
+    """
+    token = _priority.set((level, max_wait))
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def run_with_priority(level, function, *args, **kwargs):
+    """
+    Call a function, making its upstream calls wait with a priority
+    :param level: INTERACTIVE or BACKGROUND
+    :param function: The function to call
+    :return: The result of the function
+    """
+    with priority(level):
+        return function(*args, **kwargs)
+
+
+def run_paced(function, *args, **kwargs):
+    """
+    Call a function, making its upstream calls wait behind those of page
+        requests for as long as the quotas need, instead of being rejected.
+        Used by bulk work that bounds its own concurrency and nobody is
+        waiting on (batches)
+    :param function: The function to call
+    :return: The result of the function
+    """
+    with priority(BACKGROUND, max_wait=PACED):
+        return function(*args, **kwargs)
+
+
+class SharedTokens:
+    """
+    Tokens of a bucket kept in a small file that every process of the host
+    maps into memory, so they draw on one quota. Updates hold a lock on the
+    file, which is released if a process dies while holding it. Each
+    process must open the file itself (not inherit it through a fork).
+    """
+    def __init__(self, path, capacity):
+        """
+        Constructor for the tokens. A new file starts with a full bucket
+        :param path: Path of the file
+        :param capacity: Most tokens held
+        """
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(fd).st_size < _SLOT.size:
+                    os.ftruncate(fd, _SLOT.size)
+                    os.pwrite(fd, _SLOT.pack(capacity, time.time()), 0)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            self._map = mmap.mmap(fd, _SLOT.size)
+        except BaseException:
+            os.close(fd)
+            raise
+        self._fd = fd
+
+    def take(self, rate, capacity, take):
+        """
+        Refill the tokens earned since the last update, and take one if
+            asked and available. The clock is the wall clock, which every
+            process shares
+        :param rate: Tokens earned per second
+        :param capacity: Most tokens held
+        :param take: Boolean on whether to take a token
+        :return: A tuple containing a boolean on whether a token was taken
+                    and the tokens left
+        """
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            (tokens, updated) = _SLOT.unpack_from(self._map)
+            now = time.time()
+            tokens = min(capacity, tokens + max(now - updated, 0) * rate)
+            taken = take and tokens >= 1
+            if taken:
+                tokens -= 1
+            _SLOT.pack_into(self._map, 0, tokens, now)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return taken, tokens
+
+
+class TokenBucket:
+    """
+    Allows calls at a steady rate with bursts of up to capacity calls. A call
+    without a token waits in a bounded queue, ordered by priority then
+    arrival, unless its estimated wait is longer than it can wait. Paced
+    calls (max_wait of PACED) always wait, and don't count towards the
+    queue size. The queue belongs to the process, the tokens may be shared.
+    """
+    def __init__(self, name, per_minute, capacity, queue_size, shared=None):
+        """
+        Constructor for the bucket
+        :param name: Name of the upstream
+        :param per_minute: Calls allowed per minute
+        :param capacity: Most tokens held, i.e. the largest burst of calls
+        :param queue_size: Most calls waiting for a token at once
+        :param shared: SharedTokens holding the tokens of every process, or
+                        None to keep them in this process
+        """
+        self.name = name
+        self.rate = per_minute / 60
+        self.capacity = capacity
+        self.queue_size = queue_size
+        self.tokens = capacity  # As last seen, if shared
+        self.shared = shared
+        self.waited = {level: 0 for level in PRIORITY_NAMES}
+        self.rejected = {level: 0 for level in PRIORITY_NAMES}
+        self._updated = time.monotonic()
+        self._waiters = []  # Heap of [priority, arrival, paced]
+        self._arrivals = itertools.count()
+        self._cond = threading.Condition()
+
+    def _take(self, take=True):
+        """
+        Add the tokens earned since the last refill, and take one if asked
+            and available. Must be called with the lock held
+        :param take: Boolean on whether to take a token
+        :return: Boolean on whether a token was taken
+        """
+        if self.shared is not None:
+            (taken, self.tokens) = self.shared.take(self.rate, self.capacity,
+                                                    take)
+            return taken
+        now = time.monotonic()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if take and self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def _reject(self, level, reason):
+        """
+        Count and raise a rejected call. Must be called with the lock held
+        """
+        self.rejected[level] += 1
+        raise RateLimited("Rate limit of {name}: {reason}".format(
+            name=self.name, reason=reason))
+
+    def _join(self, level, max_wait):
+        """
+        Take a token at once if one is available and no call is waiting, or
+            join the queue. Must be called with the lock held. Raises
+            RateLimited if the queue is full or the call can't get a token
+            within max_wait
+        :param level: Priority of the call (INTERACTIVE or BACKGROUND)
+        :param max_wait: Most seconds the call can wait
+        :return: None if a token was taken, otherwise the queue entry of the
+                    call
+        """
+        if self._take(take=not self._waiters):
+            return None
+        paced = max_wait == PACED
+        if not paced and sum(1 for waiter in self._waiters
+                             if not waiter[2]) >= self.queue_size:
+            self._reject(level, "queue is full")
+        # Calls of the same or a higher priority are served first
+        ahead = sum(1 for waiter in self._waiters if waiter[0] <= level)
+        if (ahead + 1 - self.tokens) / self.rate > max_wait:
+            self._reject(level, "quota exhausted for longer than the call "
+                                "can wait")
+
+        self.waited[level] += 1
+        entry = [level, next(self._arrivals), paced]
+        heapq.heappush(self._waiters, entry)
+        return entry
+
+    def _leave(self, entry):
+        """
+        Remove a call from the queue. Must be called with the lock held
+        :param entry: The queue entry of the call
+        """
+        self._waiters.remove(entry)
+        heapq.heapify(self._waiters)
+
+    def _next_try(self, entry, give_up):
+        """
+        Take a token if the call is first in the queue and one is available.
+            Must be called with the lock held. Raises RateLimited (and leaves
+            the queue) if the call has run out of time
+        :param entry: The queue entry of the call
+        :param give_up: The time.monotonic() the call can wait until
+        :return: None if a token was taken, otherwise the seconds to wait
+                    before trying again
+        """
+        if self._take(take=self._waiters[0] is entry):
+            heapq.heappop(self._waiters)
+            return None
+        left = give_up - time.monotonic()
+        if left <= 0:
+            self._leave(entry)
+            self._reject(entry[0], "no token in time")
+        return min(left, max((1 - self.tokens) / self.rate, 0.001))
+
+    def acquire(self, level, max_wait):
+        """
+        Take a token, waiting for one if needed. Raises RateLimited if the
+            queue is full or the call can't get a token within max_wait
+        :param level: Priority of the call (INTERACTIVE or BACKGROUND)
+        :param max_wait: Most seconds the call can wait
+        """
+        with self._cond:
+            entry = self._join(level, max_wait)
+            if entry is None:
+                return
+            give_up = time.monotonic() + max_wait
+            try:
+                while True:
+                    wait = self._next_try(entry, give_up)
+                    if wait is None:
+                        return
+                    self._cond.wait(wait)
+            finally:
+                self._cond.notify_all()  # The next waiter may go
+
+    async def acquire_async(self, level, max_wait):
+        """
+        Coroutine version of acquire. The call waits in the same queue as
+            threads, but sleeps on the event loop, and leaves the queue if
+            it is cancelled
+        :param level: Priority of the call (INTERACTIVE or BACKGROUND)
+        :param max_wait: Most seconds the call can wait
+        """
+        with self._cond:
+            entry = self._join(level, max_wait)
+        if entry is None:
+            return
+        give_up = time.monotonic() + max_wait
+        try:
+            while True:
+                with self._cond:
+                    wait = self._next_try(entry, give_up)
+                if wait is None:
+                    return
+                await asyncio.sleep(wait)
+        except asyncio.CancelledError:
+            with self._cond:
+                self._leave(entry)
+            raise
+        finally:
+            with self._cond:
+                self._cond.notify_all()  # The next waiter may go
+
+
+def get_bucket(upstream):
+    """
+    Fetch the token bucket of an upstream, creating it on first use
+    :param upstream: Name of the upstream (key of config.upstream_timeouts)
+    :return: The TokenBucket, or None if the upstream has no rate limit
+    """
+    bucket = _buckets.get(upstream)
+    if bucket is None and config.rate_limits.get(upstream):
+        with _buckets_lock:
+            bucket = _buckets.get(upstream)
+            if bucket is None:
+                # Each bucket using the API key gets its share of the
+                # quota, and can still make a call at once. The workers of
+                # a server may share one bucket
+                (per_minute, capacity) = config.rate_limits[upstream]
+                shares = max(config.rate_limit_processes, 1)
+                capacity = max(capacity / shares, 1)
+                shared = None
+                if config.rate_limit_shared_dir:
+                    shared = SharedTokens(os.path.join(
+                        config.rate_limit_shared_dir, upstream + ".tokens"),
+                        capacity)
+                bucket = TokenBucket(upstream, per_minute / shares, capacity,
+                                     config.rate_queue_size, shared=shared)
+                _buckets[upstream] = bucket
+    return bucket
+
+
+def _wait_limits():
+    """
+    Priority of the current call, and the most seconds it may wait. A page
+        request waits no longer than its deadline budget allows
+    :return: A tuple containing the priority and the seconds
+    """
+    (level, max_wait) = _priority.get()
+    if max_wait is None:
+        max_wait = config.rate_max_wait_background if level == BACKGROUND \
+            else config.rate_max_wait
+    left = deadline.remaining()
+    if left is not None:
+        max_wait = min(max_wait, left)
+    return level, max_wait
+
+
+def acquire(upstream):
+    """
+    Wait for the rate limit of an upstream to allow a call. A page request
+        waits no longer than its deadline budget allows. Raises RateLimited
+        if the call isn't allowed in time
+    :param upstream: Name of the upstream (key of config.upstream_timeouts)
+    """
+    bucket = get_bucket(upstream)
+    if bucket is not None:
+        bucket.acquire(*_wait_limits())
+
+
+async def acquire_async(upstream):
+    """
+    Coroutine version of acquire. A call that has to wait for a token
+        sleeps on the event loop
+    :param upstream: Name of the upstream (key of config.upstream_timeouts)
+    """
+    bucket = get_bucket(upstream)
+    if bucket is not None:
+        await bucket.acquire_async(*_wait_limits())
+
+
+def _collect():
+    """
+    :return: List of lines exposing the rate limit of each upstream
+    """
+    buckets = sorted(_buckets.items())
+    return metrics.samples(
+        "rate_limit_tokens", "gauge",
+        "Calls the upstream's quota allows right now", ("upstream",),
+        [((upstream, ), round(bucket.tokens, 3))
+         for upstream, bucket in buckets]) + \
+        metrics.samples(
+            "rate_limit_waited_total", "counter",
+            "Calls that waited for the upstream's quota",
+            ("upstream", "priority"),
+            [((upstream, PRIORITY_NAMES[level]), count)
+             for upstream, bucket in buckets
+             for level, count in sorted(bucket.waited.items())]) + \
+        metrics.samples(
+            "rate_limit_rejected_total", "counter",
+            "Calls rejected because the upstream's quota wouldn't allow "
+            "them in time", ("upstream", "priority"),
+            [((upstream, PRIORITY_NAMES[level]), count)
+             for upstream, bucket in buckets
+             for level, count in sorted(bucket.rejected.items())])
+
+
+metrics.register_collector(_collect)
@@ -0,0 +1,289 @@
+"""
+Title: Compact representation of the routes returned by Transport API, and
+            an incremental parser that reads routes from the response body
+            as it arrives
+Author: Primus27
+Date: 10/2026
+"""
+
+# Import packages
+import codecs
+import json
+import re
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r"[ \t\n\r]*")
+# Characters that open or close an array, object or string, and within a
+# string, those that end it or escape the next character
+_structure = re.compile(r'[][{}"]')
+_string_end = re.compile(r'["\\]')
+
+
+class RoutePart:
+    """
+    One part of a route (i.e bus, then walking). Iterating values() gives the
+    columns of the route table.
+    """
+    __slots__ = ("mode", "line", "from_point", "to_point", "departing",
+                 "arriving", "duration", "coordinates")
+
+    def __init__(self, part, keep_duration=False, keep_coordinates=False):
+        """
+        Constructor reading a route part of the API response
+        :param part: Dictionary of the route part
+        :param keep_duration: Keep the duration of the part
+        :param keep_coordinates: Keep every coordinate along the part, rather
+                                    than only the first (see start())
+        """
+        self.mode = part.get("mode")
+        self.line = part.get("line_name") or "-"
+        self.from_point = part.get("from_point_name")
+        self.to_point = part.get("to_point_name")
+        self.departing = part.get("departure_time")
+        self.arriving = part.get("arrival_time")
+        self.duration = part.get("duration") if keep_duration else None
+        self.coordinates = part.get("coordinates")
+        if self.coordinates and not keep_coordinates:
+            self.coordinates = self.coordinates[:1]
+
+    def values(self):
+        """
+        Columns of the route table
+        :return: A tuple of mode, line, from, to, departing and arriving
+        """
+        return (self.mode, self.line, self.from_point, self.to_point,
+                self.departing, self.arriving)
+
+    def start(self):
+        """
+        Location the part starts at. Transport API gives coordinates as
+            [longitude, latitude]
+        :return: A tuple containing the latitude and longitude, or None if
+                    the part has no coordinates
+        """
+        try:
+            (lon, lat) = self.coordinates[0][:2]
+            return float(lat), float(lon)
+        except (TypeError, IndexError, ValueError):
+            return None
+
+    def as_dict(self, duration=False, coordinates=False):
+        """
+        Convert the part to a dictionary, e.g. for a JSON response
+        :param duration: Include the duration
+        :param coordinates: Include the coordinates (only the first, unless
+                                they were all kept)
+        :return: Dictionary of the route table columns
+        """
+        part_dict = {"mode": self.mode, "line": self.line,
+                     "from": self.from_point, "to": self.to_point,
+                     "departing": self.departing, "arriving": self.arriving}
+        if duration:
+            part_dict["duration"] = self.duration
+        if coordinates:
+            part_dict["coordinates"] = self.coordinates
+        return part_dict
+
+
+class Route:
+    """
+    One of the alternative routes of a journey
+    """
+    __slots__ = ("duration", "departing", "arriving", "parts")
+
+    def __init__(self, route, keep_duration=False, keep_coordinates=False):
+        """
+        Constructor reading a route of the API response
+        :param route: Dictionary of the route
+        :param keep_duration: Keep the duration of each part
+        :param keep_coordinates: Keep every coordinate along each part
+        """
+        self.duration = route.get("duration")
+        self.departing = route.get("departure_time")
+        self.arriving = route.get("arrival_time")
+        self.parts = [RoutePart(part, keep_duration, keep_coordinates)
+                      for part in route["route_parts"]]
+
+    def as_dict(self, duration=False, coordinates=False):
+        """
+        Convert the route to a dictionary, e.g. for a JSON response
+        :param duration: Include the duration of each part
+        :param coordinates: Include the coordinates of each part
+        :return: Dictionary of the route and its parts
+        """
+        return {"duration": self.duration, "departing": self.departing,
+                "arriving": self.arriving,
+                "parts": [part.as_dict(duration, coordinates)
+                          for part in self.parts]}
+
+
+class _Reader:
+    """
+    Reads JSON tokens and values from a body that arrives in chunks
+    """
+    def __init__(self, chunks):
+        """
+        Constructor for the reader
+        :param chunks: Iterable of the body as bytes or str chunks
+        """
+        self._chunks = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.pos = 0
+        self.exhausted = False
+
+    def _read(self):
+        """
+        Read the next chunk of the body
+        :return: The chunk as str, or None at the end of the body
+        """
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self.exhausted = True
+            return None
+        if isinstance(chunk, bytes):
+            chunk = self._utf8.decode(chunk)
+        return chunk
+
+    def fill(self):
+        """
+        Append the next chunk to the buffer, dropping what has been read
+        :return: Boolean on whether there was another chunk
+        """
+        chunk = self._read()
+        if chunk is None:
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """
+        Skip whitespace and look at the next character
+        :return: The next character, or "" at the end of the body
+        """
+        while True:
+            self.pos = _whitespace.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, char):
+        """
+        Read a structural character (e.g. "{" or ":")
+        :param char: The character that must come next
+        """
+        if self.peek() != char:
+            raise ValueError("Expecting '{char}' at position {pos}"
+                             .format(char=char, pos=self.pos))
+        self.pos += 1
+
+    def _value_end(self):
+        """
+        Find where the array, object or string at the read position ends,
+            reading chunks until it has arrived. Each chunk is scanned once,
+            and joined to the buffer once the value is complete
+        :return: The position after the value, or None if the body ends
+                    before it does
+        """
+        chunks = [self.buffer]
+        text = self.buffer  # Scanned part of the chunks
+        offset = 0  # Position of text in the joined chunks
+        index = self.pos
+        depth = 0
+        in_string = False
+        end = None
+        while True:
+            pattern = _string_end if in_string else _structure
+            match = pattern.search(text, index)
+            if match is None or match.group() == "\\" and \
+                    match.end() == len(text):
+                chunk = self._read()
+                if chunk is None:
+                    break
+                # A backslash is scanned with the character it escapes
+                carry = text[match.start():] if match else ""
+                offset += len(text) - len(carry)
+                text = carry + chunk
+                index = 0
+                chunks.append(chunk)
+                continue
+            char = match.group()
+            index = match.end()
+            if char == "\\":
+                index += 1  # Skip the escaped character
+                continue
+            elif char == '"':
+                in_string = not in_string
+                if in_string:
+                    continue
+            elif char in "[{":
+                depth += 1
+                continue
+            else:
+                depth -= 1
+            if depth == 0:
+                end = offset + index
+                break
+        self.buffer = "".join(chunks)
+        return end
+
+    def value(self):
+        """
+        Read a complete JSON value
+        :return: The decoded value
+        """
+        if self.peek() in ("[", "{", '"'):
+            # Decoded once complete, as decoding it again from the start
+            # after each chunk would take time quadratic in its size
+            if self._value_end() is None:
+                raise json.JSONDecodeError("Unterminated value",
+                                           self.buffer, self.pos)
+            (value, self.pos) = _decoder.raw_decode(self.buffer, self.pos)
+            return value
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.fill():
+                    continue  # Value is split across chunks
+                raise
+            # A number at the end of the buffer may continue in the next
+            # chunk
+            if end == len(self.buffer) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+
+def iter_routes(chunks):
+    """
+    Parse the routes of a Transport API journey response, yielding each
+        route as soon as it has been received. The rest of the body is not
+        read once the routes have been parsed
+    :param chunks: Iterable of the response body as bytes or str chunks
+    :return: Generator of route dictionaries. Raises ValueError if the body
+                is not a JSON object containing "routes"
+    """
+    reader = _Reader(chunks)
+    reader.expect("{")
+    if reader.peek() != "}":
+        while True:
+            key = reader.value()
+            reader.expect(":")
+            if key == "routes":
+                reader.expect("[")
+                if reader.peek() == "]":
+                    return
+                while True:
+                    yield reader.value()
+                    if reader.peek() != ",":
+                        reader.expect("]")
+                        return
+                    reader.pos += 1
+            reader.value()  # Skip values of other keys
+            if reader.peek() != ",":
+                break
+            reader.pos += 1
+    raise ValueError("Response does not contain any routes")
@@ -0,0 +1,466 @@
+"""
+Title: Production server. A master process binds the socket and forks worker
+            processes, each serving the app from a pool of threads (or, with
+            --asgi, from an event loop). Workers are warmed up before
+            serving, and SIGHUP reloads them gracefully
+Author: Primus27
+Date: 10/2026
+"""
+
+# Import packages
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+import argparse
+import json
+import os
+import secrets
+import select
+import signal
+import socket
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import config
+
+_timings = {}  # Warmup step: seconds taken, in this worker
+
+
+class _RequestHandler(WSGIRequestHandler):
+    # Idle kept-alive connections are closed, freeing their thread
+    timeout = config.keepalive_timeout
+
+    def log_request(self, *args, **kwargs):
+        if self.server.access_log:
+            super().log_request(*args, **kwargs)
+
+    def log_error(self, format, *args):
+        if not format.startswith("Request timed out"):
+            super().log_error(format, *args)
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """
+    WSGI server handling requests (and kept-alive connections) on a bounded
+    pool of threads. While every thread is busy, no more connections are
+    accepted - they wait in the listen backlog, or go to another worker
+    """
+    multithread = True
+
+    def __init__(self, host, port, app, threads, fd, access_log=False):
+        """
+        Constructor for the server
+        :param host: Interface the socket is bound to
+        :param port: Port the socket is bound to
+        :param app: The WSGI app
+        :param threads: Number of threads handling requests
+        :param fd: File descriptor of the bound, listening socket
+        :param access_log: Whether every request is logged
+        """
+        self.access_log = access_log
+        self._pool = ThreadPoolExecutor(max_workers=threads,
+                                        thread_name_prefix="request")
+        self._idle = threading.BoundedSemaphore(threads)
+        super().__init__(host, port, app, handler=_RequestHandler, fd=fd)
+
+    def get_request(self):
+        # Wait for a free thread before accepting the next connection
+        self._idle.acquire()
+        try:
+            return super().get_request()
+        except BaseException:
+            self._idle.release()
+            raise
+
+    def process_request(self, request, client_address):
+        try:
+            self._pool.submit(self._process, request, client_address)
+        except BaseException:
+            self._idle.release()
+            raise
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._idle.release()
+
+    def drain(self):
+        """
+        Wait for the requests being handled to finish
+        """
+        self._pool.shutdown(wait=True)
+
+
+def _timed(step, function, *args):
+    """
+    Run a warmup step and record how long it took
+    :param step: Name of the step
+    :param function: Function carrying out the step
+    :return: The result of the function
+    """
+    start = time.perf_counter()
+    try:
+        return function(*args)
+    finally:
+        _timings[step] = time.perf_counter() - start
+
+
+def _import_app():
+    """
+    :return: The Flask app
+    """
+    import app
+    return app.app
+
+
+def _open_pools():
+    """
+    Open the upstream connections ahead of the first requests
+    :return: Dictionary of upstream name to the connections opened
+    """
+    import http_client
+    return {upstream: http_client.warm_up(upstream, url,
+                                          config.warmup_connections)
+            for upstream, url in [("postcodes", config.postcodes_url),
+                                  ("transport", config.transport_url),
+                                  ("weather", config.weather_url)]}
+
+
+def _load_postcode_index():
+    """
+    Map the offline postcode index, if one is configured
+    """
+    if config.postcode_index_path:
+        import postcode_index
+        postcode_index.get_index(config.postcode_index_path)
+
+
+def _compile_templates(app):
+    """
+    Compile every template, and render the static pages once
+    :param app: The Flask app
+    """
+    import http_cache
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    with app.test_request_context():
+        for name in ["home.html", "route-options.html", "404.html",
+                     "500.html"]:
+            http_cache.render_static(name)
+
+
+def warm_up():
+    """
+    Import the app and prepare it to serve: open the upstream connection
+        pools, load the postcode index and compile the templates
+    :return: The Flask app
+    """
+    app = _timed("import", _import_app)
+    _timed("pools", _open_pools)
+    _timed("postcode_index", _load_postcode_index)
+    _timed("templates", _compile_templates, app)
+    return app
+
+
+def _collect():
+    """
+    :return: List of lines exposing how long each warmup step took
+    """
+    import metrics
+    return metrics.samples(
+        "startup_seconds", "gauge",
+        "Seconds taken by each step of the worker's warmup", ("step",),
+        [((step, ), round(seconds, 6))
+         for step, seconds in _timings.items()])
+
+
+def run_worker(fd, args, report):
+    """
+    Warm up and serve requests until SIGTERM, then finish the requests being
+        handled and exit
+    :param fd: File descriptor of the bound, listening socket
+    :param args: The parsed command line arguments
+    :param report: File descriptor the startup report is written to
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # The master stops workers
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)  # Until serving
+    start = time.perf_counter()
+    app = warm_up()
+    import metrics
+    metrics.register_collector(_collect)
+    server = PooledWSGIServer(args.host, args.port, app, args.threads, fd,
+                              access_log=args.access_log)
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(
+        target=server.shutdown).start())
+
+    ready = dict(_timings, total=time.perf_counter() - start)
+    os.write(report, json.dumps({"pid": os.getpid(), "seconds": ready})
+             .encode() + b"\n")
+    server.serve_forever()
+    server.drain()
+
+
+def run_asgi_worker(fd, args, report):
+    """
+    Warm up and serve asgi.application with uvicorn until SIGTERM, then
+        finish the requests being handled and exit
+    :param fd: File descriptor of the bound, listening socket
+    :param args: The parsed command line arguments
+    :param report: File descriptor the startup report is written to
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # The master stops workers
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)  # Until serving
+    start = time.perf_counter()
+    warm_up()
+    config.serve_threads = args.threads  # Threads of the other pages
+    import asgi
+    import metrics
+    import uvicorn
+    metrics.register_collector(_collect)
+    server = uvicorn.Server(uvicorn.Config(
+        asgi.application, lifespan="on", access_log=args.access_log,
+        log_level="info" if args.access_log else "warning",
+        timeout_keep_alive=config.keepalive_timeout,
+        timeout_graceful_shutdown=args.graceful_timeout))
+
+    ready = dict(_timings, total=time.perf_counter() - start)
+    os.write(report, json.dumps({"pid": os.getpid(), "seconds": ready})
+             .encode() + b"\n")
+    # uvicorn stops gracefully on SIGTERM
+    server.run(sockets=[socket.socket(fileno=fd)])
+
+
+def _bind(host, port, backlog):
+    """
+    Bind the listening socket shared by the workers
+    :return: The socket
+    """
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+class Master:
+    """
+    Keeps the configured number of workers running. SIGHUP starts a new
+    generation of workers and gracefully stops the old one once the new one
+    is ready, and SIGTERM or SIGINT gracefully stops every worker
+    """
+    def __init__(self, args):
+        """
+        Constructor for the master
+        :param args: The parsed command line arguments
+        """
+        self.args = args
+        self.sock = _bind(args.host, args.port, args.backlog)
+        (self._report, self._report_write) = os.pipe()
+        self.workers = set()  # pids of the current generation
+        self.retiring = set()  # pids of older generations, still serving
+        self.stopping = {}  # pid: time.monotonic() deadline to exit by
+        self._reload = False
+        self._stop = False
+        self._started = time.perf_counter()
+        self._pending = 0  # Workers of the generation yet to report
+
+    def spawn(self):
+        """
+        Fork a worker of the current generation
+        """
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                os.close(self._report)
+                (run_asgi_worker if self.args.asgi else run_worker)(
+                    self.sock.fileno(), self.args, self._report_write)
+            except BaseException:
+                import traceback
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        self.workers.add(pid)
+
+    def stop_workers(self, pids):
+        """
+        Ask workers to finish their requests and exit
+        :param pids: The pids of the workers
+        """
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                continue
+            self.stopping[pid] = time.monotonic() + self.args.graceful_timeout
+        self.workers -= set(pids)
+        self.retiring -= set(pids)
+
+    def _reap(self):
+        """
+        Collect exited workers, replacing unexpected exits
+        """
+        while True:
+            try:
+                (pid, status) = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            self.retiring.discard(pid)
+            if self.stopping.pop(pid, None) is None and \
+                    pid in self.workers:
+                self.workers.discard(pid)
+                print("Worker {pid} exited ({code}), restarting".format(
+                    pid=pid, code=os.waitstatus_to_exitcode(status)),
+                    file=sys.stderr)
+                if not self._stop:
+                    time.sleep(config.worker_restart_delay)
+                    self.spawn()
+
+    def _read_reports(self, timeout):
+        """
+        Print the startup reports written by workers. Once every worker of
+            the current generation is ready, the older generations are
+            stopped
+        :param timeout: Seconds to wait for a report
+        """
+        if not select.select([self._report], [], [], timeout)[0]:
+            return
+        for line in os.read(self._report, 65536).decode().splitlines():
+            report = json.loads(line)
+            print("Worker {pid} ready in {total:.3f}s ({steps})".format(
+                pid=report["pid"], total=report["seconds"].pop("total"),
+                steps=", ".join("{step} {seconds:.3f}s".format(
+                    step=step, seconds=seconds)
+                    for step, seconds in report["seconds"].items())))
+            if report["pid"] not in self.workers:
+                continue  # Of an older generation
+            self._pending -= 1
+            if self._pending == 0:
+                self.stop_workers(list(self.retiring))
+                print("{workers} workers x {threads} threads serving "
+                      "http://{host}:{port} - ready in {seconds:.3f}s".format(
+                          workers=self.args.workers,
+                          threads=self.args.threads, host=self.args.host,
+                          port=self.sock.getsockname()[1],
+                          seconds=time.perf_counter() - self._started))
+
+    def run(self):
+        """
+        Start the workers and supervise them until stopped
+        """
+        signal.signal(signal.SIGHUP, lambda signum, frame: setattr(
+            self, "_reload", True))
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda signum, frame: setattr(
+                self, "_stop", True))
+        self._pending = self.args.workers
+        for _ in range(self.args.workers):
+            self.spawn()
+
+        while not self._stop or self.workers or self.retiring or \
+                self.stopping:
+            if self._stop and (self.workers or self.retiring):
+                self.stop_workers(list(self.workers | self.retiring))
+            elif self._reload:
+                self._reload = False
+                print("Reloading workers")
+                # The old workers serve until the new ones are ready
+                self.retiring |= self.workers
+                self.workers = set()
+                self._started = time.perf_counter()
+                self._pending = self.args.workers
+                for _ in range(self.args.workers):
+                    self.spawn()
+            self._read_reports(0.5)
+            self._reap()
+            now = time.monotonic()
+            for pid, deadline in list(self.stopping.items()):
+                if now > deadline:
+                    try:
+                        os.kill(pid, signal.SIGKILL)
+                    except ProcessLookupError:
+                        self.stopping.pop(pid)
+        self.sock.close()
+
+
+def _share_rate_limits():
+    """
+    Make every worker draw on one bucket per upstream, kept in a temporary
+        directory unless RATE_LIMIT_SHARED_DIR is set. Workers import the
+        app after the fork, so they inherit this setting and each open the
+        buckets themselves
+    :return: The temporary directory, to be removed when the server stops,
+                or None if RATE_LIMIT_SHARED_DIR is set
+    """
+    if config.rate_limit_shared_dir:
+        return None
+    config.rate_limit_shared_dir = tempfile.mkdtemp(prefix="rate-limits-")
+    return config.rate_limit_shared_dir
+
+
+def _share_sessions():
+    """
+    Make every worker share the sessions. Workers import the app after the
+        fork, so they inherit these settings: memory sessions are kept in
+        SQLite instead, and without a SECRET_KEY the workers sign with one
+        key generated for this server
+    """
+    if config.session_backend == "memory":
+        config.session_backend = "sqlite"
+        print("Sessions are kept in SQLite ({path}) so that every worker "
+              "shares them".format(path=config.session_sqlite_path),
+              file=sys.stderr)
+    if not config.secret_key:
+        config.secret_key = secrets.token_hex(32)
+        print("Warning: no SECRET_KEY - sessions end when the server is "
+              "restarted", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve the app with pre-forked worker processes")
+    parser.add_argument("--host", default=config.serve_host,
+                        help="Interface to listen on")
+    parser.add_argument("--port", type=int, default=config.serve_port,
+                        help="Port to listen on")
+    parser.add_argument("--workers", type=int, default=config.serve_workers,
+                        help="Worker processes")
+    parser.add_argument("--threads", type=int, default=config.serve_threads,
+                        help="Threads handling requests in each worker")
+    parser.add_argument("--backlog", type=int, default=1024,
+                        help="Connections queued before they are accepted")
+    parser.add_argument("--graceful-timeout", type=float,
+                        default=config.graceful_timeout,
+                        help="Seconds a stopping worker has to finish its "
+                             "requests")
+    parser.add_argument("--access-log", action="store_true",
+                        help="Log every request")
+    parser.add_argument("--asgi", action="store_true",
+                        default=config.serve_asgi,
+                        help="Serve the upstream-bound pages with coroutines "
+                             "(asgi.py on uvicorn). Threads serve the other "
+                             "pages")
+    args = parser.parse_args()
+    if args.workers > 1:
+        _share_sessions()
+    shared_dir = _share_rate_limits() if args.workers > 1 else None
+    try:
+        Master(args).run()
+    finally:
+        if shared_dir:
+            shutil.rmtree(shared_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
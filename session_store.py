@@ -0,0 +1,350 @@
+"""
+Title: Server-side session storage. The session cookie only carries a signed
+            session ID, and the session data is kept in a store shared by
+            every worker process (in-memory, SQLite or a networked store)
+Author: Primus27
+Date: 10/2026
+"""
+
+# Import packages
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import Signer, BadSignature
+from werkzeug.datastructures import CallbackDict
+import argparse
+import json
+import secrets
+import socket
+import socketserver
+import sqlite3
+import threading
+import time
+import cache
+import config
+
+_serializer = TaggedJSONSerializer()
+# Key of the WSGI environ holding a session loaded ahead of the request (see
+# ServerSideSessionInterface.preload)
+PRELOADED = "session_store.preloaded"
+
+
+class MemoryStore:
+    """
+    Sessions held in the memory of this process. Only suitable for a single
+    worker process (e.g. the development server and tests)
+    """
+    def __init__(self, max_size=100000):
+        """
+        Constructor for the store
+        :param max_size: Maximum number of sessions held
+        """
+        self._sessions = cache.TTLCache(max_size=max_size, ttl=0)
+
+    def load(self, session_id):
+        """
+        Fetch the data of a session
+        :param session_id: The session ID
+        :return: The serialised session data, or None if it doesn't exist or
+                    has expired
+        """
+        data = self._sessions.get(session_id)
+        return None if data is cache.MISSING else data
+
+    def save(self, session_id, data, ttl):
+        """
+        Add or replace the data of a session
+        :param session_id: The session ID
+        :param data: The serialised session data
+        :param ttl: Seconds until the session expires
+        """
+        self._sessions.set(session_id, data, ttl=ttl)
+
+    def delete(self, session_id):
+        """
+        Remove a session, if present
+        :param session_id: The session ID
+        """
+        self._sessions.delete(session_id)
+
+
+class SQLiteStore:
+    """
+    Sessions held in an SQLite database, shared by every worker process on
+    the host. Each thread uses its own connection
+    """
+    def __init__(self, path):
+        """
+        Constructor for the store
+        :param path: Path of the database file (created if missing)
+        """
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS sessions ("
+                               "id TEXT PRIMARY KEY, data TEXT NOT NULL, "
+                               "expires REAL NOT NULL)")
+
+    def _connection(self):
+        """
+        :return: The sqlite3 connection of this thread
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def load(self, session_id):
+        """
+        Fetch the data of a session (see MemoryStore.load)
+        """
+        row = self._connection().execute(
+            "SELECT data FROM sessions WHERE id = ? AND expires > ?",
+            (session_id, time.time())).fetchone()
+        return None if row is None else row[0]
+
+    def save(self, session_id, data, ttl):
+        """
+        Add or replace the data of a session (see MemoryStore.save). Expired
+            sessions are removed now and then
+        """
+        now = time.time()
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)",
+                (session_id, data, now + ttl))
+            if secrets.randbelow(100) == 0:
+                connection.execute("DELETE FROM sessions WHERE expires <= ?",
+                                   (now, ))
+
+    def delete(self, session_id):
+        """
+        Remove a session, if present (see MemoryStore.delete)
+        """
+        with self._connection() as connection:
+            connection.execute("DELETE FROM sessions WHERE id = ?",
+                               (session_id, ))
+
+
+class RemoteStore:
+    """
+    Sessions held by a store server (see serve_store) reached over TCP,
+    shared by workers on any host. Each thread keeps its own connection
+    """
+    def __init__(self, address):
+        """
+        Constructor for the store
+        :param address: "host:port" of the store server
+        """
+        (host, port) = address.rsplit(":", 1)
+        self.address = (host, int(port))
+        self._local = threading.local()
+
+    def _call(self, command):
+        """
+        Send a command to the store server, reconnecting once if the kept
+            connection has been closed
+        :param command: Dictionary with the "op" and its arguments
+        :return: The "value" of the reply. Raises OSError if the server
+                    can't be reached
+        """
+        line = json.dumps(command).encode() + b"\n"
+        for attempt in range(2):
+            stream = getattr(self._local, "stream", None)
+            if stream is None:
+                stream = socket.create_connection(
+                    self.address, timeout=config.session_store_timeout)\
+                    .makefile("rwb")
+                self._local.stream = stream
+            try:
+                stream.write(line)
+                stream.flush()
+                reply = stream.readline()
+                if not reply:
+                    raise ConnectionResetError("Session store closed the "
+                                               "connection")
+                return json.loads(reply)["value"]
+            except OSError:
+                self._local.stream = None
+                stream.close()
+                if attempt:
+                    raise
+
+    def load(self, session_id):
+        """
+        Fetch the data of a session (see MemoryStore.load)
+        """
+        return self._call({"op": "load", "id": session_id})
+
+    def save(self, session_id, data, ttl):
+        """
+        Add or replace the data of a session (see MemoryStore.save)
+        """
+        self._call({"op": "save", "id": session_id, "data": data,
+                    "ttl": ttl})
+
+    def delete(self, session_id):
+        """
+        Remove a session, if present (see MemoryStore.delete)
+        """
+        self._call({"op": "delete", "id": session_id})
+
+
+class _StoreHandler(socketserver.StreamRequestHandler):
+    """
+    Answers the commands of RemoteStore clients, one JSON object per line,
+    from the MemoryStore of the server
+    """
+    def handle(self):
+        store = self.server.store
+        for line in self.rfile:
+            command = json.loads(line)
+            if command["op"] == "load":
+                value = store.load(command["id"])
+            elif command["op"] == "save":
+                value = store.save(command["id"], command["data"],
+                                   command["ttl"])
+            else:
+                value = store.delete(command["id"])
+            self.wfile.write(json.dumps({"value": value}).encode() + b"\n")
+
+
+class _StoreServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def serve_store(host="127.0.0.1", port=0):
+    """
+    Start a store server for RemoteStore clients in a background thread.
+        Stands in for a networked store such as Redis
+    :param host: Interface to listen on
+    :param port: Port to listen on (0 picks a free port)
+    :return: The server. Its address is server.server_address
+    """
+    server = _StoreServer((host, port), _StoreHandler)
+    server.store = MemoryStore()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def get_store(backend):
+    """
+    Create the store of a backend, configured from config
+    :param backend: "memory", "sqlite" or "remote"
+    :return: The store
+    """
+    if backend == "memory":
+        return MemoryStore()
+    elif backend == "sqlite":
+        return SQLiteStore(config.session_sqlite_path)
+    elif backend == "remote":
+        return RemoteStore(config.session_store_address)
+    raise ValueError("Unknown session backend: {backend}".format(
+        backend=backend))
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """
+    Session data of a request, tracking whether it has been modified
+    """
+    def __init__(self, initial=None, session_id=None, new=False):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.session_id = session_id
+        self.new = new
+        self.modified = False
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """
+    Keeps the session data in a store. The cookie holds the session ID,
+    signed with the app's secret key
+    """
+    def __init__(self, store, ttl):
+        """
+        Constructor for the interface
+        :param store: The store of the sessions (see get_store)
+        :param ttl: Seconds a session is kept after it was last modified
+        """
+        self.store = store
+        self.ttl = ttl
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt="session-id")
+
+    def preload(self, app, environ):
+        """
+        Load the session of a request before its context is pushed, so that
+            a coroutine can load it on another thread
+        :param app: The Flask app
+        :param environ: The WSGI environ of the request
+        """
+        environ[PRELOADED] = self.open_session(app,
+                                               app.request_class(environ))
+
+    def open_session(self, app, request):
+        """
+        Load the session of the request's cookie, or start a new session.
+            A session preloaded for the request is used as it is
+        :return: The ServerSideSession
+        """
+        preloaded = request.environ.pop(PRELOADED, None)
+        if preloaded is not None:
+            return preloaded
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                session_id = self._signer(app).unsign(cookie).decode()
+            except BadSignature:
+                pass
+            else:
+                data = self.store.load(session_id)
+                if data is not None:
+                    return ServerSideSession(_serializer.loads(data),
+                                             session_id=session_id)
+        return ServerSideSession(session_id=secrets.token_urlsafe(24),
+                                 new=True)
+
+    def save_session(self, app, session, response):
+        """
+        Store the modified session, and set the cookie of a new session (or
+            remove the cookie of an emptied session)
+        """
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if not session:
+            if session.modified:
+                self.store.delete(session.session_id)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if session.modified:
+            self.store.save(session.session_id, _serializer.dumps(
+                dict(session)), self.ttl)
+        if session.new or session.permanent:
+            response.set_cookie(
+                name, self._signer(app).sign(session.session_id).decode(),
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain, path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app))
+            response.vary.add("Cookie")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Run a session store server. Point the app at it with "
+                    "SESSION_BACKEND=remote and SESSION_STORE_ADDRESS")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="Interface to listen on")
+    parser.add_argument("--port", type=int, default=8200,
+                        help="Port to listen on")
+    args = parser.parse_args()
+    store_server = serve_store(args.host, args.port)
+    print("SESSION_STORE_ADDRESS={0}:{1}".format(
+        *store_server.server_address))
+    threading.Event().wait()
@@ -0,0 +1,246 @@
+"""
+Title: Local stand-in servers for postcodes.io, Transport API and
+            OpenWeather with configurable latency and error rates. Used for
+            benchmarking without spending API quota
+Author: Primus27
+Date: 10/2026
+"""
+
+# Import packages
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, unquote
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+
+_journey_path = re.compile(r"^/v3/uk/public/journey/from/postcode:([^/]+)/"
+                           r"to/postcode:([^/]+)/(at|by)/([^/]+)/([^/]+)"
+                           r"\.json$")
+
+
+class Profile:
+    """
+    Behaviour of a stub upstream. Latency is log-normally distributed
+    """
+    def __init__(self, latency=0.05, jitter=0.3, error_rate=0.0):
+        """
+        Constructor for the profile
+        :param latency: Median seconds before a response is sent
+        :param jitter: Spread (sigma) of the latency distribution
+        :param error_rate: Fraction of requests answered with a 500 error
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+
+    def delay(self):
+        """
+        Wait for a latency sampled from the distribution
+        """
+        if self.latency > 0:
+            time.sleep(random.lognormvariate(0, self.jitter) * self.latency)
+
+    def fails(self):
+        """
+        :return: Boolean on whether this request should fail
+        """
+        return random.random() < self.error_rate
+
+
+def _coordinates(postcode):
+    """
+    Deterministic coordinates for a postcode, within Greater London
+    :param postcode: The postcode
+    :return: A tuple containing the latitude and longitude
+    """
+    digest = hashlib.md5(postcode.replace(" ", "").upper().encode()).digest()
+    return (51.3 + digest[0] / 255 * 0.4, -0.5 + digest[1] / 255 * 0.7)
+
+
+def _postcode_result(postcode):
+    """
+    Lookup result for a postcode. Postcodes starting with "ZZ" don't exist
+    :param postcode: The postcode
+    :return: The "result" object, or None if the postcode doesn't exist
+    """
+    if postcode.replace(" ", "").upper().startswith("ZZ"):
+        return None
+    (lat, lon) = _coordinates(postcode)
+    return {"postcode": postcode, "latitude": lat, "longitude": lon}
+
+
+def _journey(source, destination, time_str, routes=3, parts=4):
+    """
+    Journey response with alternative routes between two postcodes
+    :param source: Starting postcode
+    :param destination: Ending postcode
+    :param time_str: Requested time in the format HH:MM
+    :param routes: Number of alternative routes
+    :param parts: Number of parts in each route
+    :return: Dictionary in the format of a Transport API journey
+    """
+    (start_lat, start_lon) = _coordinates(source)
+    (end_lat, end_lon) = _coordinates(destination)
+    (hours, minutes) = (int(value) for value in time_str.split(":"))
+    journey = {"request_time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "source": "stub", "acknowledgements": "stub", "routes": []}
+    for route in range(routes):
+        start = hours * 60 + minutes + route * 10
+        route_parts = []
+        for part in range(parts):
+            fraction = part / parts
+            next_fraction = (part + 1) / parts
+            departing = start + part * 8
+            route_parts.append({
+                "mode": ["foot", "bus", "train", "foot"][part % 4],
+                "from_point_name": "Stop {part}".format(part=part),
+                "to_point_name": "Stop {part}".format(part=part + 1),
+                "destination": "Stop {part}".format(part=parts),
+                "line_name": "" if part % 4 in (0, 3) else str(10 + route),
+                "duration": "00:08:00",
+                "departure_time": "{0:02d}:{1:02d}".format(
+                    departing // 60 % 24, departing % 60),
+                "arrival_time": "{0:02d}:{1:02d}".format(
+                    (departing + 8) // 60 % 24, (departing + 8) % 60),
+                "coordinates": [
+                    [start_lon + (end_lon - start_lon) * f,
+                     start_lat + (end_lat - start_lat) * f]
+                    for f in (fraction, next_fraction)]
+            })
+        end = start + parts * 8
+        journey["routes"].append({
+            "duration": "00:{0:02d}:00".format(parts * 8),
+            "departure_time": route_parts[0]["departure_time"],
+            "arrival_time": "{0:02d}:{1:02d}".format(end // 60 % 24,
+                                                     end % 60),
+            "route_parts": route_parts})
+    return journey
+
+
+def _weather(lat, lon):
+    """
+    Current weather response for a location
+    :param lat: Latitude
+    :param lon: Longitude
+    :return: Dictionary in the format of an OpenWeather current weather
+    """
+    return {"name": "Stubton", "coord": {"lat": lat, "lon": lon},
+            "weather": [{"main": random.choice(["Clear", "Clouds", "Rain"]),
+                         "icon": "03d"}],
+            "main": {"temp": 283.15 + random.random() * 10}}
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """
+    Answers requests to every stub upstream. The profile of the server
+    decides the latency and errors
+    """
+    protocol_version = "HTTP/1.1"  # Keep-alive, as the real upstreams
+
+    def log_message(self, format, *args):
+        pass  # Don't log every request
+
+    def _send(self, status, body):
+        """
+        Send a JSON response
+        :param status: The status code
+        :param body: Object encoded as the JSON body
+        """
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _answer(self, method):
+        """
+        Answer a request after the profile's latency
+        :param method: "GET" or "POST"
+        """
+        profile = self.server.profile
+        length = int(self.headers.get("Content-Length") or 0)
+        payload = self.rfile.read(length) if length else b""
+        profile.delay()
+        if profile.fails():
+            return self._send(500, {"status": 500, "error": "Stub failure"})
+
+        url = urlsplit(self.path)
+        path = unquote(url.path)
+        query = parse_qs(url.query)
+        if method == "POST" and path == "/postcodes":
+            postcodes = json.loads(payload or b"{}").get("postcodes", [])
+            return self._send(200, {"status": 200, "result": [
+                {"query": postcode, "result": _postcode_result(postcode)}
+                for postcode in postcodes]})
+        elif method == "GET" and path.startswith("/postcodes/"):
+            result = _postcode_result(path[len("/postcodes/"):])
+            if result is None:
+                return self._send(404, {"status": 404,
+                                        "error": "Postcode not found"})
+            return self._send(200, {"status": 200, "result": result})
+        elif method == "GET" and path == "/data/2.5/weather":
+            return self._send(200, _weather(float(query["lat"][0]),
+                                            float(query["lon"][0])))
+        journey = _journey_path.match(path)
+        if method == "GET" and journey:
+            return self._send(200, _journey(journey.group(1),
+                                            journey.group(2),
+                                            journey.group(5)))
+        return self._send(404, {"status": 404, "error": "Not found"})
+
+    def do_GET(self):
+        self._answer("GET")
+
+    def do_POST(self):
+        self._answer("POST")
+
+
+def start_stub(profile, host="127.0.0.1", port=0):
+    """
+    Start a stub upstream server in a background thread
+    :param profile: The Profile of the server
+    :param host: Interface to listen on
+    :param port: Port to listen on (0 picks a free port)
+    :return: The server (see base_url)
+    """
+    server = ThreadingHTTPServer((host, port), _StubHandler)
+    server.daemon_threads = True
+    server.profile = profile
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def base_url(server):
+    """
+    :param server: A server returned by start_stub
+    :return: The base url of the server
+    """
+    return "http://{0}:{1}".format(*server.server_address)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Run stub postcodes.io, Transport API and OpenWeather "
+                    "servers. Point the app at them with POSTCODES_URL, "
+                    "TRANSPORT_URL and OPENWEATHER_URL")
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="Median latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.3,
+                        help="Spread of the latency distribution")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Fraction of requests that fail")
+    parser.add_argument("--port", type=int, default=8100,
+                        help="Port of the postcodes stub. Transport and "
+                             "weather use the next two ports")
+    args = parser.parse_args()
+    for offset, name in enumerate(["POSTCODES_URL", "TRANSPORT_URL",
+                                   "OPENWEATHER_URL"]):
+        stub = start_stub(Profile(args.latency, args.jitter, args.error_rate),
+                          port=args.port + offset)
+        print("{name}={url}".format(name=name, url=base_url(stub)))
+    threading.Event().wait()
@@ -0,0 +1,125 @@
+"""
+Title: Departure time sweep. Plans a journey at several times across a
+            window in parallel, so the best time can be picked from one
+            form submission
+Author: Primus27
+Date: 10/2026
+"""
+
+# Import packages
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import rate_limit
+import travel_logic
+import config
+
+RANKS = ["duration", "arrival"]
+
+_executor = ThreadPoolExecutor(max_workers=config.sweep_workers,
+                               thread_name_prefix="sweep")
+
+
+def sweep_times(time_str, window, step):
+    """
+    List the times of a sweep. The sweep doesn't continue past midnight
+    :param time_str: First time in the format HH:MM
+    :param window: Minutes the sweep covers
+    :param step: Minutes between the times
+    :return: List of times in the format HH:MM
+    """
+    (hours, minutes) = (int(value) for value in time_str.split(":"))
+    start = hours * 60 + minutes
+    return ["{0:02d}:{1:02d}".format(*divmod(minute, 60))
+            for minute in range(start, min(start + window, 24 * 60 - 1) + 1,
+                                step)]
+
+
+def rank_key(route, rank):
+    """
+    Key routes are ranked by (lowest first)
+    :param route: A route_parser.Route
+    :param rank: "duration" (shortest journey) or "arrival" (earliest
+                    arrival)
+    :return: The key
+    """
+    if rank == "arrival":
+        return route.arriving or "", route.duration or ""
+    return route.duration or "", route.arriving or ""
+
+
+def _plan_time(travel_obj, rank):
+    """
+    Fetch the routes at one time of the sweep
+    :param travel_obj: The TravelInformation of the time
+    :param rank: How routes are ranked (see rank_key)
+    :return: The best route_parser.Route, None if no route was found, or
+                the error message
+    """
+    route_info = travel_obj.format_travel_request(all_routes=True)
+    if not isinstance(route_info, list):
+        return route_info
+    elif not route_info:
+        return None
+    return min(route_info, key=lambda route: rank_key(route, rank))
+
+
+def _plan_queued(travel_obj, rank):
+    """
+    _plan_time for a lookup of the sweep, whose upstream calls wait behind
+        those of other page requests for at most sweep_max_wait seconds
+    :param travel_obj: The TravelInformation of the time
+    :param rank: How routes are ranked (see rank_key)
+    :return: See _plan_time
+    """
+    with rate_limit.priority(rate_limit.BACKGROUND,
+                             max_wait=config.sweep_max_wait):
+        return _plan_time(travel_obj, rank)
+
+
+def run_sweep(modes, source, destination, when, date, times, rank,
+              concurrency):
+    """
+    Plan a journey at every time of a sweep, yielding the best route of each
+        time as soon as it is available. A route already yielded for an
+        earlier result isn't repeated
+    :param modes: Modes of transport, separated by dashes (-)
+    :param source: Starting postcode
+    :param destination: Ending postcode
+    :param when: Depart/arrive at the times. Can be "at" or "by"
+    :param date: Date in the format DD/MM/YY (or "" for today)
+    :param times: List of times in the format HH:MM (see sweep_times)
+    :param rank: How routes are ranked (see rank_key)
+    :param concurrency: Maximum number of route lookups running at once
+    :return: Generator of dictionaries containing the requested "time" and
+                either the best "route" and its rank "key", or an "error"
+    """
+    pending = [travel_logic.TravelInformation(
+        modes=modes, source_pc=source, destination_pc=destination,
+        dep_arri=when, date=date, time=time) for time in times]
+    seen = set()
+    running = {}
+    try:
+        while pending or running:
+            # The lookups wait their turn for the quota, behind the calls
+            # of other page requests, for as long as the page can wait
+            while pending and len(running) < concurrency:
+                travel_obj = pending.pop(0)
+                running[_executor.submit(_plan_queued, travel_obj,
+                                         rank)] = travel_obj.time
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                time = running.pop(future)
+                route = future.result()
+                if route is None:
+                    continue  # No route at this time
+                elif isinstance(route, str):
+                    yield {"time": time, "error": route}
+                    continue
+                identity = (route.departing, route.arriving, route.duration)
+                if identity not in seen:
+                    seen.add(identity)
+                    yield {"time": time, "route": route,
+                           "key": "|".join(rank_key(route, rank))}
+    finally:
+        # Client went away - don't run the remaining lookups
+        for future in running:
+            future.cancel()
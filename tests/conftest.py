@@ -0,0 +1,56 @@
+"""
+Title: Shared fixtures of the tests. Every test runs against local stub
+            upstreams (see stub_upstreams.py), with empty caches and no rate
+            limits
+Author: Primus27
+Date: 10/2026
+"""
+
+# Import packages
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import stub_upstreams  # noqa: E402
+import config  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def stub():
+    """
+    :return: A stub upstream server, answering as postcodes.io, Transport
+                API and OpenWeather
+    """
+    server = stub_upstreams.start_stub(stub_upstreams.Profile(latency=0.01,
+                                                              jitter=0))
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture(autouse=True)
+def upstreams(stub, monkeypatch):
+    """
+    Point the upstreams at the stub, and start each test with empty caches,
+        closed circuits and no rate limits
+    :return: The stub server, with its default profile
+    """
+    import circuit_breaker
+    import postcode_logic
+    import rate_limit
+    import travel_logic
+    import weather_logic
+    url = stub_upstreams.base_url(stub)
+    for name in ("postcodes_url", "transport_url", "weather_url"):
+        monkeypatch.setattr(config, name, url)
+    monkeypatch.setattr(config, "rate_limits", {})
+    stub.profile = stub_upstreams.Profile(latency=0.01, jitter=0)
+    postcode_logic.postcode_cache.clear()
+    travel_logic.route_cache.clear()
+    weather_logic.weather_cache.clear()
+    weather_logic._prefetched.clear()
+    rate_limit._buckets.clear()
+    circuit_breaker._breakers.clear()
+    yield stub
@@ -0,0 +1,43 @@
+"""
+Title: Tests of the Flask app (the threaded serving path) against the stub
+            upstreams
+Author: Primus27
+Date: 10/2026
+"""
+
+# Import packages
+import time
+import pytest
+import stub_upstreams
+import app
+import config
+
+FORM = {"start_postcode": "SW1A 1AA", "end_postcode": "EC1A 1BB",
+        "when": "at", "time": "10:00", "date": "01/06/26", "mode1": "on"}
+
+
+@pytest.fixture
+def client():
+    """
+    :return: A test client of the app, with the route options submitted
+    """
+    client = app.app.test_client()
+    client.post("/route-options", data=FORM)
+    return client
+
+
+def test_route_results_are_streamed(client):
+    r = client.get("/route-results")
+    assert r.is_streamed
+    assert r.get_data(as_text=True).count("<table") == 3
+
+
+def test_streamed_route_results_keep_the_deadline(client, upstreams,
+                                                  monkeypatch):
+    monkeypatch.setattr(config, "request_deadline", 1)
+    upstreams.profile = stub_upstreams.Profile(latency=2, jitter=0)
+    start = time.monotonic()
+    r = client.get("/route-results")
+    page = r.get_data(as_text=True)
+    assert time.monotonic() - start < 1.5
+    assert "Request Timeout! Please try again" in page
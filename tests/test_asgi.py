@@ -0,0 +1,129 @@
+"""
+Title: Tests of the ASGI application, served in-process against the stub
+            upstreams
+Author: Primus27
+Date: 10/2026
+"""
+
+# Import packages
+import asyncio
+import threading
+import httpx
+import asgi
+import http_client
+from app import app
+
+FORM = {"start_postcode": "SW1A 1AA", "end_postcode": "EC1A 1BB",
+        "when": "at", "time": "10:00", "date": "01/06/26", "mode1": "on"}
+
+
+def _run(steps):
+    """
+    Run a coroutine function with a client of the ASGI application
+    :param steps: Coroutine function called with the client
+    :return: The result of the function
+    """
+    async def main():
+        transport = httpx.ASGITransport(app=asgi.application)
+        try:
+            async with httpx.AsyncClient(transport=transport,
+                                         base_url="http://test") as client:
+                return await steps(client)
+        finally:
+            await http_client.close_async_clients()
+    return asyncio.run(main())
+
+
+def test_route_options_redirects_to_results():
+    async def steps(client):
+        return await client.post("/route-options", data=FORM)
+    r = _run(steps)
+    assert r.status_code == 302
+    assert r.headers["location"] == "/route-results"
+
+
+def test_route_options_rejects_unknown_postcode():
+    async def steps(client):
+        return await client.post("/route-options",
+                                 data=dict(FORM, start_postcode="ZZ9 9ZZ"))
+    r = _run(steps)
+    assert r.status_code == 200
+    assert "Please enter a valid &#39;FROM&#39; postcode" in r.text
+
+
+def test_route_results_are_streamed_then_cached():
+    async def steps(client):
+        await client.post("/route-options", data=FORM)
+        return (await client.get("/route-results"),
+                await client.get("/route-results"))
+    (streamed, cached) = _run(steps)
+    assert streamed.status_code == 200
+    assert "etag" not in streamed.headers
+    assert streamed.text.count("<table") == 3
+    assert cached.status_code == 200
+    assert "etag" in cached.headers
+    assert cached.text.count("<table") == 3
+
+
+def test_route_sweep_is_streamed_from_a_thread():
+    async def steps(client):
+        await client.post("/route-options", data=dict(FORM, sweep="on"))
+        return [await client.get("/route-sweep") for _ in range(3)]
+    for r in _run(steps):
+        assert r.status_code == 200
+        assert r.text.count('data-key="') == 7
+
+
+def test_weather_results():
+    async def steps(client):
+        await client.post("/route-options", data=FORM)
+        return await client.get("/weather-results")
+    r = _run(steps)
+    assert r.status_code == 200
+    assert " °C" in r.text
+    assert "class=\"lead\"" not in r.text
+
+
+def test_other_pages_are_served():
+    async def steps(client):
+        return (await client.get("/"), await client.get("/missing"),
+                await client.post("/weather-results"))
+    (home, missing, not_allowed) = _run(steps)
+    assert home.status_code == 200
+    assert missing.status_code == 404
+    assert not_allowed.status_code == 405
+
+
+def test_sessions_are_stored_off_the_event_loop(monkeypatch):
+    store = app.session_interface.store
+    threads = []
+    for name in ("load", "save"):
+        def record(*args, original=getattr(store, name)):
+            threads.append(threading.current_thread())
+            return original(*args)
+        monkeypatch.setattr(store, name, record)
+
+    async def steps(client):
+        await client.post("/route-options", data=FORM)
+        return await client.get("/weather-results")
+    assert _run(steps).status_code == 200
+    assert len(threads) >= 2
+    assert threading.current_thread() not in threads
+
+
+def test_lifespan_compiles_templates_and_closes_clients():
+    messages = asyncio.Queue()
+    sent = []
+
+    async def main():
+        for message in ("lifespan.startup", "lifespan.shutdown"):
+            messages.put_nowait({"type": message})
+
+        async def send(message):
+            sent.append(message["type"])
+        client = http_client.get_async_client("postcodes")
+        await asgi.application({"type": "lifespan"}, messages.get, send)
+        return client
+    assert asyncio.run(main()).is_closed
+    assert sent == ["lifespan.startup.complete",
+                    "lifespan.shutdown.complete"]
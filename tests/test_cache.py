@@ -0,0 +1,34 @@
+"""
+Title: Tests of the caches
+Author: Primus27
+Date: 10/2026
+"""
+
+# Import packages
+import time
+import cache
+
+
+def test_entries_expire_then_go_stale():
+    ttl_cache = cache.TTLCache(max_size=10, ttl=0.05, stale_ttl=0.1)
+    ttl_cache.set("key", "value")
+    assert ttl_cache.get("key") == "value"
+    assert ttl_cache.get_stale("key") == ("value", True)
+    time.sleep(0.06)
+    assert ttl_cache.get("key", None) is None
+    assert ttl_cache.get_stale("key") == ("value", False)
+    time.sleep(0.1)
+    assert "key" not in ttl_cache
+    assert ttl_cache.get_stale("key") is cache.MISSING
+
+
+def test_least_recently_used_entry_is_evicted():
+    ttl_cache = cache.TTLCache(max_size=2, ttl=60, negative_ttl=0)
+    ttl_cache.set("a", 1)
+    ttl_cache.set("b", 2)
+    ttl_cache.get("a")
+    ttl_cache.set("c", 3)
+    assert ttl_cache.get("b", None) is None
+    assert ttl_cache.get("a") == 1
+    ttl_cache.set("invalid", None)  # Not kept with a negative_ttl of 0
+    assert ttl_cache.get("invalid") is cache.MISSING
@@ -0,0 +1,64 @@
+"""
+Title: Tests of the circuit breakers
+Author: Primus27
+Date: 10/2026
+"""
+
+# Import packages
+import time
+import pytest
+import circuit_breaker
+import http_client
+import config
+from stub_upstreams import Profile
+
+
+def _breaker():
+    return circuit_breaker.CircuitBreaker("test", failure_rate=0.5,
+                                          min_calls=2, window=10,
+                                          open_seconds=0.05)
+
+
+def test_circuit_opens_then_closes_after_a_probe():
+    breaker = _breaker()
+    for _ in range(2):
+        breaker.record(breaker.before_call(), False)
+    assert breaker.state == circuit_breaker.OPEN
+    with pytest.raises(circuit_breaker.CircuitOpenError):
+        breaker.before_call()
+    time.sleep(0.06)
+    probe = breaker.before_call()
+    assert breaker.state == circuit_breaker.HALF_OPEN
+    with pytest.raises(circuit_breaker.CircuitOpenError):
+        breaker.before_call()  # One probe at a time
+    breaker.record(probe, True)
+    assert breaker.state == circuit_breaker.CLOSED
+    assert breaker.rejected == 2
+
+
+def test_late_call_is_not_counted_as_the_probe():
+    breaker = _breaker()
+    late = breaker.before_call()
+    for _ in range(2):
+        breaker.record(breaker.before_call(), False)
+    time.sleep(0.06)
+    probe = breaker.before_call()
+    breaker.record(late, True)  # Allowed while closed
+    assert breaker.state == circuit_breaker.HALF_OPEN
+    breaker.release(late)
+    with pytest.raises(circuit_breaker.CircuitOpenError):
+        breaker.before_call()  # The probe still holds its slot
+    breaker.record(probe, False)
+    assert breaker.state == circuit_breaker.OPEN
+
+
+def test_failing_upstream_fails_fast(upstreams, monkeypatch):
+    monkeypatch.setattr(config, "circuit_min_calls", 2)
+    monkeypatch.setattr(config, "circuit_open_seconds", 60)
+    upstreams.profile = Profile(latency=0, jitter=0, error_rate=1)
+    url = config.postcodes_url + "/postcodes/SW1A1AA"
+    for _ in range(2):
+        assert http_client.request("postcodes", "GET", url).status_code \
+            == 500
+    with pytest.raises(circuit_breaker.CircuitOpenError):
+        http_client.request("postcodes", "GET", url)
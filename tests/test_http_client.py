@@ -0,0 +1,37 @@
+"""
+Title: Tests of the upstream HTTP clients
+Author: Primus27
+Date: 10/2026
+"""
+
+# Import packages
+import asyncio
+import pytest
+import deadline
+import http_client
+import config
+
+
+def test_async_call_fails_fast_once_the_deadline_is_spent():
+    url = config.postcodes_url + "/postcodes/SW1A1AA"
+
+    async def main():
+        deadline.start(0)
+        try:
+            return await http_client.get_json_async("postcodes", url)
+        finally:
+            deadline.clear()
+            await http_client.close_async_clients()
+    with pytest.raises(deadline.DeadlineExceeded):
+        asyncio.run(main())
+
+
+def test_async_get_matches_get():
+    url = config.postcodes_url + "/postcodes/SW1A1AA"
+
+    async def main():
+        try:
+            return await http_client.get_json_async("postcodes", url)
+        finally:
+            await http_client.close_async_clients()
+    assert asyncio.run(main()) == http_client.get_json("postcodes", url)
@@ -0,0 +1,33 @@
+"""
+Title: Tests of the postcode lookups
+Author: Primus27
+Date: 10/2026
+"""
+
+# Import packages
+import asyncio
+import http_client
+import postcode_logic
+
+POSTCODES = ["SW1A 1AA", "ec1a1bb", "ZZ9 9ZZ"]
+
+
+def test_async_postcodes_match_sync_postcodes():
+    resolved = postcode_logic.resolve_postcodes(POSTCODES)
+    assert set(resolved) == {"SW1A1AA", "EC1A1BB", "ZZ99ZZ"}
+    assert resolved["ZZ99ZZ"] is None
+    postcode_logic.postcode_cache.clear()
+
+    async def main():
+        try:
+            return await postcode_logic.resolve_postcodes_async(POSTCODES)
+        finally:
+            await http_client.close_async_clients()
+    assert asyncio.run(main()) == resolved
+
+
+def test_postcodes_are_cached(upstreams):
+    postcode_logic.resolve_postcodes(POSTCODES)
+    upstreams.profile.error_rate = 1
+    assert postcode_logic.resolve_postcode("SW1A 1AA") == \
+        postcode_logic.resolve_postcodes(["SW1A1AA"])["SW1A1AA"]
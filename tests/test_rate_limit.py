@@ -0,0 +1,116 @@
+"""
+Title: Tests of the token buckets of the rate limits
+Author: Primus27
+Date: 10/2026
+"""
+
+# Import packages
+import asyncio
+import threading
+import time
+import pytest
+import rate_limit
+
+
+def test_burst_then_steady_rate():
+    bucket = rate_limit.TokenBucket("test", 600, 2, 5)
+    bucket.acquire(rate_limit.INTERACTIVE, 0)
+    bucket.acquire(rate_limit.INTERACTIVE, 0)
+    start = time.monotonic()
+    bucket.acquire(rate_limit.INTERACTIVE, 1)
+    assert 0.05 < time.monotonic() - start < 0.5  # 10 tokens a second
+
+
+def test_call_is_rejected_if_it_cannot_wait():
+    bucket = rate_limit.TokenBucket("test", 60, 1, 5)
+    bucket.acquire(rate_limit.INTERACTIVE, 0)
+    with pytest.raises(rate_limit.RateLimited):
+        bucket.acquire(rate_limit.INTERACTIVE, 0.1)
+    assert bucket.rejected[rate_limit.INTERACTIVE] == 1
+
+
+def test_full_queue_rejects_but_paced_calls_wait():
+    bucket = rate_limit.TokenBucket("test", 600, 1, 1)
+    bucket.acquire(rate_limit.INTERACTIVE, 0)
+    waiter = threading.Thread(target=bucket.acquire,
+                              args=(rate_limit.INTERACTIVE, 5))
+    waiter.start()
+    time.sleep(0.02)
+    with pytest.raises(rate_limit.RateLimited):
+        bucket.acquire(rate_limit.INTERACTIVE, 5)
+    bucket.acquire(rate_limit.BACKGROUND, rate_limit.PACED)
+    waiter.join()
+
+
+def test_interactive_calls_are_served_before_background():
+    bucket = rate_limit.TokenBucket("test", 300, 1, 5)
+    bucket.acquire(rate_limit.INTERACTIVE, 0)
+    order = []
+
+    def call(level, name):
+        bucket.acquire(level, 5)
+        order.append(name)
+    background = threading.Thread(target=call,
+                                  args=(rate_limit.BACKGROUND, "background"))
+    background.start()
+    time.sleep(0.02)
+    interactive = threading.Thread(
+        target=call, args=(rate_limit.INTERACTIVE, "interactive"))
+    interactive.start()
+    background.join()
+    interactive.join()
+    assert order == ["interactive", "background"]
+
+
+def test_async_waits_hold_no_thread():
+    bucket = rate_limit.TokenBucket("test", 6000, 1, 500)
+
+    async def main():
+        calls = [asyncio.ensure_future(
+            bucket.acquire_async(rate_limit.BACKGROUND, rate_limit.PACED))
+            for _ in range(50)]
+        await asyncio.sleep(0.05)
+        # Threads of the event loop's executor (other tests' threads, such
+        # as those of the stub upstreams, may come and go)
+        assert not [thread for thread in threading.enumerate()
+                    if thread.name.startswith("asyncio_")]
+        await asyncio.gather(*calls)
+    asyncio.run(main())
+    assert not bucket._waiters
+
+
+def test_cancelled_async_wait_leaves_the_queue():
+    bucket = rate_limit.TokenBucket("test", 60, 1, 5)
+    bucket.acquire(rate_limit.INTERACTIVE, 0)
+
+    async def main():
+        call = asyncio.ensure_future(
+            bucket.acquire_async(rate_limit.INTERACTIVE, 5))
+        await asyncio.sleep(0.02)
+        assert len(bucket._waiters) == 1
+        call.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await call
+    asyncio.run(main())
+    assert not bucket._waiters
+
+
+def test_processes_share_one_bucket(tmp_path, monkeypatch):
+    # Each process opens the file itself, as two buckets do here
+    path = str(tmp_path / "test.tokens")
+    first = rate_limit.TokenBucket(
+        "test", 60, 2, 5, shared=rate_limit.SharedTokens(path, 2))
+    second = rate_limit.TokenBucket(
+        "test", 60, 2, 5, shared=rate_limit.SharedTokens(path, 2))
+    first.acquire(rate_limit.INTERACTIVE, 0)
+    second.acquire(rate_limit.INTERACTIVE, 0)
+    with pytest.raises(rate_limit.RateLimited):
+        first.acquire(rate_limit.INTERACTIVE, 0.1)
+
+    monkeypatch.setattr("config.rate_limits", {"transport": (60, 2)})
+    monkeypatch.setattr("config.rate_limit_shared_dir", str(tmp_path))
+    rate_limit.get_bucket("transport").acquire(rate_limit.INTERACTIVE, 0)
+    rate_limit._buckets.clear()  # As in another worker
+    bucket = rate_limit.get_bucket("transport")
+    assert 0.9 < bucket.shared.take(bucket.rate, bucket.capacity,
+                                    False)[1] < 1.1
@@ -0,0 +1,63 @@
+"""
+Title: Tests of the route parser
+Author: Primus27
+Date: 10/2026
+"""
+
+# Import packages
+import json
+import time
+import pytest
+import route_parser
+
+PART = {"mode": "bus", "line_name": "25", "from_point_name": 'Stop "A" \\',
+        "to_point_name": "Stop B", "departure_time": "10:00",
+        "arrival_time": "10:20", "duration": "00:20:00",
+        "coordinates": [[-0.1, 51.5], [-0.11, 51.51], [-0.12, 51.52]]}
+JOURNEY = {"request_time": "2026-06-01T09:00:00", "extra": [1, {"x": "]"}],
+           "routes": [{"duration": "00:20:00", "departure_time": "10:00",
+                       "arrival_time": "10:20", "route_parts": [PART]},
+                      {"duration": "00:30:00", "departure_time": "10:05",
+                       "arrival_time": "10:35", "route_parts": [PART]}],
+           "source": "test"}
+
+
+def _chunks(body, size):
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+
+@pytest.mark.parametrize("size", [1, 3, 16384])
+def test_routes_are_parsed_across_chunks(size):
+    body = json.dumps(JOURNEY, ensure_ascii=False).encode()
+    assert list(route_parser.iter_routes(_chunks(body, size))) == \
+        JOURNEY["routes"]
+
+
+def test_body_without_routes_is_rejected():
+    with pytest.raises(ValueError):
+        list(route_parser.iter_routes([b'{"error": "no journey"}']))
+    with pytest.raises(ValueError):
+        list(route_parser.iter_routes([b'{"routes": [{"duration": "0']))
+
+
+def test_large_route_is_parsed_in_linear_time():
+    part = dict(PART, coordinates=[[-0.1, 51.5]] * 100000)
+    body = json.dumps({"routes": [{"route_parts": [part]}]}).encode()
+    start = time.perf_counter()
+    routes = list(route_parser.iter_routes(_chunks(body, 16384)))
+    assert time.perf_counter() - start < 1
+    assert len(routes[0]["route_parts"][0]["coordinates"]) == 100000
+
+
+def test_route_keeps_only_what_is_asked():
+    route = route_parser.Route(JOURNEY["routes"][0])
+    part = route.parts[0]
+    assert part.coordinates == [[-0.1, 51.5]]
+    assert part.duration is None
+    assert part.start() == (51.5, -0.1)
+    route = route_parser.Route(JOURNEY["routes"][0], keep_duration=True,
+                               keep_coordinates=True)
+    assert route.parts[0].as_dict(duration=True, coordinates=True) == {
+        "mode": "bus", "line": "25", "from": 'Stop "A" \\', "to": "Stop B",
+        "departing": "10:00", "arriving": "10:20", "duration": "00:20:00",
+        "coordinates": PART["coordinates"]}
@@ -0,0 +1,24 @@
+"""
+Title: Tests of the departure time sweep
+Author: Primus27
+Date: 10/2026
+"""
+
+# Import packages
+import time
+import config
+import sweep_logic
+
+
+def test_sweep_waits_are_capped(monkeypatch):
+    # One lookup a second, so most of the sweep's times can't get the quota
+    # within sweep_max_wait
+    monkeypatch.setattr(config, "rate_limits", {"transport": (60, 1)})
+    monkeypatch.setattr(config, "sweep_max_wait", 1)
+    times = sweep_logic.sweep_times("10:00", 60, 10)
+    start = time.monotonic()
+    results = list(sweep_logic.run_sweep("bus", "SW1A 1AA", "EC1A 1BB",
+                                         "at", "", times, "duration", 6))
+    assert time.monotonic() - start < 3
+    assert len(results) == len(times)
+    assert sum(1 for result in results if "error" in result) >= 4
@@ -0,0 +1,74 @@
+"""
+Title: Tests of the route planning logic and the route cache
+Author: Primus27
+Date: 10/2026
+"""
+
+# Import packages
+import asyncio
+import time
+import warnings
+import travel_logic
+
+
+def _travel(travel_class=travel_logic.TravelInformation, time="10:00",
+            when="at"):
+    return travel_class(modes="foot-bus", source_pc="SW1A 1AA",
+                        destination_pc="EC1A 1BB", dep_arri=when,
+                        date="01/06/26", time=time)
+
+
+def _wait_for_refresh(key, timeout=5):
+    end = time.monotonic() + timeout
+    while key in travel_logic._refreshing and time.monotonic() < end:
+        time.sleep(0.01)
+
+
+def test_routes_are_cached():
+    routes = _travel().format_travel_request(all_routes=True)
+    assert routes
+    assert travel_logic.route_cache.get(_travel().cache_key()) == routes
+
+
+def test_routes_suit_every_time_of_their_bucket():
+    # The stub's first route leaves at the requested time
+    arrive_by = _travel(time="10:04", when="by")
+    routes = arrive_by.format_travel_request(all_routes=True)
+    assert routes[0].departing == "10:00"
+    assert _travel(time="10:00", when="by").cache_key() == \
+        arrive_by.cache_key()
+    depart_at = _travel(time="10:01", when="at")
+    routes = depart_at.format_travel_request(all_routes=True)
+    assert routes[0].departing == "10:05"
+    assert _travel(time="10:05", when="at").cache_key() == \
+        depart_at.cache_key()
+    assert travel_logic.time_bucket("23:58", "at") == "23:59"
+
+
+def test_stale_routes_are_refreshed_in_background():
+    travel_obj = _travel()
+    key = travel_obj.cache_key()
+    travel_logic.route_cache.set(key, [], ttl=-1)
+    assert travel_obj.format_travel_request(all_routes=True) == []
+    _wait_for_refresh(key)
+    assert travel_logic.route_cache.get(key, None)
+
+
+def test_stale_routes_are_refreshed_in_background_async():
+    travel_obj = _travel(travel_logic.AsyncTravelInformation)
+    key = travel_obj.cache_key()
+    travel_logic.route_cache.set(key, [], ttl=-1)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", RuntimeWarning)
+        assert asyncio.run(
+            travel_obj.format_travel_request(all_routes=True)) == []
+        _wait_for_refresh(key)
+    assert travel_logic.route_cache.get(key, None)
+
+
+def test_async_routes_match_sync_routes():
+    sync_routes = _travel().fetch_travel_request()
+    async_routes = asyncio.run(
+        _travel(travel_logic.AsyncTravelInformation).fetch_travel_request())
+    assert [route.as_dict(duration=True) for route in async_routes] == \
+        [route.as_dict(duration=True) for route in sync_routes]
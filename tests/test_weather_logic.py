@@ -0,0 +1,55 @@
+"""
+Title: Tests of the weather logic
+Author: Primus27
+Date: 10/2026
+"""
+
+# Import packages
+from concurrent.futures import Future
+import asyncio
+import time
+import pytest
+import deadline
+import weather_logic
+
+
+@pytest.fixture
+def stuck_prefetch():
+    """
+    A prefetch of the destination's weather that never finishes, within a
+        short deadline budget
+    """
+    future = Future()
+    future.set_running_or_notify_cancel()
+    weather_logic._prefetched.set(
+        weather_logic.WeatherInformation("EC1A 1BB").destination, future)
+    deadline.start(0.3)
+    yield future
+    deadline.clear()
+
+
+def test_weather_matches_async_weather():
+    info_dic = weather_logic.WeatherInformation("EC1A 1BB") \
+        .get_weather_info()
+    weather_logic.weather_cache.clear()
+    async_info_dic = asyncio.run(
+        weather_logic.AsyncWeatherInformation("EC1A 1BB").get_weather_info())
+    # The stub's weather changes with every call
+    assert async_info_dic.keys() == info_dic.keys()
+    assert async_info_dic["name"] == info_dic["name"]
+
+
+def test_prefetch_is_waited_for_within_the_deadline(stuck_prefetch):
+    start = time.monotonic()
+    info_dic = weather_logic.WeatherInformation("EC1A 1BB") \
+        .get_weather_info()
+    assert time.monotonic() - start < 1
+    assert info_dic == "Request Timeout! Please try again"
+
+
+def test_prefetch_is_awaited_within_the_deadline(stuck_prefetch):
+    start = time.monotonic()
+    info_dic = asyncio.run(weather_logic.AsyncWeatherInformation("EC1A 1BB")
+                           .get_weather_info())
+    assert time.monotonic() - start < 1
+    assert info_dic == "Request Timeout! Please try again"
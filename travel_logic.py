@@ -8,9 +8,46 @@ Date: 05/2019
 # Import packages
 import requests
 import datetime as dt
+import threading
+import background
+import cache
+import deadline
+import http_client
+import metrics
+import route_parser
 import utils
+import weather_logic
 import config
 
+# Route request: list of route_parser.Route
+route_cache = cache.TTLCache(max_size=config.route_cache_size,
+                             ttl=config.route_cache_ttl,
+                             stale_ttl=config.route_cache_stale_ttl)
+metrics.register_cache("routes", route_cache)
+# Route requests being refreshed in the background
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+
+def time_bucket(time_str, dep_arri):
+    """
+    Round a time to the boundary of its route cache bucket that routes are
+        requested at, so that they suit every time in the bucket: up for
+        departing at (no later than 23:59), and down for arriving by
+    :param time_str: Time in the format HH:MM
+    :param dep_arri: Depart/arrive at the time. Can be "at" or "by"
+    :return: The boundary of the bucket in the format HH:MM
+    """
+    (hours, minutes) = time_str.split(":")
+    minutes = int(hours) * 60 + int(minutes)
+    if dep_arri == "by":
+        minutes -= minutes % config.route_time_bucket
+    else:
+        minutes = min(-(-minutes // config.route_time_bucket) *
+                      config.route_time_bucket, 23 * 60 + 59)
+    return "{hours:02d}:{minutes:02d}".format(hours=minutes // 60,
+                                              minutes=minutes % 60)
+
 
 class TravelInformation:
     """
@@ -46,22 +83,175 @@ class TravelInformation:
         self.transport_id = config.transport_id
         self.transport_key = config.transport_key
 
-    def get_route_info(self):
+    def journey_url(self):
         """
-        API call to fetch route information
-        :return: If successful, return a dictionary with the request response.
-                    Otherwise, return a tuple with -1 and an error message
+        :return: The url of the journey request, at the boundary of the
+                    time's bucket (see time_bucket)
         """
-        url = "https://transportapi.com/v3/uk/public/journey/from/postcode:" \
-              "{source}/to/postcode:{destination}/{type}/{date}/{time}.json" \
-              "?app_id={id}&app_key={key}&modes={modes}&service=southeast"\
-            .format(source=self.source, destination=self.destination,
-                    type=self.type, date=self.date, time=self.time,
+        return "{base}/v3/uk/public/journey/from/postcode:" \
+               "{source}/to/postcode:{destination}/{type}/{date}/{time}" \
+               ".json?app_id={id}&app_key={key}&modes={modes}" \
+               "&service=southeast"\
+            .format(base=config.transport_url, source=self.source,
+                    destination=self.destination,
+                    type=self.type, date=self.date,
+                    time=time_bucket(self.time, self.type),
                     id=self.transport_id, key=self.transport_key,
                     modes=self.modes)
+
+    def get_route_info(self):
+        """
+        API call to fetch route information. The routes are parsed as the
+            response body arrives
+        :return: If successful, return a list of route_parser.Route objects.
+                    Otherwise, return a tuple with -1 and an error message
+        """
+        url = self.journey_url()
         try:
-            r = requests.get(url)
+            # Identical journeys requested at once share one call
+            routes = http_client.coalesce(
+                "transport", http_client.request_key("GET", url),
+                self.stream_routes, url)
+        except requests.exceptions.HTTPError:  # status_code != 200
+            return -1, "Error! Could not retrieve live info. " \
+                       "Please check your information"
+        except requests.exceptions.ConnectionError:
+            return -1, "Connection Error! Please check your network and " \
+                       "try again"
+        except requests.exceptions.Timeout:
+            return -1, "Request Timeout! Please try again"
+        except requests.exceptions.TooManyRedirects:
+            return -1, "Redirect Error! Max redirections reached"
+        except (ValueError, KeyError):
+            # Decoding failed
+            # Response is a 204 (No Content) or contains invalid JSON/routes
+            return -1, "Error! Could not retrieve live info. " \
+                       "Please check your information"
+        except requests.exceptions.RequestException:
+            return -1, "Something went wrong! Please try again"
+        else:
+            return routes
+
+    @staticmethod
+    def stream_routes(url):
+        """
+        Request a journey and parse its routes as the response body arrives
+        :param url: The full url of the journey request
+        :return: A list of route_parser.Route objects. Raises requests
+                    exceptions on failure (including HTTPError if
+                    status_code != 200), and ValueError or KeyError if the
+                    body is not a valid journey
+        """
+        with metrics.time_upstream("transport_journey"), \
+                http_client.request("transport", "GET", url,
+                                    stream=True) as r:
             r.raise_for_status()
+            # Part durations are given by the batch API. Only the first
+            # coordinate of each part is kept, for the weather along it
+            return [route_parser.Route(route, keep_duration=True) for route in
+                    route_parser.iter_routes(r.iter_content(chunk_size=16384))]
+
+    def cache_key(self):
+        """
+        Key of the route cache that the request is stored under. Requests at
+            times within the same bucket share a key, as they request the
+            same routes
+        :return: A tuple identifying the request
+        """
+        return (self.source, self.destination, self.type, self.date,
+                time_bucket(self.time, self.type), self.modes)
+
+    def format_travel_request(self, all_routes=False):
+        """
+        Fetch the formatted route information. Answered from the route cache
+            if possible. An entry that has just expired is still returned and
+            refreshed in the background
+        :param all_routes: Return every alternative route instead of the
+                        parts of the first route
+        :return: A dictionary of index to route_parser.RoutePart for each
+                    part of the first route, or a list of
+                    route_parser.Route if all_routes. If the data is an error
+                    message, the message will be forwarded
+        """
+        key = self.cache_key()
+        cached = route_cache.get_stale(key)
+        if cached is cache.MISSING:
+            routes = self.fetch_travel_request()
+        else:
+            (routes, fresh) = cached
+            if not fresh:
+                self.refresh_in_background()
+
+        if not isinstance(routes, list) or all_routes:
+            return routes
+        elif not routes:
+            return {}  # No route found
+        return dict(enumerate(routes[0].parts))
+
+    def refresh_in_background(self):
+        """
+        Refetch the route information in the background, unless a refresh of
+            the same request is already running
+        """
+        key = self.cache_key()
+        with _refreshing_lock:
+            if key in _refreshing:
+                return
+            _refreshing.add(key)
+        if background.submit(self._refresh, key) is None:
+            with _refreshing_lock:  # Queue full - a later request retries
+                _refreshing.discard(key)
+
+    def _refresh(self, key):
+        """
+        Refetch the route information and mark the refresh as finished
+        :param key: The route cache key of the request
+        """
+        try:
+            self.fetch_travel_request()
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(key)
+
+    def store_routes(self, routes):
+        """
+        Add a successful result of get_route_info to the route cache
+        :param routes: The result of get_route_info
+        :return: A list of route_parser.Route. If the data is an error
+                    message, the message will be forwarded
+        """
+        if isinstance(routes, list):
+            route_cache.set(self.cache_key(), routes)
+            return routes
+        return routes[1]  # Return error message
+
+    def fetch_travel_request(self):
+        """
+        Fetch every route from the API. A successful result is added to the
+            route cache
+        :return: A list of route_parser.Route. If the data is an error
+                    message, the message will be forwarded
+        """
+        return self.store_routes(self.get_route_info())
+
+
+class AsyncTravelInformation(TravelInformation):
+    """
+    TravelInformation whose API calls are coroutines, made with the
+    non-blocking client. Shares the route cache with TravelInformation.
+    """
+    async def get_route_info(self):
+        """
+        Coroutine version of TravelInformation.get_route_info. The routes
+            are parsed once the whole response body has arrived
+        :return: See TravelInformation.get_route_info
+        """
+        url = self.journey_url()
+        try:
+            # Identical journeys requested at once share one call
+            routes = await http_client.coalesce_async(
+                "transport", http_client.request_key("GET", url),
+                self.read_routes, url)
         except requests.exceptions.HTTPError:  # status_code != 200
             return -1, "Error! Could not retrieve live info. " \
                        "Please check your information"
@@ -72,71 +262,134 @@ class TravelInformation:
             return -1, "Request Timeout! Please try again"
         except requests.exceptions.TooManyRedirects:
             return -1, "Redirect Error! Max redirections reached"
+        except (ValueError, KeyError):
+            # Decoding failed
+            # Response is a 204 (No Content) or contains invalid JSON/routes
+            return -1, "Error! Could not retrieve live info. " \
+                       "Please check your information"
         except requests.exceptions.RequestException:
             return -1, "Something went wrong! Please try again"
         else:
-            try:
-                # Decode JSON
-                json_info = r.json()
-            except ValueError:
-                # Decoding failed
-                # Response is a 204 (No Content) or contains invalid JSON
-                return -1, "Error! Could not retrieve live info. " \
-                           "Please check your information"
+            return routes
+
+    @staticmethod
+    async def read_routes(url):
+        """
+        Request a journey and parse its routes
+        :param url: The full url of the journey request
+        :return: See TravelInformation.stream_routes
+        """
+        with metrics.time_upstream("transport_journey"):
+            r = await http_client.request_async("transport", "GET", url)
+            http_client.raise_for_status(r)
+            return [route_parser.Route(route, keep_duration=True) for route in
+                    route_parser.iter_routes([r.content])]
+
+    async def format_travel_request(self, all_routes=False):
+        """
+        Coroutine version of TravelInformation.format_travel_request
+        :param all_routes: Return every alternative route instead of the
+                        parts of the first route
+        :return: See TravelInformation.format_travel_request
+        """
+        key = self.cache_key()
+        cached = route_cache.get_stale(key)
+        if cached is cache.MISSING:
+            routes = await self.fetch_travel_request()
+        else:
+            (routes, fresh) = cached
+            if not fresh:
+                self.refresh_in_background()
+
+        if not isinstance(routes, list) or all_routes:
+            return routes
+        elif not routes:
+            return {}  # No route found
+        return dict(enumerate(routes[0].parts))
+
+    def _refresh(self, key):
+        """
+        Refetch the route information on a background thread, with the
+            blocking client, and mark the refresh as finished
+        :param key: The route cache key of the request
+        """
+        try:
+            self.store_routes(TravelInformation.get_route_info(self))
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(key)
+
+    async def fetch_travel_request(self):
+        """
+        Coroutine version of TravelInformation.fetch_travel_request
+        :return: See TravelInformation.fetch_travel_request
+        """
+        return self.store_routes(await self.get_route_info())
+
+
+class RouteResults:
+    """
+    The routes of a request for the route results page. They are only
+    fetched when first iterated, so that a streamed page can be sent before
+    the routes are available. The fetch keeps to the deadline budget of the
+    request that created the results.
+    """
+    def __init__(self, travel_obj, with_weather=False):
+        """
+        Constructor for the results
+        :param travel_obj: The TravelInformation of the request
+        :param with_weather: Also fetch the weather along the routes
+        """
+        self.travel_obj = travel_obj
+        self.with_weather = with_weather
+        self.budget = deadline.current()
+        self.routes = None
+        self.part_weather = None
+        self.error = None
+
+    def fetch(self):
+        """
+        Fetch the routes (and their weather), unless already fetched
+        :return: A list of route_parser.Route, empty if the routes couldn't
+                    be fetched (the message is in error)
+        """
+        if self.routes is None and self.error is None:
+            with deadline.within(self.budget):
+                route_info = self.travel_obj.format_travel_request(
+                    all_routes=True)
+                if isinstance(route_info, list) and self.with_weather:
+                    self.part_weather = weather_logic.route_weather(
+                        route_info)
+            if isinstance(route_info, list):
+                self.routes = route_info
             else:
-                return json_info
-
-    def format_travel_request(self):
-        """
-        Samples useful information from api request and formats it correctly.
-        This allows each dictionary key to be on a new line and each value
-                    (containing a dictionary) to be the columns
-        :return: The formatted dictionary. If the data is an error message,
-                    the message will be forwarded
-        """
-        request_data = self.get_route_info()
-
-        # Sanitise if the data is a dictionary
-        if isinstance(request_data, dict):
-            sanitised_dict = {}
-            length = len(request_data["routes"][0]["route_parts"])
-
-            # Each part of the route (i.e bus, then walking)
-            for i in range(0, length):
-                temp_dict = {}
-
-                # Place mode as first element
-                for key, r_value in request_data["routes"][0]["route_parts"][
-                                i].items():
-                    if key == "mode":
-                        temp_dict[key] = r_value
-
-                # Add "line_name" as second element
-                for key, r_value in request_data["routes"][0]["route_parts"][
-                                i].items():
-                    if key == "line_name":
-                        key = "line"
-                        if r_value == "":
-                            r_value = "-"
-                        temp_dict[key] = r_value
-
-                for key, r_value in request_data["routes"][0]["route_parts"][
-                        i].items():  # Add each route element
-                    # Removed from final dict
-                    if key not in ["destination", "duration", "coordinates",
-                                   "line_name", "mode"]:
-                        # Formatting
-                        if key == "from_point_name":
-                            key = "from"
-                        elif key == "to_point_name":
-                            key = "to"
-                        elif key == "departure_time":
-                            key = "departing"
-                        elif key == "arrival_time":
-                            key = "arriving"
-
-                        temp_dict[key] = r_value
-
-                sanitised_dict[i] = temp_dict
-            return sanitised_dict
-        return request_data[1]  # Return error message
+                self.error = route_info
+                metrics.error_messages.inc(template="route-results.html")
+        return self.routes or []
+
+    async def fetch_async(self):
+        """
+        Coroutine version of fetch, for an AsyncTravelInformation
+        :return: See fetch
+        """
+        if self.routes is None and self.error is None:
+            with deadline.within(self.budget):
+                route_info = await self.travel_obj.format_travel_request(
+                    all_routes=True)
+                if isinstance(route_info, list) and self.with_weather:
+                    self.part_weather = \
+                        await weather_logic.route_weather_async(route_info)
+            if isinstance(route_info, list):
+                self.routes = route_info
+            else:
+                self.error = route_info
+                metrics.error_messages.inc(template="route-results.html")
+        return self.routes or []
+
+    def __iter__(self):
+        return iter(self.fetch())
+
+    async def __aiter__(self):
+        # Iterated by a template of the async environment
+        for route in await self.fetch_async():
+            yield route
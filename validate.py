@@ -6,43 +6,65 @@ Date: 05/2019
 
 # Import packages
 import datetime as dt
-import requests
+import postcode_logic
+import utils
 
 
 def is_valid_postcode(location_str):
     """
     Check whether the input postcode exists
     :param location_str: The postcode as a string (format irrelevant)
-    :return: Value of type: boolean on whether the postcode exists
+    :return: Value of type: boolean on whether the postcode exists.
+                Otherwise, return a tuple with -1 and an error message
     """
-    url = "https://api.postcodes.io/postcodes/{postcode}/validate"\
-        .format(postcode=location_str)
+    coords = postcode_logic.resolve_postcode(location_str)
+    if coords is None:
+        return False
+    elif coords[0] == -1:
+        return coords  # Return error tuple
+    return True
 
-    try:
-        r = requests.get(url)
-        r.raise_for_status()
-    except requests.exceptions.HTTPError:  # status_code != 200
-        return -1, "Error! Could not retrieve live info. " \
-                   "Please check your information"
-    except requests.exceptions.ConnectionError:
-        return -1, "Connection Error! Please check your network and " \
-                   "try again"
-    except requests.exceptions.Timeout:
-        return -1, "Request Timeout! Please try again"
-    except requests.exceptions.TooManyRedirects:
-        return -1, "Redirect Error! Max redirections reached"
-    except requests.exceptions.RequestException:
-        return -1, "Something went wrong! Please try again"
-    else:
-        try:
-            # Decode JSON
-            json_info = r.json()
-        except ValueError:
-            # Decoding failed
-            # Response is a 204 (No Content) or contains invalid JSON
-            return -1, "Error! Couldn't process postcode data"
-        else:
-            return json_info["result"]
+
+def are_valid_postcodes(location_list):
+    """
+    Check whether each of the input postcodes exists, using a single lookup
+        for all of them
+    :param location_list: List of postcodes as strings (format irrelevant)
+    :return: List of booleans on whether each postcode exists, in the order
+                given. Otherwise, return a tuple with -1 and an error message
+    """
+    resolved = postcode_logic.resolve_postcodes(location_list)
+    if isinstance(resolved, tuple):
+        return resolved  # Return error tuple
+    return [resolved.get(utils.format_pc(location)) is not None
+            for location in location_list]
+
+
+async def is_valid_postcode_async(location_str):
+    """
+    Coroutine version of is_valid_postcode
+    :param location_str: The postcode as a string (format irrelevant)
+    :return: See is_valid_postcode
+    """
+    coords = await postcode_logic.resolve_postcode_async(location_str)
+    if coords is None:
+        return False
+    elif coords[0] == -1:
+        return coords  # Return error tuple
+    return True
+
+
+async def are_valid_postcodes_async(location_list):
+    """
+    Coroutine version of are_valid_postcodes
+    :param location_list: List of postcodes as strings (format irrelevant)
+    :return: See are_valid_postcodes
+    """
+    resolved = await postcode_logic.resolve_postcodes_async(location_list)
+    if isinstance(resolved, tuple):
+        return resolved  # Return error tuple
+    return [resolved.get(utils.format_pc(location)) is not None
+            for location in location_list]
 
 
 def is_valid_date(date_str):
@@ -6,10 +6,265 @@ Date: 05/2019
 """
 
 # Import packages
+from concurrent.futures import ThreadPoolExecutor, wait, \
+    TimeoutError as FutureTimeoutError
+import asyncio
+import threading
 import requests
+import background
+import cache
+import deadline
+import http_client
+import metrics
+import postcode_logic
+import rate_limit
 import utils
 import config
 
+# Grid cell: weather information
+weather_cache = cache.TTLCache(max_size=config.weather_cache_size,
+                               ttl=config.weather_cache_ttl)
+metrics.register_cache("weather", weather_cache)
+_cell_fetches = cache.SingleFlight()
+# Formatted postcode: Future of a weather fetch started by prefetch
+_prefetched = cache.TTLCache(max_size=config.weather_cache_size,
+                             ttl=config.weather_prefetch_ttl)
+# Fetches the cells along routes, bounding their concurrency
+_route_executor = ThreadPoolExecutor(
+    max_workers=config.route_weather_workers,
+    thread_name_prefix="route-weather")
+# Limits the cell fetches that are queued or running at once
+_route_slots = threading.BoundedSemaphore(config.route_weather_queue_size)
+
+
+def grid_cell(lat, lon):
+    """
+    Find the grid cell containing a location. Weather is shared by every
+        location in a cell
+    :param lat: Latitude of the location
+    :param lon: Longitude of the location
+    :return: A tuple identifying the cell
+    """
+    resolution = config.weather_grid_resolution
+    return round(lat / resolution), round(lon / resolution)
+
+
+def cell_centre(cell):
+    """
+    Find the coordinates at the centre of a grid cell
+    :param cell: The grid cell, as returned by grid_cell
+    :return: A tuple containing the latitude and longitude
+    """
+    resolution = config.weather_grid_resolution
+    return round(cell[0] * resolution, 6), round(cell[1] * resolution, 6)
+
+
+def _if_quota_allows(function, *args):
+    """
+    Call a function whose upstream calls are optional. They are skipped
+        rather than queued if the API's quota doesn't allow them right now
+    :param function: The function to call
+    :return: The result of the function
+    """
+    with rate_limit.priority(rate_limit.BACKGROUND, max_wait=0):
+        return function(*args)
+
+
+def prefetch_weather_info(destination_pc):
+    """
+    Start fetching the weather of a postcode in the background, so that it is
+        ready (or in flight) when get_weather_info is called for it
+    :param destination_pc: Postcode location (format doesn't matter)
+    """
+    weather_obj = WeatherInformation(destination_pc)
+    if _prefetched.get(weather_obj.destination) is not cache.MISSING:
+        return  # Already prefetched
+    future = background.submit(_if_quota_allows,
+                               weather_obj.fetch_weather_info)
+    if future is not None:
+        _prefetched.set(weather_obj.destination, future)
+
+
+def cell_weather(cell):
+    """
+    Fetch weather information at the centre of a grid cell. Answered from
+        the weather cache if the cell was fetched recently, and concurrent
+        fetches of a cell are coalesced into one API call
+    :param cell: The grid cell, as returned by grid_cell
+    :return: If successful, return a dictionary with the request response.
+                Otherwise, return a tuple with -1 and an error message
+    """
+    info_dic = weather_cache.get(cell)
+    if info_dic is cache.MISSING:
+        info_dic = _cell_fetches.do(
+            cell, WeatherInformation.fetch_cell_weather, cell)
+    return info_dic
+
+
+async def cell_weather_async(cell):
+    """
+    Coroutine version of cell_weather. Concurrent fetches of a cell on the
+        event loop are coalesced into one API call
+    :param cell: The grid cell, as returned by grid_cell
+    :return: See cell_weather
+    """
+    info_dic = weather_cache.get(cell)
+    if info_dic is cache.MISSING:
+        info_dic = await AsyncWeatherInformation.fetch_cell_weather(cell)
+    return info_dic
+
+
+def _submit_cell(cell):
+    """
+    Fetch the weather of a cell on the route executor, unless its queue is
+        full (the part is then shown without weather)
+    :param cell: The grid cell, as returned by grid_cell
+    :return: A Future of the weather information, or None if the fetch was
+                dropped
+    """
+    if not _route_slots.acquire(blocking=False):
+        return None
+    try:
+        future = _route_executor.submit(_if_quota_allows, cell_weather, cell)
+    except RuntimeError:  # Executor has been shut down
+        _route_slots.release()
+        return None
+    # Released once the fetch finishes or is cancelled
+    future.add_done_callback(lambda _: _route_slots.release())
+    return future
+
+
+def _route_cells(routes):
+    """
+    Find the grid cell where each part of the routes starts, and the
+        weather of the distinct cells that are cached
+    :param routes: List of route_parser.Route objects
+    :return: A tuple containing a list of the cell (or None) of each part
+                for each route, a dictionary of cell to cached weather and
+                the list of cells needing a fetch, at most
+                route_weather_max_cells
+    """
+    cells = [[grid_cell(*part.start()) if part.start() else None
+              for part in route.parts] for route in routes]
+    weather = {}
+    missing = []
+    for cell in dict.fromkeys(cell for row in cells for cell in row
+                              if cell is not None):
+        info_dic = weather_cache.get(cell)
+        if info_dic is cache.MISSING:
+            missing.append(cell)
+        else:
+            weather[cell] = info_dic
+    return cells, weather, missing[:config.route_weather_max_cells]
+
+
+def _route_weather_timeout():
+    """
+    :return: Seconds to wait for the weather along routes, limited by the
+                deadline budget of the page request
+    """
+    timeout = config.route_weather_timeout
+    left = deadline.remaining()
+    if left is not None:
+        timeout = max(min(timeout, left), 0)
+    return timeout
+
+
+def _prefetch_timeout():
+    """
+    :return: Seconds to wait for a prefetch still running, i.e. what is left
+                of the deadline budget of the page request (None if it has
+                none)
+    """
+    left = deadline.remaining()
+    if left is not None:
+        left = max(left, 0)
+    return left
+
+
+def _part_weather(cells, weather):
+    """
+    :return: A list for each route with the weather information dictionary
+                of each part, or None where it is unavailable
+    """
+    return [[weather.get(cell) if isinstance(weather.get(cell), dict)
+             else None for cell in row] for row in cells]
+
+
+def route_weather(routes):
+    """
+    Fetch the weather where each part of the routes starts. The parts are
+        collapsed into distinct grid cells, and the cells that aren't cached
+        are fetched concurrently, if the weather API's quota and the fetch
+        queue allow. Cells still being fetched when the wait ends have no
+        weather (they are cached once fetched)
+    :param routes: List of route_parser.Route objects
+    :return: A list for each route with the weather information dictionary
+                of each part, or None where it is unavailable
+    """
+    (cells, weather, missing) = _route_cells(routes)
+    futures = {}
+    for cell in missing:
+        future = _submit_cell(cell)
+        if future is not None:
+            futures[future] = cell
+    if futures:
+        (done, _) = wait(futures, timeout=_route_weather_timeout())
+        for future in done:
+            weather[futures[future]] = future.result()
+    return _part_weather(cells, weather)
+
+
+async def route_weather_async(routes):
+    """
+    Coroutine version of route_weather. The cells are fetched on the event
+        loop instead of by a pool of threads
+    :param routes: List of route_parser.Route objects
+    :return: See route_weather
+    """
+    (cells, weather, missing) = _route_cells(routes)
+    if missing:
+        # Tasks copy the priority, so the fetches are skipped rather than
+        # queued if the quota doesn't allow them
+        with rate_limit.priority(rate_limit.BACKGROUND, max_wait=0):
+            tasks = {asyncio.ensure_future(cell_weather_async(cell)): cell
+                     for cell in missing}
+        (done, _) = await asyncio.wait(tasks,
+                                       timeout=_route_weather_timeout())
+        for task in done:
+            weather[tasks[task]] = task.result()
+    return _part_weather(cells, weather)
+
+
+def cell_url(cell):
+    """
+    :param cell: The grid cell, as returned by grid_cell
+    :return: The url of the weather request at the centre of the cell
+    """
+    (lat, lon) = cell_centre(cell)
+    return "{base}/data/2.5/weather?lat={lat}&lon={lon}&appid={app_id}"\
+        .format(base=config.weather_url, lat=lat, lon=lon,
+                app_id=config.weather_key)
+
+
+def _cell_info(cell, json_info):
+    """
+    Extract the weather information of a cell from the API response and
+        add it to the weather cache
+    :param cell: The grid cell, as returned by grid_cell
+    :param json_info: The decoded API response
+    :return: The weather information dictionary
+    """
+    info_dic = {
+        "name": json_info["name"],
+        "weather": json_info["weather"][0]["main"],
+        "image": "http://openweathermap.org/img/w/" +
+                 json_info["weather"][0]["icon"] + ".png",
+        "temp": "%.1f" % (json_info["main"]["temp"]-273.15)
+    }
+    weather_cache.set(cell, info_dic)
+    return info_dic
+
 
 class WeatherInformation:
     """
@@ -23,20 +278,33 @@ class WeatherInformation:
         :param destination_pc: Ending postcode location (format doesn't matter)
         """
         self.destination = utils.format_pc(destination_pc)
-        self.weather_key = config.weather_key
 
     def postcode_to_coordinates(self):
         """
-        API call to fetch coordinates from destination postcode
+        Fetch coordinates from destination postcode, shared with the postcode
+            validation cache
         :return: If successful, return a tuple containing coordinates.
                     Otherwise, return a tuple with -1 and an error message
         """
-        url = "https://api.postcodes.io/postcodes/{postcode}" \
-            .format(postcode=self.destination)
+        coords = postcode_logic.resolve_postcode(self.destination)
+        # Postcode does not exist, or has no coordinates
+        if coords is None or None in coords:
+            return -1, "Error! Could not retrieve live info. " \
+                       "Please check your information"
+        return coords
 
+    @staticmethod
+    def fetch_cell_weather(cell):
+        """
+        API call to fetch weather information at the centre of a grid cell.
+            A successful result is added to the weather cache
+        :param cell: The grid cell, as returned by grid_cell
+        :return: If successful, return a dictionary with the request response.
+                    Otherwise, return a tuple with -1 and an error message
+        """
         try:
-            r = requests.get(url)
-            r.raise_for_status()
+            json_info = http_client.get_json("weather", cell_url(cell),
+                                             operation="openweather")
         except requests.exceptions.HTTPError:  # status_code != 200
             return -1, "Error! Could not retrieve live info. " \
                        "Please check your information"
@@ -47,65 +315,129 @@ class WeatherInformation:
             return -1, "Request Timeout! Please try again"
         except requests.exceptions.TooManyRedirects:
             return -1, "Redirect Error! Max redirections reached"
+        except ValueError:
+            # Decoding failed
+            # Response is a 204 (No Content)/contains invalid JSON
+            return -1, "Error! Could not retrieve live info. " \
+                       "Please check your information"
         except requests.exceptions.RequestException:
             return -1, "Something went wrong! Please try again"
         else:
-            try:
-                # Decode JSON
-                json_info = r.json()
-            except ValueError:
-                # Decoding failed
-                # Response is a 204 (No Content) or contains invalid JSON
-                return -1, "Error! Couldn't process postcode data"
-            else:
-                lon = json_info["result"]["longitude"]
-                lat = json_info["result"]["latitude"]
-                return lat, lon
+            return _cell_info(cell, json_info)
 
     def get_weather_info(self):
         """
-        API call to fetch weather information
+        Fetch weather information for the destination. Picks up the result
+            of prefetch_weather_info if one was started, and fetches it again
+            if the prefetch failed or doesn't finish within the deadline
+            budget
+        :return: If successful, return a dictionary with the request response.
+                    Otherwise, return a tuple with -1 and an error message
+        """
+        future = _prefetched.get(self.destination)
+        if future is not cache.MISSING:
+            _prefetched.delete(self.destination)
+            # Still queued behind other background work - fetch it here
+            if not future.cancel():
+                try:
+                    info_dic = future.result(timeout=_prefetch_timeout())
+                except FutureTimeoutError:
+                    info_dic = None
+                if isinstance(info_dic, dict):
+                    return info_dic
+        return self.fetch_weather_info()
+
+    def fetch_weather_info(self):
+        """
+        Fetch weather information for the destination. Shared by every
+            postcode in the same grid cell (see cell_weather)
         :return: If successful, return a dictionary with the request response.
                     Otherwise, return a tuple with -1 and an error message
         """
         coords = self.postcode_to_coordinates()
         if coords[0] != -1:
-            (lat, lon) = coords
-            url = "http://api.openweathermap.org/data/2.5/weather?lat={lat}&" \
-                  "lon={lon}&appid={app_id}".format(lat=lat, lon=lon,
-                                                    app_id=self.weather_key)
-            try:
-                r = requests.get(url)
-                r.raise_for_status()
-            except requests.exceptions.HTTPError:  # status_code != 200
-                return -1, "Error! Could not retrieve live info. " \
-                           "Please check your information"
-            except requests.exceptions.ConnectionError:
-                return -1, "Connection Error! Please check your network and " \
-                           "try again"
-            except requests.exceptions.Timeout:
-                return -1, "Request Timeout! Please try again"
-            except requests.exceptions.TooManyRedirects:
-                return -1, "Redirect Error! Max redirections reached"
-            except requests.exceptions.RequestException:
-                return -1, "Something went wrong! Please try again"
-            else:
+            return cell_weather(grid_cell(*coords))
+        else:
+            return coords[1]  # Return error message
+
+
+class AsyncWeatherInformation(WeatherInformation):
+    """
+    WeatherInformation whose API calls are coroutines, made with the
+    non-blocking client. Shares the weather cache with WeatherInformation.
+    """
+    async def postcode_to_coordinates(self):
+        """
+        Coroutine version of WeatherInformation.postcode_to_coordinates
+        :return: See WeatherInformation.postcode_to_coordinates
+        """
+        coords = await postcode_logic.resolve_postcode_async(
+            self.destination)
+        # Postcode does not exist, or has no coordinates
+        if coords is None or None in coords:
+            return -1, "Error! Could not retrieve live info. " \
+                       "Please check your information"
+        return coords
+
+    @staticmethod
+    async def fetch_cell_weather(cell):
+        """
+        Coroutine version of WeatherInformation.fetch_cell_weather
+        :param cell: The grid cell, as returned by grid_cell
+        :return: See WeatherInformation.fetch_cell_weather
+        """
+        try:
+            json_info = await http_client.get_json_async(
+                "weather", cell_url(cell), operation="openweather")
+        except requests.exceptions.HTTPError:  # status_code != 200
+            return -1, "Error! Could not retrieve live info. " \
+                       "Please check your information"
+        except requests.exceptions.ConnectionError:
+            return -1, "Connection Error! Please check your network and " \
+                       "try again"
+        except requests.exceptions.Timeout:
+            return -1, "Request Timeout! Please try again"
+        except requests.exceptions.TooManyRedirects:
+            return -1, "Redirect Error! Max redirections reached"
+        except ValueError:
+            # Decoding failed
+            # Response is a 204 (No Content)/contains invalid JSON
+            return -1, "Error! Could not retrieve live info. " \
+                       "Please check your information"
+        except requests.exceptions.RequestException:
+            return -1, "Something went wrong! Please try again"
+        else:
+            return _cell_info(cell, json_info)
+
+    async def get_weather_info(self):
+        """
+        Coroutine version of WeatherInformation.get_weather_info. A prefetch
+            still running is awaited without holding a thread, for at most
+            the rest of the deadline budget
+        :return: See WeatherInformation.get_weather_info
+        """
+        future = _prefetched.get(self.destination)
+        if future is not cache.MISSING:
+            _prefetched.delete(self.destination)
+            # Still queued behind other background work - fetch it here
+            if not future.cancel():
                 try:
-                    # Decode JSON
-                    json_info = r.json()
-                except ValueError:
-                    # Decoding failed
-                    # Response is a 204 (No Content)/contains invalid JSON
-                    return -1, "Error! Could not retrieve live info. " \
-                               "Please check your information"
-                else:
-                    info_dic = {
-                        "name": json_info["name"],
-                        "weather": json_info["weather"][0]["main"],
-                        "image": "http://openweathermap.org/img/w/" +
-                                 json_info["weather"][0]["icon"] + ".png",
-                        "temp": "%.1f" % (json_info["main"]["temp"]-273.15)
-                    }
+                    info_dic = await asyncio.wait_for(
+                        asyncio.shield(asyncio.wrap_future(future)),
+                        _prefetch_timeout())
+                except asyncio.TimeoutError:
+                    info_dic = None
+                if isinstance(info_dic, dict):
                     return info_dic
+        return await self.fetch_weather_info()
+
+    async def fetch_weather_info(self):
+        """
+        Coroutine version of WeatherInformation.fetch_weather_info
+        :return: See WeatherInformation.fetch_weather_info
+        """
+        coords = await self.postcode_to_coordinates()
+        if coords[0] != -1:
+            return await cell_weather_async(grid_cell(*coords))
         else:
             return coords[1]  # Return error message